@@ -1,41 +1,163 @@
-import bcrypt
-from fastapi import FastAPI, Request, Depends, Form, HTTPException
-from fastapi.responses import HTMLResponse, RedirectResponse
+import logging
+import os
+from typing import Optional
+
+from fastapi import FastAPI, Request, Depends, Form, HTTPException, Header
+from fastapi.responses import HTMLResponse, RedirectResponse, PlainTextResponse
 from fastapi.templating import Jinja2Templates
-from fastapi.staticfiles import StaticFiles
 
 from sqlalchemy.orm import Session
-from sqlalchemy.orm import aliased
 
 from sqlalchemy import text
 
 
-from database.connection import engine
+from database.connection import engine, read_engine, async_engine, async_read_engine, SessionLocal, pool_stats
+from database.migrations import ensure_indexes
 from database.models import Base
 from database.models import Message, MessageRecipient, User
-from database.deps import get_db
+from database.deps import get_db, get_read_db, get_async_db, DbRunner
 
 
-from routes.auth import verify_password, get_password_hash, create_access_token, verify_token
+from routes.auth import get_password_hash, create_access_token, verify_token, Principal, principal_cache
 
 
 from routes.users import router as users_router
-from routes.messages import router as messages_router
+from routes.messages import router as messages_router, message_log_page
 from routes.admin_messaging import router as admin_messaging_router
-
+from routes.acks import router as acks_router
+from routes.fog import router as fog_router
+from routes.search import router as search_router
+from routes.exports import router as exports_router
+
+from services import delivery_counters, fog_sync
+from services.passwords import password_hasher
+from services.metrics import MetricsMiddleware, instrument_engine, render_metrics
+from services.structured_logging import configure_logging
+from services.dispatch import DISPATCH_ENABLED, dispatcher
+from services.acks import ack_buffer
+from services.telemetry import telemetry
+from services.retention import RETENTION_ENABLED, retention_job
+from services.stats import live_stats
+from services.search import search_index
+from services.user_import import user_importer
+from services.assets import AssetFiles, asset_manifest, register as register_asset_helpers
+
+
+configure_logging()
+logger = logging.getLogger("hopfog")
+
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+instrument_engine(engine, "write")
+if read_engine is not engine:
+    instrument_engine(read_engine, "read")
+if async_engine is not None:
+    instrument_engine(async_engine.sync_engine, "async_write")
+    if async_read_engine is not async_engine:
+        instrument_engine(async_read_engine.sync_engine, "async_read")
 
 app = FastAPI()
+app.add_middleware(MetricsMiddleware)
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/static", AssetFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
+register_asset_helpers(templates)
+
+DASHBOARD_RECENT_MESSAGES = 20
 
 app.include_router(users_router)
 app.include_router(messages_router)
 app.include_router(admin_messaging_router)
+app.include_router(acks_router)
+app.include_router(fog_router)
+app.include_router(search_router)
+app.include_router(exports_router)
 
 @app.on_event("startup")
 def on_startup():
+    asset_manifest.ensure_built()
     Base.metadata.create_all(bind=engine)
+    ensure_indexes(engine)
+    search_index.install(engine)
+
+    # Databases created before delivery counters existed get them computed once here.
+    db = SessionLocal()
+    try:
+        delivery_counters.backfill_missing(db)
+        fog_sync.backfill_changes(db)
+        db.commit()
+        telemetry.load(db)
+        live_stats.reconcile(db)
+    finally:
+        db.close()
+
+@app.on_event("startup")
+def calibrate_password_hashing():
+    password_hasher.calibrate()
+
+@app.on_event("startup")
+async def start_dispatcher():
+    if DISPATCH_ENABLED:
+        dispatcher.start()
+
+@app.on_event("startup")
+async def start_ack_buffer():
+    ack_buffer.start()
+
+@app.on_event("startup")
+async def start_telemetry():
+    telemetry.start()
+
+@app.on_event("startup")
+async def start_stats_reconciliation():
+    live_stats.start()
+
+@app.on_event("startup")
+async def start_retention():
+    if RETENTION_ENABLED:
+        retention_job.start()
+
+@app.on_event("shutdown")
+async def stop_dispatcher():
+    await dispatcher.stop()
+
+@app.on_event("shutdown")
+async def stop_ack_buffer():
+    await ack_buffer.stop()
+
+@app.on_event("shutdown")
+async def stop_telemetry():
+    await telemetry.stop()
+
+@app.on_event("shutdown")
+async def stop_retention():
+    await retention_job.stop()
+
+@app.on_event("shutdown")
+async def stop_stats_reconciliation():
+    await live_stats.stop()
+
+@app.on_event("shutdown")
+def stop_password_hashing():
+    password_hasher.shutdown()
+    user_importer.shutdown()
+
+def _user_by_email(db: Session, email: str) -> Optional[User]:
+    return db.query(User).filter(User.email == email).first()
+
+def _set_password_hash(db: Session, user_id: int, password_hash: str) -> None:
+    db.query(User).filter(User.id == user_id).update({"password_hash": password_hash}, synchronize_session=False)
+    db.commit()
+
+async def _upgrade_password_hash(db: DbRunner, user: User, password: str) -> None:
+    """Rehash with the current work factor after a successful login, if it differs."""
+    if not password_hasher.needs_rehash(user.password_hash):
+        return
+    try:
+        new_hash = await password_hasher.hash(password)
+    except HTTPException:
+        return  # pool is busy; try again on a later login
+    await db.run(_set_password_hash, user.id, new_hash)
 
 @app.get("/", response_class=HTMLResponse)
 def login_page(request: Request):
@@ -46,54 +168,38 @@ async def login(
     request: Request,
     email: str = Form(...),
     password: str = Form(...),
-    db: Session = Depends(get_db)
+    db: DbRunner = Depends(get_async_db)
 ):
-    print(f"\n=== LOGIN ATTEMPT ===")
-    print(f"Email: {email}")
-    print(f"Password entered: '{password}'")
-    print(f"Password length: {len(password)} chars, {len(password.encode('utf-8'))} bytes")
-    
-    user = db.query(User).filter(User.email == email).first()
+    user = await db.run(_user_by_email, email)
     
     if not user:
-        print(f"User not found!")
+        logger.info("web login failed", extra={"email": email, "reason": "unknown_user"})
         return templates.TemplateResponse("login.html", {
             "request": request,
             "error": "Invalid email or password"
         })    
-    print(f"User found: {user.username}")
-    print(f"Stored hash: {user.password_hash}")
-    print(f"Hash type: {type(user.password_hash)}")
 
     if user.role != "admin":
-        print(f"User is not an admin, role: {user.role}")
+        logger.info("web login refused", extra={"email": email, "reason": "not_admin", "role": user.role})
         return templates.TemplateResponse("login.html", {
             "request": request,
             "error": "This account is not authorized for web access. Please use the mobile app."
         })
     
-    # Manual verification test
     try:
-        password_bytes = password.encode('utf-8')
-        hash_bytes = user.password_hash.encode('utf-8')
-        
-        print(f"Password bytes: {password_bytes}")
-        print(f"Hash bytes length: {len(hash_bytes)}")
-        
-        result = bcrypt.checkpw(password_bytes, hash_bytes)
-        print(f"bcrypt.checkpw result: {result}")
-        
-        if not result:
-            print(f"Password verification FAILED")
-            raise HTTPException(status_code=401, detail="Invalid email or password")
-            
-    except Exception as e:
-        print(f"Exception during verification: {type(e).__name__}: {e}")
-        import traceback
-        traceback.print_exc()
+        result = await password_hasher.verify(password, user.password_hash)
+    except HTTPException:
+        raise
+    except Exception:
+        logger.exception("password verification error", extra={"email": email})
+        raise HTTPException(status_code=401, detail="Invalid email or password")
+
+    if not result:
+        logger.info("web login failed", extra={"email": email, "reason": "bad_password"})
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
-    print(f"Login successful!")
+    logger.info("web login succeeded", extra={"email": email, "user_id": user.id})
+    await _upgrade_password_hash(db, user, password)
     
     token = create_access_token(data={"sub": user.email})
     response = RedirectResponse(url="/dashboard", status_code=302)
@@ -145,87 +251,61 @@ def register(
     return RedirectResponse(url="/?registered=true", status_code=302)
 
 @app.get("/dashboard", response_class=HTMLResponse)
-def dashboard(request: Request, db: Session = Depends(get_db), current_user: User= Depends(verify_token)):
-    Sender = aliased(User)
-
-    fog_nodes_count = 2  # Replace with actual count from your data source
-    people_connected = 5  # Replace with actual count
-    storage_used = "7.8GB"  
-
-
-    # Query messages with sender and recipients
-    messages_query = db.query(
-        Message.id,
-        Message.body,
-        Message.created_at,
-        Sender.username.label('sender_username')
-    ).join(Sender, Message.sender_id == Sender.id).all()
-    
-    # Format messages for template
-    messages = []
-    for msg in messages_query:
-        # Get recipients for this message
-        recipients = db.query(User.username).join(
-            MessageRecipient, User.id == MessageRecipient.user_id
-        ).filter(MessageRecipient.message_id == msg.id).all()
-        
-        messages.append({
-            'id': msg.id,
-            'from': msg.sender_username,
-            'to': [r.username for r in recipients],
-            'message': msg.body,
-            'date': msg.created_at
-        })
+def dashboard(request: Request, db: Session = Depends(get_db), current_user: Principal = Depends(verify_token)):
+    # Live figures from memory: fog node heartbeats (online nodes only) and write-path counters.
+    stats = live_stats.snapshot()
+    fog_nodes_count = stats["fog"]["online"]
+    people_connected = stats["fog"]["people_connected"]
+    storage_used = stats["fog"]["storage_used"]
+    by_type = stats["broadcasts_by_type"]
+    sos_alerts = by_type.get("sos", 0) + by_type.get("alert", 0)
+
+    # Only the most recent window; the full history lives behind /logs.
+    messages = message_log_page(db, limit=DASHBOARD_RECENT_MESSAGES)["items"]
 
-        
-    
     return templates.TemplateResponse("dashboard.html", {
         "request": request,
         "messages": messages,
         "current_user": current_user,
         "fog_nodes_count": fog_nodes_count,
         "people_connected": people_connected,
-        "storage_used": storage_used
+        "storage_used": storage_used,
+        "sos_alerts": sos_alerts,
+        "stats": stats,
     })
     
 @app.get("/users", response_class=HTMLResponse)
-def users(request: Request, db: Session = Depends(get_db), current_user: User = Depends(verify_token)):
-    users_list = db.query(User).all()
-
+def users(request: Request, current_user: Principal = Depends(verify_token)):
+    # Rows are fetched a page at a time from /api/users/page.
     return templates.TemplateResponse("user.html", {
         "request": request,
-        "users": users_list,
         "current_user": current_user
     })
 
 @app.get("/logs", response_class=HTMLResponse)
-def logs(request: Request, db: Session = Depends(get_db), current_user: User = Depends(verify_token)):
-    Sender = aliased(User)
-    
-    messages_query = db.query(
-        Message.id,
-        Message.body,
-        Message.created_at,
-        Sender.username.label('sender_username')
-    ).join(Sender, Message.sender_id == Sender.id).all()
-    
-    messages = []
-    for msg in messages_query:
-        recipients = db.query(User.username).join(
-            MessageRecipient, User.id == MessageRecipient.user_id
-        ).filter(MessageRecipient.message_id == msg.id).all()
-        
-        messages.append({
-            'id': msg.id,
-            'from': msg.sender_username,
-            'to': [r.username for r in recipients],
-            'message': msg.body,
-            'date': msg.created_at
+def logs(request: Request, cursor: Optional[str] = None, q: Optional[str] = None, db: Session = Depends(get_read_db), current_user: Principal = Depends(verify_token)):
+    if q:
+        # Full-text search over message bodies instead of the chronological log.
+        try:
+            results = search_index.search(db, q, kinds=["message"], cursor=cursor)
+            error = None
+        except HTTPException as exc:
+            results, error = {"items": [], "next_cursor": None}, exc.detail
+        return templates.TemplateResponse("logs.html", {
+            "request": request,
+            "q": q,
+            "results": results["items"],
+            "next_cursor": results["next_cursor"],
+            "search_error": error,
+            "current_user": current_user
         })
+
+    page = message_log_page(db, cursor=cursor)
     
     return templates.TemplateResponse("logs.html", {
         "request": request,
-        "messages": messages,
+        "messages": page["items"],
+        "next_cursor": page["next_cursor"],
         "current_user": current_user
     })
 
@@ -240,16 +320,33 @@ def logs(request: Request, db: Session = Depends(get_db), current_user: User = D
 
 @app.delete("/api/messages/{message_id}")
 def delete_message(message_id: int, db: Session = Depends(get_db)):
-    db.query(MessageRecipient).filter(MessageRecipient.message_id == message_id).delete()
-    
-    # Delete the message
-    message = db.query(Message).filter(Message.id == message_id).first()
-    if message:
-        db.delete(message)
-        db.commit()
+    # Two set-based DELETEs in one transaction; nothing is loaded into the session.
+    db.query(MessageRecipient).filter(MessageRecipient.message_id == message_id).delete(synchronize_session=False)
+    deleted = db.query(Message).filter(Message.id == message_id).delete(synchronize_session=False)
+    db.commit()
+    if deleted:
         return {"message": "Message deleted successfully"}
     return {"error": "Message not found"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics(authorization: Optional[str] = Header(None)):
+    # Prometheus scrape endpoint; protected by a bearer token when METRICS_TOKEN is set.
+    if METRICS_TOKEN and authorization != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/admin/db-stats")
+def db_stats(current_user: Principal = Depends(verify_token)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can view database statistics")
+    return pool_stats()
+
+@app.get("/api/admin/stats")
+def live_statistics(current_user: Principal = Depends(verify_token)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can view statistics")
+    return live_stats.snapshot()
+
 # @app.get("/debug/users")
 # def debug_users(db: Session = Depends(get_db)):
 #     users = db.query(User).all()
@@ -262,41 +359,23 @@ def delete_message(message_id: int, db: Session = Depends(get_db)):
 
 
 @app.get("/fog_nodes", response_class=HTMLResponse)
-def fog_nodes(request: Request, db: Session = Depends(get_db), current_user: User = Depends(verify_token)):
-    # This is for connection when the technology is created
-    # For now this is for mock data
-    fog_nodes_data = [
-        {
-            'id': 1,
-            'name': 'Fog_1',
-            'people_connected': 2,
-            'storage_used': '3.9GB',
-            'storage_free': 'free',
-            'status': 'online',
-            'latency': '50ms',
-            'position': {'x': 300, 'y': 200}
-        },
-        {
-            'id': 2,
-            'name': 'Fog_2',
-            'people_connected': 2,
-            'storage_used': '3.9GB',
-            'storage_free': 'free',
-            'status': 'online',
-            'latency': '40ms',
-            'position': {'x': 900, 'y': 200}
-        }
-    ]
-    
+def fog_nodes(request: Request, current_user: Principal = Depends(verify_token)):
+    # Live state from heartbeats posted to /api/fog/telemetry
+    fog_nodes_data = telemetry.nodes()
+    # Lay the nodes out evenly across the topology canvas.
+    for i, node in enumerate(fog_nodes_data):
+        node["position"] = {"x": round(1100 * (i + 1) / (len(fog_nodes_data) + 1)), "y": 200}
+
     return templates.TemplateResponse("fog_nodes.html", {
         "request": request,
         "current_user": current_user,
-        "fog_nodes": fog_nodes_data
+        "fog_nodes": fog_nodes_data,
+        "fog_totals": telemetry.totals(),
     })
 
 
 @app.get("/settings", response_class=HTMLResponse)
-def settings(request: Request, db: Session = Depends(get_db), current_user: User = Depends(verify_token)):
+def settings(request: Request, db: Session = Depends(get_db), current_user: Principal = Depends(verify_token)):
     return templates.TemplateResponse("settings.html", {
         "request": request,
         "current_user": current_user
@@ -309,18 +388,19 @@ async def change_password(
     current_password: str = Form(...),
     new_password: str = Form(...),
     confirm_password: str = Form(...),
-    db: Session = Depends(get_db),
-    current_user: User = Depends(verify_token)
+    db: DbRunner = Depends(get_async_db),
+    current_user: Principal = Depends(verify_token)
 ):
     error = None
     success = None
+    user = await db.run(_user_by_email, current_user.email)
     
     # Check if new passwords match
     if new_password != confirm_password:
         error = "New passwords do not match"
     
     # Verify current password
-    elif not verify_password(current_password, current_user.password_hash):
+    elif not await password_hasher.verify(current_password, user.password_hash):
         error = "Current password is incorrect"
     
     # Check minimum length
@@ -329,8 +409,9 @@ async def change_password(
     
     else:
         # Update password
-        current_user.password_hash = get_password_hash(new_password)
-        db.commit()
+        password_hash = await password_hasher.hash(new_password)
+        await db.run(_set_password_hash, user.id, password_hash)
+        principal_cache.invalidate(user.email)
         success = "Password changed successfully!"
     
     return templates.TemplateResponse("settings.html", {
@@ -344,13 +425,13 @@ async def change_password(
 
 # Mobile Login API
 @app.post("/api/mobile/login")
-def mobile_login(
+async def mobile_login(
     email: str = Form(...),
     password: str = Form(...),
-    db: Session = Depends(get_db)
+    db: DbRunner = Depends(get_async_db)
 ):
     # Find user
-    user = db.query(User).filter(User.email == email).first()
+    user = await db.run(_user_by_email, email)
     
     if not user:
         raise HTTPException(status_code=401, detail="Invalid email or password")
@@ -360,13 +441,15 @@ def mobile_login(
         raise HTTPException(status_code=403, detail="This account is not authorized for mobile access")
     
     # Verify password - FIXED: use password_hash
-    if not verify_password(password, user.password_hash):
+    if not await password_hasher.verify(password, user.password_hash):
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
     # Check if active
     if not user.is_active:
         raise HTTPException(status_code=403, detail="Account is inactive")
     
+    await _upgrade_password_hash(db, user, password)
+    
     # Create token
     access_token = create_access_token(data={"sub": user.email, "role": "mobile"})
     
@@ -388,7 +471,7 @@ def create_mobile_user(
     email: str = Form(...),
     password: str = Form(...),
     db: Session = Depends(get_db),
-    current_user: User = Depends(verify_token)
+    current_user: Principal = Depends(verify_token)
 ):
     # Only admins can create mobile users
     if current_user.role != "admin":
@@ -430,7 +513,7 @@ def create_mobile_user(
 def toggle_user_status(
     user_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(verify_token)
+    current_user: Principal = Depends(verify_token)
 ):
     # Only admins can toggle user status
     if current_user.role != "admin":
@@ -453,6 +536,7 @@ def toggle_user_status(
     # Toggle the status
     user.is_active = not user.is_active
     db.commit()
+    principal_cache.invalidate(user.email)
     
     status = "activated" if user.is_active else "deactivated"
     
@@ -491,5 +575,6 @@ def forgot_password(
     # Update password
     user.password_hash = get_password_hash(new_password)
     db.commit()
+    principal_cache.invalidate(user.email)
     
     return {"success": True, "message": "Password reset successfully! You can now log in."}
@@ -0,0 +1,298 @@
+"""Query-count regression guard.
+
+Seeds the database at two sizes, calls every registered route once to warm
+caches and once more while counting the SQL statements it runs (through
+``before_cursor_execute``), and fails when
+
+* a route has no entry in ``CASES`` (every new route must declare a budget),
+* a call does not succeed (error status, or a form redirect carrying ``error=``),
+* a route runs more statements than its budget,
+* a route's statement count grows with the size of the data (N+1), or
+* ``EXPLAIN QUERY PLAN`` shows a full table scan of one of the ``HOT_TABLES``.
+
+    python -m benchmarks.query_guard            # exits 1 on any violation
+"""
+import argparse
+import asyncio
+import os
+import re
+import sys
+from dataclasses import dataclass
+from typing import Callable
+
+from benchmarks import seed as seeding
+
+HOT_TABLES = ("broadcast_recipients", "message_recipients", "messages")
+# "SCAN messages" / "SCAN TABLE messages" without "USING ... INDEX" is a full table scan.
+_FULL_SCAN = re.compile(r"\bSCAN (?:TABLE )?(%s)\b(?!.*\bUSING\b)" % "|".join(HOT_TABLES))
+
+SIZES = {
+    "small": dict(users=200, broadcasts=10, recipients=2_000, messages=500),
+    "large": dict(users=2_000, broadcasts=100, recipients=100_000, messages=5_000),
+}
+
+ADMIN_FORM = {"email": seeding.ADMIN_EMAIL, "password": seeding.ADMIN_PASSWORD}
+NODE_TOKEN = "query-guard-node"
+NODE_HEADERS = {"Authorization": f"Bearer {NODE_TOKEN}"}
+# Fresh accounts need a deliverable-looking domain; EmailStr rejects reserved ones such as .local.
+MAIL_DOMAIN = "example.com"
+
+
+@dataclass
+class Case:
+    """Statement budget for one route and how to call it (``n`` counts calls, for fresh ids)."""
+    budget: int
+    request: Callable[[int], dict]
+
+
+def _get(url):
+    return lambda n: {"method": "GET", "url": url}
+
+
+CASES = {
+    ("GET", "/"): Case(0, _get("/")),
+    ("POST", "/login"): Case(1, lambda n: {"method": "POST", "url": "/login", "data": ADMIN_FORM}),
+    ("GET", "/register"): Case(0, _get("/register")),
+    ("POST", "/register"): Case(3, lambda n: {"method": "POST", "url": "/register", "data": {
+        "username": f"reg{os.getpid()}_{n}", "email": f"reg{os.getpid()}_{n}@{MAIL_DOMAIN}", "password": "secret123"}}),
+    ("GET", "/dashboard"): Case(2, _get("/dashboard")),
+    ("GET", "/users"): Case(0, _get("/users")),
+    ("GET", "/logs"): Case(2, _get("/logs")),
+    ("DELETE", "/api/messages/{message_id}"): Case(2, lambda n: {"method": "DELETE", "url": f"/api/messages/{n + 1}"}),
+    ("GET", "/fog_nodes"): Case(0, _get("/fog_nodes")),
+    ("GET", "/settings"): Case(0, _get("/settings")),
+    # Changing the password drops the cached principal, so the measured call resolves it again (3).
+    ("POST", "/settings/change-password"): Case(5, lambda n: {"method": "POST", "url": "/settings/change-password", "data": {
+        "current_password": seeding.ADMIN_PASSWORD, "new_password": seeding.ADMIN_PASSWORD,
+        "confirm_password": seeding.ADMIN_PASSWORD}}),
+    ("POST", "/api/mobile/login"): Case(1, lambda n: {"method": "POST", "url": "/api/mobile/login", "data": {
+        "email": "user2@hopfog.local", "password": seeding.USER_PASSWORD}}),
+    ("POST", "/api/admin/create-mobile-user"): Case(4, lambda n: {"method": "POST", "url": "/api/admin/create-mobile-user", "data": {
+        "username": f"mob{os.getpid()}_{n}", "email": f"mob{os.getpid()}_{n}@{MAIL_DOMAIN}", "password": "secret123"}}),
+    ("PUT", "/api/users/{user_id}/toggle-status"): Case(3, lambda n: {"method": "PUT", "url": f"/api/users/{n + 2}/toggle-status"}),
+    ("POST", "/forgot-password"): Case(3, lambda n: {"method": "POST", "url": "/forgot-password", "data": {
+        "email": seeding.ADMIN_EMAIL, "new_password": seeding.ADMIN_PASSWORD}}),
+    ("GET", "/metrics"): Case(0, _get("/metrics")),
+    ("GET", "/api/admin/db-stats"): Case(0, _get("/api/admin/db-stats")),
+    ("GET", "/api/admin/stats"): Case(0, _get("/api/admin/stats")),
+    ("POST", "/api/users"): Case(4, lambda n: {"method": "POST", "url": "/api/users", "json": {
+        "email": f"api{os.getpid()}_{n}@{MAIL_DOMAIN}", "username": f"api{os.getpid()}_{n}", "password_hash": "x"}}),
+    ("GET", "/api/users"): Case(1, _get("/api/users")),
+    ("GET", "/api/exports/broadcast-events"): Case(1, _get("/api/exports/broadcast-events?broadcast_id=1")),
+    ("GET", "/api/exports/broadcast-recipients"): Case(1, _get("/api/exports/broadcast-recipients?broadcast_id=1&format=csv")),
+    ("GET", "/api/search"): Case(3, _get("/api/search?q=body&limit=20")),
+    ("POST", "/api/users/import"): Case(4, lambda n: {"method": "POST", "url": "/api/users/import", "files": {"file": (
+        "users.csv", f"username,email,password\nimp{os.getpid()}_{n}a,imp{os.getpid()}_{n}a@{MAIL_DOMAIN},secret123\n"
+        f"imp{os.getpid()}_{n}b,imp{os.getpid()}_{n}b@{MAIL_DOMAIN},secret123\n", "text/csv")}}),
+    ("PUT", "/api/users/{user_id}/location"): Case(4, lambda n: {"method": "PUT", "url": f"/api/users/{n + 2}/location", "json": {
+        "fog_device_id": 1, "area": "Purok 3"}}),
+    ("GET", "/api/users/page"): Case(1, _get("/api/users/page?sort=username&order=asc&q=user&limit=25")),
+    ("POST", "/api/messages"): Case(5, lambda n: {"method": "POST", "url": "/api/messages", "json": {
+        "sender_id": 2, "subject": "guard", "body": "guard", "recipient_ids": [3, 4]}}),
+    ("GET", "/api/messages/inbox/{user_id}"): Case(1, _get("/api/messages/inbox/3")),
+    ("GET", "/api/messages/log"): Case(2, _get("/api/messages/log")),
+    ("GET", "/admin/messaging"): Case(1, _get("/admin/messaging")),
+    ("GET", "/admin/messaging/broadcasts"): Case(1, _get("/admin/messaging/broadcasts")),
+    ("POST", "/admin/messaging/broadcasts"): Case(6, lambda n: {"method": "POST", "url": "/admin/messaging/broadcasts", "data": {
+        "msg_type": "alert", "severity": "info", "subject": "guard", "body": "guard", "ttl_hours": "1", "action": "draft"}}),
+    ("GET", "/admin/messaging/broadcasts/{broadcast_id}"): Case(3, _get("/admin/messaging/broadcasts/1")),
+    ("POST", "/admin/messaging/broadcasts/{broadcast_id}/mark_sent"): Case(7, lambda n: {
+        "method": "POST", "url": f"/admin/messaging/broadcasts/{n + 1}/mark_sent"}),
+    ("POST", "/admin/messaging/broadcasts/{broadcast_id}/cancel"): Case(4, lambda n: {
+        "method": "POST", "url": f"/admin/messaging/broadcasts/{n + 1}/cancel"}),
+    ("GET", "/admin/messaging/audiences"): Case(2, _get("/admin/messaging/audiences")),
+    ("POST", "/admin/messaging/audiences"): Case(4, lambda n: {"method": "POST", "url": "/admin/messaging/audiences", "data": {
+        "name": f"guard{os.getpid()}_{n}", "kind": "list", "members": "2 user3 user4@hopfog.local"}}),
+    ("POST", "/admin/messaging/audiences/{audience_id}/delete"): Case(3, lambda n: {
+        "method": "POST", "url": f"/admin/messaging/audiences/{n + 2}/delete"}),
+    ("GET", "/admin/messaging/audiences/preview"): Case(1, _get("/admin/messaging/audiences/preview?ids=1&mode=any")),
+    ("GET", "/admin/messaging/sos"): Case(1, _get("/admin/messaging/sos")),
+    ("GET", "/admin/messaging/queue"): Case(2, _get("/admin/messaging/queue")),
+    ("GET", "/admin/messaging/tracking"): Case(2, _get("/admin/messaging/tracking")),
+    ("GET", "/admin/messaging/testing"): Case(0, _get("/admin/messaging/testing")),
+    ("POST", "/api/acks"): Case(0, lambda n: {"method": "POST", "url": "/api/acks", "json": {"acks": [
+        {"kind": "broadcast", "id": 1, "user_id": uid, "status": "delivered"} for uid in range(2, 12)]}}),
+    ("GET", "/api/acks/stats"): Case(0, _get("/api/acks/stats")),
+    ("POST", "/api/fog/telemetry"): Case(0, lambda n: {"method": "POST", "url": "/api/fog/telemetry", "headers": NODE_HEADERS, "json": {
+        "node": "guard-node", "connected_users": 3, "storage_used_bytes": 1 << 30, "storage_free_bytes": 1 << 31, "latency_ms": 40}}),
+    ("GET", "/api/fog/sync"): Case(6, lambda n: {"method": "GET", "url": "/api/fog/sync?node=guard-node&limit=200", "headers": NODE_HEADERS}),
+    ("GET", "/api/fog/nodes"): Case(0, _get("/api/fog/nodes")),
+    ("GET", "/api/fog/nodes/{device_id}/samples"): Case(0, _get("/api/fog/nodes/1/samples")),
+    ("GET", "/admin/messaging/progress/stream"): Case(0, _get("/admin/messaging/progress/stream?since=0&timeout=0.05")),
+}
+
+
+class StatementRecorder:
+    """Collects statements run on the app's engines while ``active``."""
+
+    def __init__(self):
+        self.active = False
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        if self.active:
+            self.statements.append((conn.engine, statement, None if executemany else parameters))
+
+    def start(self):
+        self.statements = []
+        self.active = True
+
+    def stop(self):
+        self.active = False
+        return self.statements
+
+
+def full_scans(statements) -> list:
+    """Hot tables that EXPLAIN QUERY PLAN shows being scanned without an index."""
+    found = []
+    for engine, statement, parameters in statements:
+        if parameters is None or not statement.lstrip().upper().startswith(("SELECT", "WITH", "UPDATE", "DELETE")):
+            continue
+        raw = engine.raw_connection()
+        try:
+            cur = raw.cursor()
+            cur.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+            for row in cur.fetchall():
+                detail = row[-1]
+                match = _FULL_SCAN.search(detail)
+                if match:
+                    found.append(f"{detail}  <-  {' '.join(statement.split())[:160]}")
+        finally:
+            raw.close()
+    return found
+
+
+def failed(response) -> bool:
+    """Error status, or a form redirect that carries an error message back."""
+    return response.status_code >= 400 or "error=" in response.headers.get("location", "")
+
+
+async def measure(client, recorder, routes) -> dict:
+    from routes.auth import principal_cache
+
+    results = {}
+    calls = {}
+    for key in routes:
+        case = CASES[key]
+        n = calls.get(key, 0)
+        # First call warms per-process caches (principals, audience snapshot). The
+        # principal is re-resolved here so its TTL cannot run out before the measured call.
+        principal_cache.clear()
+        warm = await client.request(**case.request(n))
+        recorder.start()
+        response = await client.request(**case.request(n + 1))
+        statements = recorder.stop()
+        calls[key] = n + 2
+        results[key] = {
+            "failed": [r.status_code for r in (warm, response) if failed(r)],
+            "count": len(statements),
+            "scans": full_scans(statements),
+        }
+    return results
+
+
+async def run(db_path: str) -> list:
+    import httpx
+    from fastapi.routing import APIRoute
+    from sqlalchemy import event
+
+    from app.main import app
+    from database import connection
+    from routes.auth import principal_cache
+    from services.audience import DEFINITIONS, named_audiences, resident_audience
+    from services.search import search_index
+    from services.telemetry import telemetry
+
+    routes = sorted({(m, r.path) for r in app.routes if isinstance(r, APIRoute) for m in r.methods if m != "HEAD"})
+    problems = [f"{m} {p}: no query budget declared in benchmarks/query_guard.py" for m, p in routes if (m, p) not in CASES]
+    routes = [key for key in routes if key in CASES]
+
+    recorder = StatementRecorder()
+    engines = {connection.engine, connection.read_engine}
+    for eng in engines:
+        event.listen(eng, "before_cursor_execute", recorder)
+
+    per_size = {}
+    started = False
+    try:
+        for size, scale in SIZES.items():
+            # Reseed the same file between sizes; pooled connections must not outlive it.
+            for eng in engines:
+                eng.dispose()
+            seeding.seed(db_path, bcrypt_rounds=4, **scale)
+            principal_cache.clear()
+            resident_audience.mark_rules_changed()
+            named_audiences.mark_changed([DEFINITIONS])
+            search_index.install(connection.engine)  # the reseeded file has no FTS tables yet
+            telemetry.clear()  # node ids from the previous size no longer exist
+            if not started:
+                await app.router.startup()
+                started = True
+
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://guard") as client:
+                r = await client.post("/login", data=ADMIN_FORM)
+                client.cookies.set("access_token", r.cookies["access_token"])
+                # Routes run in path order; set up what later cases refer to by id: fog node 1
+                # (location, sync, samples) and audience 1 (preview; the audience cases
+                # create and delete 2 and 3).
+                fixtures = [
+                    await client.post("/api/fog/telemetry", json={"node": "guard-node"}, headers=NODE_HEADERS),
+                    await client.post("/admin/messaging/audiences", data={
+                        "name": "guard-fixture", "kind": "list", "members": "2 3 4"}),
+                ]
+                if any(failed(r) for r in fixtures):
+                    raise RuntimeError(f"fixture setup failed: {[r.status_code for r in fixtures]}")
+                per_size[size] = await measure(client, recorder, routes)
+    finally:
+        for eng in engines:
+            event.remove(eng, "before_cursor_execute", recorder)
+        if started:
+            await app.router.shutdown()
+
+    small, large = per_size["small"], per_size["large"]
+    for key in routes:
+        method, path = key
+        budget = CASES[key].budget
+        label = f"{method} {path}"
+        print(f"{label:<60} small={small[key]['count']:>3} large={large[key]['count']:>3} budget={budget:>3}", file=sys.stderr)
+        if large[key]["count"] > small[key]["count"]:
+            problems.append(f"{label}: statement count grows with data size ({small[key]['count']} -> {large[key]['count']})")
+        worst = max(small[key]["count"], large[key]["count"])
+        if worst > budget:
+            problems.append(f"{label}: {worst} statements, budget is {budget}")
+        statuses = small[key]["failed"] + large[key]["failed"]
+        if statuses:
+            problems.append(f"{label}: request did not succeed (status {', '.join(map(str, statuses))})")
+        for scan in sorted(set(small[key]["scans"] + large[key]["scans"])):
+            problems.append(f"{label}: full table scan: {scan}")
+    return problems
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Check per-route SQL statement budgets")
+    parser.add_argument("--db", default="query_guard.db")
+    args = parser.parse_args()
+
+    # Set before anything imports database.connection, which reads these once.
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.abspath(args.db)}"
+    os.environ.setdefault("SECRET_KEY", "query-guard-secret")
+    os.environ.setdefault("BCRYPT_ROUNDS", "4")
+    os.environ.setdefault("BCRYPT_MIN_ROUNDS", "4")
+    os.environ.setdefault("DISPATCH_ENABLED", "0")
+    os.environ.setdefault("DB_MODE", "sync")
+    os.environ["FOG_NODE_TOKEN"] = NODE_TOKEN
+    # Background flushes would land in whichever route is being counted; keep them out of the run.
+    for name in ("ACK_FLUSH_SECONDS", "TELEMETRY_FLUSH_SECONDS", "STATS_RECONCILE_SECONDS"):
+        os.environ[name] = "3600"
+
+    problems = asyncio.run(run(args.db))
+    for line in problems:
+        print(f"FAIL {line}", file=sys.stderr)
+    if problems:
+        raise SystemExit(1)
+    print("query budgets OK", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
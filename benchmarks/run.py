@@ -0,0 +1,249 @@
+"""Reproducible load benchmark for the HopFog web app.
+
+Seeds (or reuses) a SQLite database, starts the real FastAPI app in-process and
+drives it through httpx's ASGI transport: login, inbox, send_message,
+create_broadcast, tracking and dashboard. Each scenario runs a fixed number of
+requests at a fixed concurrency with a seeded RNG, and the results (throughput
+and p50/p95/p99 latency) are written as JSON. With ``--baseline`` the run is
+compared against an earlier result and exits non-zero on a regression.
+
+    python -m benchmarks.run --db bench.db --users 50000 --recipients 5000000 --out result.json
+    python -m benchmarks.run --db bench.db --reuse-db --baseline baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+from benchmarks import seed as seeding
+
+SCENARIOS = ("login", "inbox", "send_message", "create_broadcast", "tracking", "dashboard")
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies: list, errors: int, wall_seconds: float) -> dict:
+    ordered = sorted(latencies)
+    ms = lambda s: round(s * 1000, 3)  # noqa: E731
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / wall_seconds, 2) if wall_seconds else 0.0,
+        "mean_ms": ms(sum(ordered) / len(ordered)) if ordered else 0.0,
+        "p50_ms": ms(percentile(ordered, 50)),
+        "p95_ms": ms(percentile(ordered, 95)),
+        "p99_ms": ms(percentile(ordered, 99)),
+        "max_ms": ms(ordered[-1]) if ordered else 0.0,
+    }
+
+
+class Bench:
+    def __init__(self, client, rng: random.Random, users: int):
+        self.client = client
+        self.rng = rng
+        # Mobile users occupy ids 2..users+1 (see benchmarks.seed).
+        self.user_ids = range(2, users + 2)
+
+    async def login(self):
+        r = await self.client.post("/login", data={"email": seeding.ADMIN_EMAIL, "password": seeding.ADMIN_PASSWORD})
+        return r.status_code == 302
+
+    async def inbox(self):
+        r = await self.client.get(f"/api/messages/inbox/{self.rng.choice(self.user_ids)}")
+        return r.status_code == 200
+
+    async def send_message(self):
+        payload = {
+            "sender_id": self.rng.choice(self.user_ids),
+            "subject": "bench",
+            "body": "benchmark message",
+            "recipient_ids": list({self.rng.choice(self.user_ids) for _ in range(self.rng.randint(1, 3))}),
+        }
+        r = await self.client.post("/api/messages", json=payload)
+        return r.status_code == 200
+
+    async def create_broadcast(self):
+        r = await self.client.post("/admin/messaging/broadcasts", data={
+            "msg_type": self.rng.choice(("announcement", "alert", "sos")),
+            "severity": "info",
+            "subject": "Benchmark broadcast",
+            "body": "benchmark",
+            "ttl_hours": "24",
+            "action": "draft",
+        })
+        return r.status_code == 303
+
+    async def tracking(self):
+        r = await self.client.get("/admin/messaging/tracking")
+        return r.status_code == 200
+
+    async def dashboard(self):
+        r = await self.client.get("/dashboard")
+        return r.status_code == 200
+
+
+async def run_scenario(fn, requests: int, concurrency: int) -> dict:
+    latencies: list = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            started = time.perf_counter()
+            try:
+                ok = await fn()
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+async def run_all(args) -> dict:
+    import httpx
+
+    # Imported only now: the app reads DATABASE_URL and friends at import time.
+    from app.main import app
+
+    await app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            bench = Bench(client, random.Random(args.seed), args.users)
+
+            # Authenticate once for the admin pages.
+            r = await client.post("/login", data={"email": seeding.ADMIN_EMAIL, "password": seeding.ADMIN_PASSWORD})
+            if r.status_code != 302:
+                raise SystemExit(f"benchmark login failed with HTTP {r.status_code}")
+            client.cookies.set("access_token", r.cookies["access_token"])
+
+            results = {}
+            for name in args.scenarios:
+                fn = getattr(bench, name)
+                requests = args.broadcast_requests if name == "create_broadcast" else args.requests
+                for _ in range(args.warmup):
+                    await fn()
+                results[name] = await run_scenario(fn, requests, args.concurrency)
+                print(f"{name:>16}: {results[name]}", file=sys.stderr)
+            return results
+    finally:
+        await app.router.shutdown()
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list:
+    """Scenarios whose p95 grew or throughput dropped by more than ``tolerance``."""
+    regressions = []
+    for name, now in current["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        if before["p95_ms"] and now["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before['p95_ms']} -> {now['p95_ms']} ms")
+        if before["throughput_rps"] and now["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {before['throughput_rps']} -> {now['throughput_rps']} rps")
+    return regressions
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the HopFog load benchmark")
+    parser.add_argument("--db", default="bench.db")
+    parser.add_argument("--reuse-db", action="store_true", help="skip seeding and use the existing --db")
+    seeding.add_arguments(parser)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--broadcast-requests", type=int, default=20, help="requests for create_broadcast")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--out", help="write the JSON result here (default: stdout)")
+    parser.add_argument("--baseline", help="compare against this earlier JSON result")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed regression, as a fraction")
+    args = parser.parse_args()
+
+    # Set before anything imports database.connection, which reads these once.
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.abspath(args.db)}"
+    os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+    # Match the seeded hashes so logins measure verification, not rehashing.
+    os.environ.setdefault("BCRYPT_ROUNDS", str(args.bcrypt_rounds))
+    # Keep the dispatcher from competing with the measured requests.
+    os.environ.setdefault("DISPATCH_ENABLED", "0")
+
+    seed_info = None
+    if not args.reuse_db:
+        seed_info = seeding.seed(
+            args.db,
+            users=args.users,
+            broadcasts=args.broadcasts,
+            recipients=args.recipients,
+            messages=args.messages,
+            seed=args.seed,
+            bcrypt_rounds=args.bcrypt_rounds,
+        )
+        print(f"seeded: {seed_info}", file=sys.stderr)
+
+    scenarios = asyncio.run(run_all(args))
+
+    result = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "db_mode": os.getenv("DB_MODE", "sync"),
+            "db_profile": os.getenv("DB_PROFILE", "production"),
+            "scale": {
+                "users": args.users,
+                "broadcasts": args.broadcasts,
+                "recipients": args.recipients,
+                "messages": args.messages,
+                "seed": args.seed,
+            },
+            "seeding": seed_info,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+        },
+        "scenarios": scenarios,
+    }
+
+    text = json.dumps(result, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
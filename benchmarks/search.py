@@ -0,0 +1,198 @@
+"""Full-text search benchmark.
+
+Seeds a database with ``--messages`` direct messages (1M by default) and
+``--broadcasts`` broadcasts with their events, their text drawn from a
+Zipf-weighted vocabulary so there are common, rare and absent terms. It then
+builds the FTS5 indexes and reports, as JSON: index build time and size, the
+per-row cost the sync triggers add to inserts, and p50/p95 latency of ranked
+searches next to the ``LIKE '%term%'`` query they replace.
+
+    python -m benchmarks.search --db search-bench.db --messages 1000000 --out search.json
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+from benchmarks import seed as seeding
+from benchmarks.run import percentile
+
+VOCABULARY = (
+    "flood water river level rising evacuate evacuation center barangay road closed bridge landslide "
+    "typhoon signal wind rain heavy power outage restored electricity generator relief goods food "
+    "rice canned drinking clinic medicine doctor nurse injured missing family shelter school gym "
+    "hall rescue team boat rope volunteer registration census headcount curfew tonight tomorrow "
+    "morning afternoon advisory warning alert update status safe help need please urgent check "
+    "signal tower network fog node battery solar charging station queue schedule distribution "
+    "purok sitio zone north south east west market church plaza clinic pharmacy hospital ambulance "
+    "fire smoke earthquake aftershock tsunami coast shore pier fishermen boats harbor mayor captain "
+    "council meeting announcement reminder thanks received confirmed delivered pending cancelled"
+).split()
+WEIGHTS = [1 / rank for rank in range(1, len(VOCABULARY) + 1)]
+QUERIES = {
+    "common": "water",
+    "rare": "fishermen",
+    "two_terms": "evacuation center",
+    "prefix": "evac",
+    "absent": "volcano",
+}
+
+
+def _text(rng: random.Random, low: int, high: int) -> str:
+    return " ".join(rng.choices(VOCABULARY, weights=WEIGHTS, k=rng.randint(low, high)))
+
+
+def seed(path: str, messages: int, broadcasts: int, users: int, rng_seed: int) -> dict:
+    if os.path.exists(path):
+        os.remove(path)
+    seeding.create_schema(path)
+    rng = random.Random(rng_seed)
+    base_time = datetime(2026, 1, 1)
+    started = time.perf_counter()
+
+    con = sqlite3.connect(path)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=OFF")
+    try:
+        con.execute("BEGIN")
+        con.executemany(
+            "INSERT INTO users (id, email, username, password_hash, is_active, role, created_at) VALUES (?, ?, ?, 'x', 1, 'mobile', ?)",
+            ((uid, f"user{uid}@hopfog.local", f"user{uid}", seeding._ts(base_time)) for uid in range(1, users + 1)),
+        )
+        rows = (
+            (mid, rng.randint(1, users), _text(rng, 5, 40), seeding._ts(base_time + timedelta(seconds=10 * mid)))
+            for mid in range(1, messages + 1)
+        )
+        for batch in seeding._batched(rows):
+            con.executemany("INSERT INTO messages (id, sender_id, body, created_at) VALUES (?, ?, ?, ?)", batch)
+        for bid in range(1, broadcasts + 1):
+            created = seeding._ts(base_time + timedelta(minutes=bid))
+            con.execute(
+                "INSERT INTO broadcast_messages (id, created_by, msg_type, severity, audience, subject, body, status, priority, created_at) "
+                "VALUES (?, 1, 'alert', 'info', 'all_residents', ?, ?, 'sent', 50, ?)",
+                (bid, _text(rng, 3, 8), _text(rng, 20, 120), created),
+            )
+            con.executemany(
+                "INSERT INTO broadcast_events (broadcast_id, event_type, message, created_at) VALUES (?, 'note', ?, ?)",
+                [(bid, _text(rng, 3, 12), created) for _ in range(3)],
+            )
+        con.execute("COMMIT")
+    finally:
+        con.close()
+    return {"messages": messages, "broadcasts": broadcasts, "seconds": round(time.perf_counter() - started, 2)}
+
+
+def _timed(fn, repeat: int) -> dict:
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - started)
+    ordered = sorted(latencies)
+    return {
+        "p50_ms": round(percentile(ordered, 50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 3),
+    }
+
+
+def _index_bytes(con) -> int:
+    try:
+        return con.execute("SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name LIKE '%_fts%'").fetchone()[0]
+    except sqlite3.OperationalError:  # dbstat not compiled in
+        return -1
+
+
+def _trigger_overhead(path: str, rows: int, rng: random.Random) -> dict:
+    con = sqlite3.connect(path)
+    try:
+        con.execute("CREATE TEMP TABLE plain_messages AS SELECT * FROM messages WHERE 0")
+        bodies = [_text(rng, 5, 40) for _ in range(rows)]
+        timings = {}
+        for table in ("plain_messages", "messages"):
+            started = time.perf_counter()
+            con.execute("BEGIN")
+            con.executemany(f"INSERT INTO {table} (sender_id, body, created_at) VALUES (1, ?, CURRENT_TIMESTAMP)", [(b,) for b in bodies])
+            con.execute("COMMIT")
+            timings[table] = time.perf_counter() - started
+        return {
+            "rows": rows,
+            "insert_us_per_row_without_index": round(timings["plain_messages"] / rows * 1e6, 2),
+            "insert_us_per_row_with_index": round(timings["messages"] / rows * 1e6, 2),
+        }
+    finally:
+        con.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark HopFog full-text search")
+    parser.add_argument("--db", default="search-bench.db")
+    parser.add_argument("--reuse-db", action="store_true", help="skip seeding and use the existing --db")
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--broadcasts", type=int, default=5_000)
+    parser.add_argument("--users", type=int, default=5_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=50, help="runs per FTS query")
+    parser.add_argument("--like-repeat", type=int, default=5, help="runs per LIKE query")
+    parser.add_argument("--insert-rows", type=int, default=10_000)
+    parser.add_argument("--out", help="write the JSON result here (default: stdout)")
+    args = parser.parse_args()
+
+    # Set before anything imports database.connection, which reads it once.
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.abspath(args.db)}"
+
+    seed_info = None
+    if not args.reuse_db:
+        seed_info = seed(args.db, args.messages, args.broadcasts, args.users, args.seed)
+        print(f"seeded: {seed_info}", file=sys.stderr)
+
+    from database.connection import SessionLocal, engine
+    from services.search import search_index
+
+    started = time.perf_counter()
+    built = search_index.install(engine)
+    if not search_index.available:
+        raise SystemExit("this SQLite build has no FTS5")
+    if not built:
+        search_index.rebuild(engine)
+    build_seconds = round(time.perf_counter() - started, 2)
+
+    con = sqlite3.connect(args.db)
+    index_bytes = _index_bytes(con)
+    queries = {}
+    db = SessionLocal()
+    try:
+        for name, q in QUERIES.items():
+            like = f"%{q}%"
+            queries[name] = {
+                "q": q,
+                "fts": _timed(lambda: search_index.search(db, q, limit=20), args.repeat),
+                "like": _timed(lambda: con.execute(
+                    "SELECT id FROM messages WHERE body LIKE ? ORDER BY created_at DESC, id DESC LIMIT 20", (like,)
+                ).fetchall(), args.like_repeat),
+                "matches": con.execute("SELECT count(*) FROM messages_fts WHERE messages_fts MATCH ?",
+                                       (search_index.match_expression(q),)).fetchone()[0],
+            }
+    finally:
+        db.close()
+        con.close()
+
+    result = {
+        "seeding": seed_info,
+        "index": {"build_seconds": build_seconds, "bytes": index_bytes},
+        "triggers": _trigger_overhead(args.db, args.insert_rows, random.Random(args.seed + 1)),
+        "queries": queries,
+    }
+    text = json.dumps(result, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
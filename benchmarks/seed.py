@@ -0,0 +1,202 @@
+"""Synthetic data generator for benchmarks.
+
+Builds a SQLite database with the app's schema and a reproducible (seeded) data
+set: one admin, ``users`` mobile users, ``messages`` direct messages with 1-3
+recipients each, and ``broadcasts`` broadcasts sharing ``recipients`` recipient
+rows between them, with delivery counters to match. Rows are written with the
+raw sqlite3 driver in large executemany batches inside a single transaction, so
+millions of rows take seconds to minutes rather than hours.
+
+    python -m benchmarks.seed bench.db --users 50000 --broadcasts 1000 --recipients 5000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import bcrypt
+
+ADMIN_EMAIL = "bench-admin@hopfog.local"
+ADMIN_PASSWORD = "bench-admin-password"
+USER_PASSWORD = "bench-user-password"
+
+BATCH = 50_000
+STATUSES = ("queued", "sent", "delivered", "read", "failed")
+STATUS_WEIGHTS = (10, 30, 35, 20, 5)
+MSG_TYPES = (("announcement", 10), ("alert", 50), ("sos", 100))
+
+
+def _batched(rows, size=BATCH):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _ts(dt: datetime) -> str:
+    # Same text format SQLite's CURRENT_TIMESTAMP (server_default=func.now()) produces.
+    return dt.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def create_schema(path: str) -> None:
+    """Create tables and indexes exactly as the app declares them."""
+    from sqlalchemy import create_engine
+
+    from database.connection import Base
+    from database.migrations import ensure_indexes
+    import database.models  # noqa: F401  (registers the tables)
+
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    ensure_indexes(engine)
+    engine.dispose()
+
+
+def seed(
+    path: str,
+    users: int = 50_000,
+    broadcasts: int = 1_000,
+    recipients: int = 5_000_000,
+    messages: int = 200_000,
+    seed: int = 42,
+    bcrypt_rounds: int = 10,
+) -> dict:
+    if os.path.exists(path):
+        os.remove(path)
+    create_schema(path)
+
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    base_time = datetime(2026, 1, 1)
+
+    # Hashing is the expensive part of user creation; every mobile user shares one hash.
+    admin_hash = bcrypt.hashpw(ADMIN_PASSWORD.encode(), bcrypt.gensalt(rounds=bcrypt_rounds)).decode()
+    user_hash = bcrypt.hashpw(USER_PASSWORD.encode(), bcrypt.gensalt(rounds=bcrypt_rounds)).decode()
+
+    con = sqlite3.connect(path)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=OFF")
+    con.execute("PRAGMA cache_size=-262144")
+    try:
+        con.execute("BEGIN")
+
+        # ---------- users (id 1 is the admin) ----------
+        con.execute(
+            "INSERT INTO users (id, email, username, password_hash, is_active, role, created_at) VALUES (?, ?, ?, ?, 1, 'admin', ?)",
+            (1, ADMIN_EMAIL, "bench-admin", admin_hash, _ts(base_time)),
+        )
+        user_rows = (
+            (uid, f"user{uid}@hopfog.local", f"user{uid}", user_hash, 1, "mobile", _ts(base_time + timedelta(seconds=uid)))
+            for uid in range(2, users + 2)
+        )
+        for batch in _batched(user_rows):
+            con.executemany(
+                "INSERT INTO users (id, email, username, password_hash, is_active, role, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                batch,
+            )
+        user_ids = range(2, users + 2)
+
+        # ---------- direct messages ----------
+        def message_rows():
+            for mid in range(1, messages + 1):
+                yield (mid, rng.choice(user_ids), f"Subject {mid}", f"Message body {mid} " + "x" * rng.randint(20, 200),
+                       _ts(base_time + timedelta(seconds=30 * mid)))
+
+        for batch in _batched(message_rows()):
+            con.executemany("INSERT INTO messages (id, sender_id, subject, body, created_at) VALUES (?, ?, ?, ?, ?)", batch)
+
+        def message_recipient_rows():
+            for mid in range(1, messages + 1):
+                for uid in set(rng.choice(user_ids) for _ in range(rng.randint(1, 3))):
+                    yield (mid, uid, rng.choice(("sent", "delivered", "read")))
+
+        message_recipients = 0
+        for batch in _batched(message_recipient_rows()):
+            con.executemany("INSERT INTO message_recipients (message_id, user_id, status) VALUES (?, ?, ?)", batch)
+            message_recipients += len(batch)
+
+        # ---------- broadcasts, recipients and counters ----------
+        per_broadcast = min(users, recipients // broadcasts) if broadcasts else 0
+        for bid in range(1, broadcasts + 1):
+            msg_type, priority = rng.choice(MSG_TYPES)
+            created = base_time + timedelta(minutes=10 * bid)
+            con.execute(
+                "INSERT INTO broadcast_messages (id, created_by, msg_type, severity, audience, subject, body, status, priority, ttl_expires_at, created_at) "
+                "VALUES (?, 1, ?, 'info', 'all_residents', ?, ?, 'sent', ?, ?, ?)",
+                (bid, msg_type, f"Broadcast {bid}", f"Broadcast body {bid}", priority,
+                 _ts(created + timedelta(hours=24)), _ts(created)),
+            )
+            con.execute(
+                "INSERT INTO broadcast_events (broadcast_id, event_type, message, created_at) VALUES (?, 'created', 'Created as QUEUED', ?)",
+                (bid, _ts(created)),
+            )
+
+            # A contiguous window of users keeps this cheap while spreading rows across the table.
+            start = rng.randrange(0, max(users - per_broadcast, 0) + 1)
+            statuses = rng.choices(STATUSES, weights=STATUS_WEIGHTS, k=per_broadcast)
+            counts = dict.fromkeys(STATUSES, 0)
+            rows = []
+            for offset, status in enumerate(statuses):
+                counts[status] += 1
+                rows.append((bid, user_ids[start + offset], status, 1 if status != "queued" else 0))
+            con.executemany(
+                "INSERT INTO broadcast_recipients (broadcast_id, user_id, status, attempts) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            con.execute(
+                "INSERT INTO broadcast_delivery_counters (broadcast_id, queued, sent, delivered, read, failed, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (bid, counts["queued"], counts["sent"], counts["delivered"], counts["read"], counts["failed"], _ts(created)),
+            )
+
+        con.execute("COMMIT")
+        con.execute("ANALYZE")
+    finally:
+        con.close()
+
+    return {
+        "path": path,
+        "users": users + 1,
+        "messages": messages,
+        "message_recipients": message_recipients,
+        "broadcasts": broadcasts,
+        "broadcast_recipients": per_broadcast * broadcasts,
+        "seed": seed,
+        "bcrypt_rounds": bcrypt_rounds,
+        "seconds": round(time.perf_counter() - started, 2),
+    }
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--users", type=int, default=50_000)
+    parser.add_argument("--broadcasts", type=int, default=1_000)
+    parser.add_argument("--recipients", type=int, default=5_000_000, help="total broadcast_recipients rows")
+    parser.add_argument("--messages", type=int, default=200_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--bcrypt-rounds", type=int, default=10)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Seed a synthetic HopFog database")
+    parser.add_argument("path")
+    add_arguments(parser)
+    args = parser.parse_args()
+    info = seed(
+        args.path,
+        users=args.users,
+        broadcasts=args.broadcasts,
+        recipients=args.recipients,
+        messages=args.messages,
+        seed=args.seed,
+        bcrypt_rounds=args.bcrypt_rounds,
+    )
+    print(info)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,120 @@
+import asyncio
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 from dotenv import load_dotenv
 import os
 
+from .pool import EngineStats, InstrumentedQueuePool, configure_sqlite
+
 # Load environment variables
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./capstone.db")
+# Read-only endpoints use their own engine; by default it points at the same database.
+READ_DATABASE_URL = os.getenv("READ_DATABASE_URL", DATABASE_URL)
+
+# "sync" runs hot-path queries on the regular engine in worker threads,
+# "async" runs them on an async driver (aiosqlite for SQLite). Both are kept so
+# they can be benchmarked against each other.
+DB_MODE = os.getenv("DB_MODE", "sync").lower()
+
+# "production" applies the tuned SQLite pragmas (WAL, busy_timeout, ...) and
+# explicit pool sizes; "default" leaves SQLite and the pool at library defaults.
+DB_PROFILE = os.getenv("DB_PROFILE", "production").lower()
+
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+# In-memory databases exist per connection, so they cannot be pooled or split.
+_IS_MEMORY = IS_SQLITE and (":memory:" in DATABASE_URL or DATABASE_URL.rstrip("/") == "sqlite:")
+
+engine_stats = {"write": EngineStats("write"), "read": EngineStats("read")}
+
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
+def _engine_kwargs(url: str, pool_size: int, max_overflow: int) -> dict:
+    kwargs = {"connect_args": {"check_same_thread": False} if url.startswith("sqlite") else {}}
+    if DB_PROFILE == "production" and not _IS_MEMORY:
+        kwargs.update(
+            poolclass=InstrumentedQueuePool,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+            pool_pre_ping=False,
+        )
+    return kwargs
+
+
+def _make_engine(url: str, role: str, pool_size: int, max_overflow: int):
+    eng = create_engine(url, **_engine_kwargs(url, pool_size, max_overflow))
+    stats = engine_stats[role]
+    if isinstance(eng.pool, InstrumentedQueuePool):
+        eng.pool.stats = stats
+    if url.startswith("sqlite") and DB_PROFILE == "production":
+        configure_sqlite(eng, stats, read_only=(role == "read"))
+    return eng
+
+
+engine = _make_engine(
+    DATABASE_URL, "write",
+    pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+    max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "5")),
 )
 
+if _IS_MEMORY:
+    read_engine = engine
+else:
+    read_engine = _make_engine(
+        READ_DATABASE_URL, "read",
+        pool_size=int(os.getenv("DB_READ_POOL_SIZE", "10")),
+        max_overflow=int(os.getenv("DB_READ_MAX_OVERFLOW", "10")),
+    )
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
 
 Base = declarative_base()
 
+
+def _async_url(url: str) -> str:
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    if url.startswith("postgresql:"):
+        return url.replace("postgresql:", "postgresql+asyncpg:", 1)
+    return url
+
+
+def _make_async_engine(url: str, role: str):
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    kwargs = {}
+    if DB_PROFILE == "production" and not _IS_MEMORY:
+        kwargs.update(
+            pool_size=int(os.getenv("DB_READ_POOL_SIZE" if role == "read" else "DB_POOL_SIZE", "5")),
+            max_overflow=int(os.getenv("DB_READ_MAX_OVERFLOW" if role == "read" else "DB_MAX_OVERFLOW", "5")),
+        )
+    eng = create_async_engine(url, **kwargs)
+    if url.startswith("sqlite") and DB_PROFILE == "production":
+        configure_sqlite(eng.sync_engine, engine_stats[role], read_only=(role == "read"))
+    return eng
+
+
+async_engine = None
+async_read_engine = None
+AsyncSessionLocal = None
+AsyncReadSessionLocal = None
+if DB_MODE == "async":
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+    async_engine = _make_async_engine(os.getenv("ASYNC_DATABASE_URL", _async_url(DATABASE_URL)), "write")
+    async_read_engine = (
+        async_engine if _IS_MEMORY
+        else _make_async_engine(os.getenv("ASYNC_READ_DATABASE_URL", _async_url(READ_DATABASE_URL)), "read")
+    )
+    AsyncSessionLocal = sessionmaker(
+        async_engine, class_=AsyncSession, autocommit=False, autoflush=False, expire_on_commit=False
+    )
+    AsyncReadSessionLocal = sessionmaker(
+        async_read_engine, class_=AsyncSession, autocommit=False, autoflush=False, expire_on_commit=False
+    )
+
 # Dependency for FastAPI routes
 def get_db():
     db = SessionLocal()
@@ -24,3 +122,70 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+# Dependency for read-only FastAPI routes; writes on this session fail (query_only).
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+class DbRunner:
+    """Runs ORM code for an ``async def`` route without blocking the event loop.
+
+    ``await db.run(fn, *args)`` calls ``fn(session, *args)`` with an ordinary Session,
+    so query code keeps the usual ``db.query(...)`` style. In async mode that happens
+    through ``AsyncSession.run_sync`` on the async engine; in sync mode in a worker
+    thread. Objects returned from ``fn`` keep their loaded attributes but should not
+    rely on lazy loading afterwards.
+    """
+
+    def __init__(self, read_only: bool = False):
+        if AsyncSessionLocal is not None:
+            factory = AsyncReadSessionLocal if read_only else AsyncSessionLocal
+            self._async_session = factory()
+            self._session = None
+        else:
+            factory = ReadSessionLocal if read_only else SessionLocal
+            self._async_session = None
+            self._session = factory(expire_on_commit=False)
+
+    async def run(self, fn, *args, **kwargs):
+        if self._async_session is not None:
+            return await self._async_session.run_sync(fn, *args, **kwargs)
+        return await asyncio.to_thread(fn, self._session, *args, **kwargs)
+
+    async def close(self):
+        if self._async_session is not None:
+            await self._async_session.close()
+        else:
+            await asyncio.to_thread(self._session.close)
+
+
+# Dependency for async FastAPI routes
+async def get_async_db():
+    db = DbRunner()
+    try:
+        yield db
+    finally:
+        await db.close()
+
+
+# Dependency for read-only async FastAPI routes
+async def get_async_read_db():
+    db = DbRunner(read_only=True)
+    try:
+        yield db
+    finally:
+        await db.close()
+
+
+def pool_stats() -> dict:
+    """Pool and lock-wait statistics for the write and read engines."""
+    stats = {"write": engine_stats["write"].snapshot(engine.pool)}
+    if read_engine is not engine:
+        stats["read"] = engine_stats["read"].snapshot(read_engine.pool)
+    return stats
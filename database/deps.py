@@ -1,3 +1,3 @@
-from database.connection import get_db
+from database.connection import get_db, get_read_db, get_async_db, get_async_read_db, DbRunner
 
-__all__ = ["get_db"]
\ No newline at end of file
+__all__ = ["get_db", "get_read_db", "get_async_db", "get_async_read_db", "DbRunner"]
@@ -0,0 +1,115 @@
+from sqlalchemy import Table, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateTable
+
+from .connection import Base
+
+
+def merge_duplicate_fog_devices(engine: Engine) -> int:
+    """Fold fog devices registered twice under one name into the oldest row.
+
+    Concurrent first heartbeats could create duplicates before ``fog_devices.name``
+    was unique; they must be merged before the unique index can be built. Rollups,
+    user locations and fog node audiences move to the surviving device. Returns the
+    number of rows removed.
+    """
+    with engine.begin() as conn:
+        pairs = conn.execute(text(
+            "SELECT d.id, k.keep FROM fog_devices d "
+            "JOIN (SELECT name, MIN(id) AS keep FROM fog_devices WHERE name IS NOT NULL "
+            "      GROUP BY name HAVING COUNT(*) > 1) k ON k.name = d.name "
+            "WHERE d.id <> k.keep"
+        )).all()
+        for dup, keep in pairs:
+            params = {"dup": dup, "keep": keep}
+            conn.execute(text(
+                "DELETE FROM fog_telemetry_rollups WHERE device_id = :dup AND EXISTS ("
+                "SELECT 1 FROM fog_telemetry_rollups k WHERE k.device_id = :keep "
+                "AND k.resolution = fog_telemetry_rollups.resolution "
+                "AND k.bucket_start = fog_telemetry_rollups.bucket_start)"
+            ), params)
+            conn.execute(text("UPDATE fog_telemetry_rollups SET device_id = :keep WHERE device_id = :dup"), params)
+            conn.execute(text("UPDATE user_locations SET fog_device_id = :keep WHERE fog_device_id = :dup"), params)
+            conn.execute(text(
+                "UPDATE audiences SET value = :keep_value WHERE kind = 'fog_node' AND value = :dup_value"
+            ), {"keep_value": str(keep), "dup_value": str(dup)})
+            conn.execute(text("DELETE FROM fog_devices WHERE id = :dup"), params)
+    return len(pairs)
+
+
+def _rebuild_with_autoincrement(conn, table: Table) -> None:
+    """Recreate ``table`` from its model (AUTOINCREMENT included), keeping every row and id.
+
+    SQLite cannot add AUTOINCREMENT in place: the rows go to a fresh table that then
+    takes the old name. Indexes dropped with the old table are rebuilt by
+    ``ensure_indexes``; the search triggers by ``search_index.install``.
+    """
+    rebuilt = table.to_metadata(Base.metadata, name=f"{table.name}_rebuild")
+    try:
+        conn.execute(CreateTable(rebuilt))
+    finally:
+        Base.metadata.remove(rebuilt)
+    names = ", ".join(c.name for c in table.columns)
+    conn.execute(text(f"INSERT INTO {table.name}_rebuild ({names}) SELECT {names} FROM {table.name}"))
+    conn.execute(text(f"DROP TABLE {table.name}"))
+    conn.execute(text(f"ALTER TABLE {table.name}_rebuild RENAME TO {table.name}"))
+
+
+def _skip_archived_ids(conn, table: Table) -> None:
+    """Start new ids above every id already moved to ``<table>_archive``.
+
+    After a retention run emptied a table that had no AUTOINCREMENT, SQLite started
+    again from 1 and the next run collided with archived rows.
+    """
+    archive = Base.metadata.tables.get(f"{table.name}_archive")
+    if archive is None:
+        return
+    floor = conn.execute(text(f"SELECT COALESCE(MAX(id), 0) FROM {archive.name}")).scalar()
+    if not floor:
+        return
+    params = {"name": table.name, "floor": floor}
+    if conn.execute(text("UPDATE sqlite_sequence SET seq = :floor WHERE name = :name AND seq < :floor"), params).rowcount:
+        return
+    conn.execute(text(
+        "INSERT INTO sqlite_sequence (name, seq) SELECT :name, :floor "
+        "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = :name)"
+    ), params)
+
+
+def ensure_autoincrement(engine: Engine) -> list[str]:
+    """Rebuild tables declared with ``sqlite_autoincrement`` that were created without it.
+
+    Without AUTOINCREMENT SQLite hands out the id of a deleted newest row again,
+    which breaks anything that remembers ids: fog node sync cursors, audience specs
+    of broadcasts, archived rows. Returns the names of the rebuilt tables.
+    """
+    if engine.dialect.name != "sqlite":
+        return []
+    rebuilt = []
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not table.dialect_options["sqlite"]["autoincrement"]:
+                continue
+            sql = conn.execute(
+                text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": table.name}
+            ).scalar()
+            if sql is None:
+                continue
+            if "AUTOINCREMENT" not in sql.upper():
+                _rebuild_with_autoincrement(conn, table)
+                rebuilt.append(table.name)
+            _skip_archived_ids(conn, table)
+    return rebuilt
+
+
+def ensure_indexes(engine: Engine) -> None:
+    """Create any index declared on the models that the database does not have yet.
+
+    ``create_all`` only builds indexes together with new tables, so databases created
+    before an index was added (e.g. an existing capstone.db) pick it up here.
+    """
+    merge_duplicate_fog_devices(engine)
+    ensure_autoincrement(engine)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
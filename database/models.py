@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, UniqueConstraint
+from sqlalchemy import BigInteger, Column, Integer, String, Table, Text, ForeignKey, DateTime, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .connection import Base
@@ -6,7 +6,10 @@ from .connection import Base
 
 class FogDevice(Base):
     __tablename__ = "fog_devices"
-    
+    __table_args__ = (
+        Index("uq_fog_devices_name", "name", unique=True),
+    )
+
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(100))
     status = Column(String(50))
@@ -14,6 +17,9 @@ class FogDevice(Base):
 # ---------- AUTH / USERS ----------
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        Index("ix_users_created_at_id", "created_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     email = Column(String(120), unique=True, index=True, nullable=False)
@@ -39,9 +45,42 @@ class UserRole(Base):
 
     __table_args__ = (UniqueConstraint("user_id", "role_id", name="uq_user_role"),)
 
+class UserLocation(Base):
+    """Where a user is reached: the fog node serving them and their area (barangay/purok)."""
+    __tablename__ = "user_locations"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    fog_device_id = Column(Integer, ForeignKey("fog_devices.id", ondelete="SET NULL"), nullable=True, index=True)
+    area = Column(String(100), nullable=True, index=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+# ---------- AUDIENCES ----------
+class Audience(Base):
+    """A named broadcast target: everyone with a role, behind a fog node, in an area, or an explicit list."""
+    __tablename__ = "audiences"
+    __table_args__ = {"sqlite_autoincrement": True}  # never reuse ids; broadcasts keep them in their audience spec
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(100), unique=True, nullable=False)
+    kind = Column(String(20), nullable=False)     # role/fog_node/area/list
+    value = Column(String(100), nullable=True)    # role name, fog device id or area; unused for lists
+    created_by = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+class AudienceMember(Base):
+    """Members of an explicit-list audience."""
+    __tablename__ = "audience_members"
+
+    audience_id = Column(Integer, ForeignKey("audiences.id", ondelete="CASCADE"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+
 # ---------- MESSAGING ----------
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        Index("ix_messages_created_at_id", "created_at", "id"),
+        {"sqlite_autoincrement": True},  # never reuse ids; sync cursors and archived rows hold them
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     sender_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
@@ -56,6 +95,10 @@ class Message(Base):
 
 class MessageRecipient(Base):
     __tablename__ = "message_recipients"
+    __table_args__ = (
+        # Inbox reads are per user; the (message_id, user_id) primary key cannot serve them.
+        Index("ix_message_recipients_user_message", "user_id", "message_id"),
+    )
 
     message_id = Column(Integer, ForeignKey("messages.id", ondelete="CASCADE"), primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
@@ -71,6 +114,9 @@ class MessageRecipient(Base):
 # ---------- ADMIN BROADCAST MESSAGING ----------
 class BroadcastMessage(Base):
     __tablename__ = "broadcast_messages"
+    __table_args__ = (
+        Index("ix_broadcast_messages_type_created", "msg_type", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     created_by = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
@@ -91,12 +137,14 @@ class BroadcastMessage(Base):
 
     recipients = relationship("BroadcastRecipient", back_populates="broadcast", cascade="all, delete-orphan")
     events = relationship("BroadcastEvent", back_populates="broadcast", cascade="all, delete-orphan")
+    counters = relationship("BroadcastDeliveryCounter", uselist=False, cascade="all, delete-orphan")
 
 
 class BroadcastRecipient(Base):
     __tablename__ = "broadcast_recipients"
     __table_args__ = (
         UniqueConstraint("broadcast_id", "user_id", name="uq_broadcast_recipient"),
+        {"sqlite_autoincrement": True},  # never reuse ids; sync cursors and archived rows hold them
     )
 
     id = Column(Integer, primary_key=True, index=True)
@@ -119,6 +167,7 @@ class BroadcastRecipient(Base):
 
 class BroadcastEvent(Base):
     __tablename__ = "broadcast_events"
+    __table_args__ = {"sqlite_autoincrement": True}  # never reuse ids; archived rows keep theirs
 
     id = Column(Integer, primary_key=True, index=True)
     broadcast_id = Column(Integer, ForeignKey("broadcast_messages.id", ondelete="CASCADE"), nullable=False, index=True)
@@ -129,3 +178,76 @@ class BroadcastEvent(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
 
     broadcast = relationship("BroadcastMessage", back_populates="events")
+
+
+
+class BroadcastDeliveryCounter(Base):
+    """Per-broadcast recipient counts by status, kept in step with broadcast_recipients."""
+    __tablename__ = "broadcast_delivery_counters"
+
+    broadcast_id = Column(Integer, ForeignKey("broadcast_messages.id", ondelete="CASCADE"), primary_key=True)
+
+    queued = Column(Integer, default=0, nullable=False)
+    sent = Column(Integer, default=0, nullable=False)
+    delivered = Column(Integer, default=0, nullable=False)
+    read = Column(Integer, default=0, nullable=False)
+    failed = Column(Integer, default=0, nullable=False)
+
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+
+class FogTelemetryRollup(Base):
+    """Downsampled fog node heartbeats: one row per node per minute or hour."""
+    __tablename__ = "fog_telemetry_rollups"
+    __table_args__ = (
+        UniqueConstraint("device_id", "resolution", "bucket_start", name="uq_fog_rollup_bucket"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    device_id = Column(Integer, ForeignKey("fog_devices.id", ondelete="CASCADE"), nullable=False)
+    resolution = Column(String(4), nullable=False)  # "1m" or "1h"
+    bucket_start = Column(DateTime(timezone=True), nullable=False)
+
+    samples = Column(Integer, default=0, nullable=False)
+    connected_users_avg = Column(Integer, default=0, nullable=False)
+    connected_users_max = Column(Integer, default=0, nullable=False)
+    latency_ms_avg = Column(Integer, nullable=True)
+    latency_ms_max = Column(Integer, nullable=True)
+    storage_used_bytes = Column(BigInteger, nullable=True)   # last value in the bucket
+    storage_free_bytes = Column(BigInteger, nullable=True)
+
+
+class SyncChange(Base):
+    """Append-only log of changed broadcasts; fog nodes sync from it by ``seq``."""
+    __tablename__ = "sync_changes"
+    __table_args__ = (
+        # Retention finds superseded entries by looking up later ones for the same row.
+        Index("ix_sync_changes_entity_seq", "entity", "entity_id", "seq"),
+        {"sqlite_autoincrement": True},  # never reuse a seq a node may hold
+    )
+
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    entity = Column(String(20), nullable=False)  # "broadcast"
+    entity_id = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
+# ---------- ARCHIVE ----------
+def _archive_table(source: Table) -> Table:
+    """Same columns as ``source`` (no foreign keys or secondary indexes) plus archived_at."""
+    columns = [
+        Column(c.name, c.type, primary_key=c.primary_key, autoincrement=False, nullable=c.nullable)
+        for c in source.columns
+    ]
+    return Table(
+        f"{source.name}_archive",
+        Base.metadata,
+        *columns,
+        Column("archived_at", DateTime(timezone=True), server_default=func.now(), nullable=False),
+    )
+
+
+broadcast_recipients_archive = _archive_table(BroadcastRecipient.__table__)
+broadcast_events_archive = _archive_table(BroadcastEvent.__table__)
+messages_archive = _archive_table(Message.__table__)
+message_recipients_archive = _archive_table(MessageRecipient.__table__)
@@ -0,0 +1,125 @@
+"""Engine tuning and pool instrumentation.
+
+``configure_sqlite`` installs the on-connect pragmas of the production SQLite
+profile. ``InstrumentedQueuePool`` records how long requests wait for a pooled
+connection, and ``EngineStats`` collects that together with lock errors
+("database is locked" after busy_timeout ran out) per engine.
+"""
+import os
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+
+SQLITE_PRAGMAS = {
+    # Only takes effect on a new database (or after a full VACUUM); lets the
+    # retention job hand freed pages back with PRAGMA incremental_vacuum.
+    "auto_vacuum": os.getenv("SQLITE_AUTO_VACUUM", "INCREMENTAL"),
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-65536")),  # negative = KiB, i.e. 64 MiB
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+}
+
+# Pragmas that change the database file rather than the connection; read-only
+# connections leave these to the writer. Everything else, synchronous included,
+# is per connection and applied to both engines.
+_WRITER_ONLY_PRAGMAS = {"auto_vacuum", "journal_mode"}
+
+
+class EngineStats:
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+        self.checkout_timeouts = 0
+        self.lock_errors = 0
+
+    def record_checkout(self, waited: float) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.checkout_wait_total += waited
+            self.checkout_wait_max = max(self.checkout_wait_max, waited)
+
+    def record_checkout_timeout(self) -> None:
+        with self._lock:
+            self.checkout_timeouts += 1
+
+    def record_lock_error(self) -> None:
+        with self._lock:
+            self.lock_errors += 1
+
+    def snapshot(self, pool=None) -> dict:
+        with self._lock:
+            data = {
+                "checkouts": self.checkouts,
+                "checkout_wait_seconds_total": round(self.checkout_wait_total, 6),
+                "checkout_wait_seconds_max": round(self.checkout_wait_max, 6),
+                "checkout_timeouts": self.checkout_timeouts,
+                "lock_errors": self.lock_errors,
+            }
+        if isinstance(pool, QueuePool):
+            data.update({
+                "pool_size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "checked_in": pool.checkedin(),
+                "overflow": pool.overflow(),
+            })
+        return data
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that reports checkout wait times to an EngineStats."""
+
+    # SQLAlchemy names pool loggers after the class's module; keep this one's
+    # checkout/checkin debug records under sqlalchemy.pool with the stock pools.
+    _sqla_logger_namespace = "sqlalchemy.pool.impl.QueuePool"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # create_engine() cannot pass extra pool arguments; the owner assigns its own.
+        self.stats = EngineStats("pool")
+
+    def recreate(self):
+        new_pool = super().recreate()
+        new_pool.stats = self.stats
+        return new_pool
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except PoolTimeoutError:
+            self.stats.record_checkout_timeout()
+            raise
+        self.stats.record_checkout(time.perf_counter() - started)
+        return conn
+
+
+def configure_sqlite(engine, stats: EngineStats, read_only: bool = False) -> None:
+    """Apply the production pragmas on every new connection and count lock errors."""
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in SQLITE_PRAGMAS.items():
+                if read_only and name in _WRITER_ONLY_PRAGMAS:
+                    continue
+                cursor.execute(f"PRAGMA {name}={value}")
+            if read_only:
+                cursor.execute("PRAGMA query_only=ON")
+        finally:
+            cursor.close()
+
+    @event.listens_for(engine, "handle_error")
+    def _count_lock_errors(context):
+        if "database is locked" in str(context.original_exception):
+            stats.record_lock_error()
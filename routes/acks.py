@@ -0,0 +1,47 @@
+from datetime import datetime, timezone
+from typing import List, Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel
+
+from routes.auth import Principal, verify_token
+from services.acks import Ack, ack_buffer
+
+router = APIRouter(prefix="/api/acks", tags=["Acknowledgements"])
+
+MAX_ACKS_PER_REQUEST = 5000
+
+class AckIn(BaseModel):
+    kind: Literal["broadcast", "message"]
+    id: int                      # broadcast_id or message_id
+    user_id: int
+    status: Literal["sent", "delivered", "read"]
+    at: Optional[datetime] = None  # when the device saw it; defaults to receipt time
+
+class AckBatch(BaseModel):
+    acks: List[AckIn]
+
+@router.post("", status_code=202)
+async def submit_acks(payload: AckBatch, current_user: Principal = Depends(verify_token)):
+    """Queue delivery/read acknowledgements; they are applied in batches within about a second.
+
+    Mobile users may only acknowledge for themselves; admins (e.g. a fog gateway
+    account) may report for anyone.
+    """
+    if len(payload.acks) > MAX_ACKS_PER_REQUEST:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_ACKS_PER_REQUEST} acknowledgements per request")
+    if current_user.role != "admin" and any(a.user_id != current_user.id for a in payload.acks):
+        raise HTTPException(status_code=403, detail="Cannot acknowledge for other users")
+
+    now = datetime.now(timezone.utc)
+    accepted = ack_buffer.add([
+        Ack(kind=a.kind, target_id=a.id, user_id=a.user_id, status=a.status, at=a.at or now)
+        for a in payload.acks
+    ])
+    return {"accepted": accepted, "pending": ack_buffer.pending}
+
+@router.get("/stats")
+def ack_stats(current_user: Principal = Depends(verify_token)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admins only")
+    return ack_buffer.stats()
@@ -1,61 +1,54 @@
 from __future__ import annotations
 
+import asyncio
+import json
+import re
+import time
 from datetime import datetime, timedelta, timezone
+from itertools import islice
 from typing import Optional
+from urllib.parse import quote
 
-from fastapi import APIRouter, Depends, Form, HTTPException, Request
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi import APIRouter, Depends, Form, Header, HTTPException, Query, Request
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
+from sqlalchemy import desc, insert, or_
 
-from database.deps import get_db
+from database.deps import get_db, get_read_db, get_async_db, DbRunner
 from database.models import (
-    User, Role, UserRole,
-    BroadcastMessage, BroadcastRecipient, BroadcastEvent
+    Audience, AudienceMember, BroadcastMessage, BroadcastRecipient, BroadcastEvent, FogDevice, Role, User
 )
-from routes.auth import verify_token
+from routes.auth import Principal, verify_token
+from services import delivery_counters
+from services.assets import register as register_asset_helpers
+from services.audience import ALL_RESIDENTS, AUDIENCE_KINDS, format_spec, named_audiences, resident_audience
+from services.progress import RESYNC, progress_hub
+from services.search import search_index
+from services.stats import live_stats
 
 templates = Jinja2Templates(directory="templates")
+register_asset_helpers(templates)
 
 router = APIRouter(prefix="/admin/messaging", tags=["Admin Messaging UI"])
 
 
-def _is_admin(db: Session, user_id: int) -> bool:
-    # Dev-friendly: if roles table is empty or 'admin' role doesn't exist yet, allow.
-    admin_role = db.query(Role).filter(func.lower(Role.name) == "admin").first()
-    if not admin_role:
-        return True
-    link = db.query(UserRole).filter(UserRole.user_id == user_id, UserRole.role_id == admin_role.id).first()
-    return link is not None
-
-
-def _get_residents(db: Session) -> list[User]:
-    # Prefer explicit 'resident' role if present; otherwise return all active non-admin users.
-    resident_role = db.query(Role).filter(func.lower(Role.name) == "resident").first()
-    if resident_role:
-        return (
-            db.query(User)
-            .join(UserRole, UserRole.user_id == User.id)
-            .filter(UserRole.role_id == resident_role.id)
-            .filter(User.is_active == 1)
-            .order_by(User.id.asc())
-            .all()
-        )
+FAN_OUT_CHUNK_SIZE = 5000
 
-    # Fallback: active users who are not admins (or if no admin role exists, then all active)
-    admin_role = db.query(Role).filter(func.lower(Role.name) == "admin").first()
-    if not admin_role:
-        return db.query(User).filter(User.is_active == 1).order_by(User.id.asc()).all()
-
-    admin_user_ids = {ur.user_id for ur in db.query(UserRole).filter(UserRole.role_id == admin_role.id).all()}
-    return (
-        db.query(User)
-        .filter(User.is_active == 1)
-        .filter(~User.id.in_(admin_user_ids))
-        .order_by(User.id.asc())
-        .all()
-    )
+
+def _fan_out_recipients(db: Session, broadcast_id: int, audience: str = ALL_RESIDENTS) -> int:
+    """Create one queued BroadcastRecipient per audience member with chunked bulk INSERTs.
+
+    Recipient ids come straight from the cached membership sets, so no User rows are
+    loaded. Does not commit; the caller owns the transaction.
+    """
+    recipients = named_audiences.resolve(db, audience)
+    for chunk in recipients.chunks(FAN_OUT_CHUNK_SIZE):
+        db.execute(
+            insert(BroadcastRecipient),
+            [{"broadcast_id": broadcast_id, "user_id": uid, "status": "queued", "attempts": 0} for uid in chunk],
+        )
+    return len(recipients)
 
 
 def _priority_for(msg_type: str) -> int:
@@ -67,8 +60,9 @@ def _priority_for(msg_type: str) -> int:
     return 10
 
 
-def _require_admin(db: Session, current_user: User):
-    if not _is_admin(db, current_user.id):
+def _require_admin(db, current_user: Principal):
+    # Admin status is resolved (and cached) by verify_token.
+    if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Admins only")
 
 
@@ -76,13 +70,16 @@ def _require_admin(db: Session, current_user: User):
 def overview(
     request: Request,
     db: Session = Depends(get_db),
-    current_user: User = Depends(verify_token),
+    current_user: Principal = Depends(verify_token),
 ):
     _require_admin(db, current_user)
 
-    total = db.query(BroadcastMessage).count()
-    queued = db.query(BroadcastMessage).filter(BroadcastMessage.status == "queued").count()
-    drafts = db.query(BroadcastMessage).filter(BroadcastMessage.status == "draft").count()
+    # Served from the in-memory counters; only the SOS list hits the database (indexed).
+    stats = live_stats.snapshot()
+    by_status = stats["broadcasts_by_status"]
+    total = stats["broadcasts_total"]
+    queued = by_status.get("queued", 0)
+    drafts = by_status.get("draft", 0)
     recent_sos = (
         db.query(BroadcastMessage)
         .filter(BroadcastMessage.msg_type == "sos")
@@ -97,41 +94,93 @@ def overview(
         "total": total,
         "queued": queued,
         "drafts": drafts,
+        "queued_recipients": stats["queued_recipients"],
         "recent_sos": recent_sos,
     })
 
 
-@router.get("/broadcasts", response_class=HTMLResponse)
-def broadcasts_page(
-    request: Request,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(verify_token),
-    success: Optional[str] = None,
-    error: Optional[str] = None,
-):
-    _require_admin(db, current_user)
+def _audience_choices(db: Session) -> tuple[int, list[dict]]:
+    """Resident count and named audiences for the create form, from the cached sets."""
+    return len(resident_audience.snapshot(db)), named_audiences.summaries(db)
+
 
+def _recent_broadcasts(db: Session) -> tuple[list[BroadcastMessage], int, list[dict]]:
     broadcasts = (
         db.query(BroadcastMessage)
         .order_by(desc(BroadcastMessage.created_at))
         .limit(100)
         .all()
     )
+    return broadcasts, *_audience_choices(db)
 
-    residents = _get_residents(db)
 
-    return templates.TemplateResponse("admin_broadcasts.html", {
-        "request": request,
-        "current_user": current_user,
-        "broadcasts": broadcasts,
-        "resident_count": len(residents),
-        "success": success,
-        "error": error,
-    })
+def _search_broadcasts(db: Session, q: str, cursor: Optional[str]) -> tuple[dict, int, list[dict]]:
+    results = search_index.search(db, q, kinds=["broadcast", "event"], cursor=cursor)
+    return results, *_audience_choices(db)
+
+
+@router.get("/broadcasts", response_class=HTMLResponse)
+async def broadcasts_page(
+    request: Request,
+    db: DbRunner = Depends(get_async_db),
+    current_user: Principal = Depends(verify_token),
+    success: Optional[str] = None,
+    error: Optional[str] = None,
+    q: Optional[str] = None,
+    cursor: Optional[str] = None,
+):
+    _require_admin(db, current_user)
+
+    context = {"request": request, "current_user": current_user, "success": success, "error": error, "q": q}
+    if q:
+        # Subjects, bodies and event messages matching the search, best first.
+        try:
+            results, resident_count, audiences = await db.run(_search_broadcasts, q, cursor)
+        except HTTPException as exc:
+            results, resident_count, audiences = {"items": [], "next_cursor": None}, None, []
+            context["search_error"] = exc.detail
+        context.update(results=results["items"], next_cursor=results["next_cursor"], broadcasts=[])
+    else:
+        broadcasts, resident_count, audiences = await db.run(_recent_broadcasts)
+        context["broadcasts"] = broadcasts
+    context.update(resident_count=resident_count, audiences=audiences)
+
+    return templates.TemplateResponse("admin_broadcasts.html", context)
+
+
+def _create_broadcast(db: Session, b: BroadcastMessage) -> tuple[int, float]:
+    """Write the broadcast, its events and its recipients in one transaction.
+
+    Returns the number of recipients created and the elapsed time in milliseconds.
+    """
+    started = time.perf_counter()
+    status = b.status
+    try:
+        db.add(b)
+        db.flush()
+
+        db.add(BroadcastEvent(broadcast_id=b.id, event_type="created", message=f"Created as {status.upper()}"))
+        if status == "queued":
+            db.add(BroadcastEvent(broadcast_id=b.id, event_type="queued", message="Queued for dispatch"))
+
+        # Pre-create recipients for tracking.
+        recipient_count = _fan_out_recipients(db, b.id, b.audience)
+        delivery_counters.init(db, b.id, queued=recipient_count)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        db.add(BroadcastEvent(
+            broadcast_id=b.id,
+            event_type="recipients_created",
+            message=f"{recipient_count} recipients created in {elapsed_ms:.0f} ms",
+        ))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return recipient_count, elapsed_ms
 
 
 @router.post("/broadcasts")
-def create_broadcast(
+async def create_broadcast(
     request: Request,
     msg_type: str = Form("announcement"),
     severity: str = Form("info"),
@@ -139,8 +188,10 @@ def create_broadcast(
     body: str = Form(...),
     ttl_hours: int = Form(24),
     action: str = Form("draft"),  # draft or queue
-    db: Session = Depends(get_db),
-    current_user: User = Depends(verify_token),
+    audience_ids: list[int] = Form([]),  # named audiences; none means all residents
+    audience_mode: str = Form("any"),  # any (union) or all (intersection)
+    db: DbRunner = Depends(get_async_db),
+    current_user: Principal = Depends(verify_token),
 ):
     _require_admin(db, current_user)
 
@@ -161,59 +212,38 @@ def create_broadcast(
 
     status = "draft" if action == "draft" else "queued"
     priority = _priority_for(msg_type)
+    try:
+        audience = format_spec((audience_mode or "any").lower(), audience_ids)
+    except ValueError as exc:
+        return RedirectResponse(url=f"/admin/messaging/broadcasts?error={quote(str(exc))}", status_code=303)
 
     b = BroadcastMessage(
         created_by=current_user.id,
         msg_type=msg_type,
         severity=severity,
-        audience="all_residents",
+        audience=audience,
         subject=subject.strip(),
         body=body.strip(),
         status=status,
         priority=priority,
         ttl_expires_at=ttl_expires_at,
     )
-    db.add(b)
-    db.commit()
-    db.refresh(b)
+    try:
+        recipient_count, elapsed_ms = await db.run(_create_broadcast, b)
+    except ValueError as exc:  # an audience was deleted while the form was open
+        return RedirectResponse(url=f"/admin/messaging/broadcasts?error={quote(str(exc))}", status_code=303)
 
-    db.add(BroadcastEvent(broadcast_id=b.id, event_type="created", message=f"Created as {status.upper()}"))
-    if status == "queued":
-        db.add(BroadcastEvent(broadcast_id=b.id, event_type="queued", message="Queued for dispatch"))
-    db.commit()
+    success = f"Broadcast created: {recipient_count} recipients in {elapsed_ms:.0f} ms"
+    return RedirectResponse(url=f"/admin/messaging/broadcasts?success={quote(success)}", status_code=303)
 
-    # Pre-create recipients for tracking.
-    residents = _get_residents(db)
-    for u in residents:
-        db.add(BroadcastRecipient(broadcast_id=b.id, user_id=u.id, status=("queued" if status == "queued" else "queued")))
-    db.commit()
-
-    return RedirectResponse(url="/admin/messaging/broadcasts?success=Broadcast%20created", status_code=303)
-
-
-@router.get("/broadcasts/{broadcast_id}", response_class=HTMLResponse)
-def broadcast_detail(
-    broadcast_id: int,
-    request: Request,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(verify_token),
-    success: Optional[str] = None,
-    error: Optional[str] = None,
-):
-    _require_admin(db, current_user)
 
+def _broadcast_detail(db: Session, broadcast_id: int):
     b = db.query(BroadcastMessage).filter(BroadcastMessage.id == broadcast_id).first()
     if not b:
         raise HTTPException(status_code=404, detail="Broadcast not found")
 
     # Summary counts
-    status_counts = dict(
-        db.query(BroadcastRecipient.status, func.count(BroadcastRecipient.id))
-        .filter(BroadcastRecipient.broadcast_id == broadcast_id)
-        .group_by(BroadcastRecipient.status)
-        .all()
-    )
-    total = sum(status_counts.values()) if status_counts else 0
+    status_counts = delivery_counters.counts_for(db, [broadcast_id])[broadcast_id]
 
     events = (
         db.query(BroadcastEvent)
@@ -222,6 +252,24 @@ def broadcast_detail(
         .limit(50)
         .all()
     )
+    return b, status_counts, events, named_audiences.describe(db, b.audience)
+
+
+@router.get("/broadcasts/{broadcast_id}", response_class=HTMLResponse)
+async def broadcast_detail(
+    broadcast_id: int,
+    request: Request,
+    db: DbRunner = Depends(get_async_db),
+    current_user: Principal = Depends(verify_token),
+    success: Optional[str] = None,
+    error: Optional[str] = None,
+):
+    _require_admin(db, current_user)
+
+    # Read before the counts so the live stream replays anything committed meanwhile.
+    progress_seq = progress_hub.seq
+    b, status_counts, events, audience_label = await db.run(_broadcast_detail, broadcast_id)
+    total = sum(status_counts.values())
 
     return templates.TemplateResponse("admin_broadcast_detail.html", {
         "request": request,
@@ -230,6 +278,8 @@ def broadcast_detail(
         "status_counts": status_counts,
         "total": total,
         "events": events,
+        "audience_label": audience_label,
+        "progress_seq": progress_seq,
         "success": success,
         "error": error,
     })
@@ -239,7 +289,7 @@ def broadcast_detail(
 def mark_sent(
     broadcast_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(verify_token),
+    current_user: Principal = Depends(verify_token),
 ):
     _require_admin(db, current_user)
 
@@ -248,12 +298,9 @@ def mark_sent(
         raise HTTPException(status_code=404, detail="Broadcast not found")
 
     b.status = "sent"
-    # Mark all recipients as sent (simulation)
+    # Mark undelivered recipients as sent (simulation)
     now = datetime.now(timezone.utc)
-    db.query(BroadcastRecipient).filter(BroadcastRecipient.broadcast_id == broadcast_id).update(
-        {"status": "sent", "sent_at": now},
-        synchronize_session=False,
-    )
+    delivery_counters.transition(db, broadcast_id, "sent", ["queued", "failed"], values={"sent_at": now})
     db.add(BroadcastEvent(broadcast_id=b.id, event_type="marked_sent", message="Marked as SENT (simulation)"))
     db.commit()
 
@@ -264,7 +311,7 @@ def mark_sent(
 def cancel_broadcast(
     broadcast_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(verify_token),
+    current_user: Principal = Depends(verify_token),
 ):
     _require_admin(db, current_user)
 
@@ -279,11 +326,151 @@ def cancel_broadcast(
     return RedirectResponse(url=f"/admin/messaging/broadcasts/{broadcast_id}?success=Cancelled", status_code=303)
 
 
+AUDIENCE_PREVIEW_SAMPLE = 10
+_MEMBER_SEPARATORS = re.compile(r"[\s,;]+")
+
+
+def _audience_ids_param(ids: Optional[str]) -> list[int]:
+    try:
+        return [int(i) for i in (ids or "").split(",") if i.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid audience ids")
+
+
+@router.get("/audiences", response_class=HTMLResponse)
+def audiences_page(
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(verify_token),
+    success: Optional[str] = None,
+    error: Optional[str] = None,
+):
+    _require_admin(db, current_user)
+
+    return templates.TemplateResponse("admin_audiences.html", {
+        "request": request,
+        "current_user": current_user,
+        "audiences": named_audiences.summaries(db),
+        "resident_count": len(resident_audience.snapshot(db)),
+        "kinds": AUDIENCE_KINDS,
+        "fog_devices": db.query(FogDevice.id, FogDevice.name).order_by(FogDevice.id).all(),
+        "roles": sorted({"admin", "mobile", *(name for (name,) in db.query(Role.name))}),
+        "success": success,
+        "error": error,
+    })
+
+
+def _resolve_members(db: Session, text: str) -> tuple[set[int], list[str]]:
+    """User ids for whitespace/comma separated ids, usernames or emails; also returns what matched nobody."""
+    tokens = {t for t in _MEMBER_SEPARATORS.split(text or "") if t}
+    numbers = {int(t) for t in tokens if t.isdigit()}
+    rows = db.query(User.id, User.username, User.email).filter(or_(
+        User.id.in_(numbers), User.username.in_(tokens), User.email.in_(tokens),
+    )).all()
+    found = {str(r.id) for r in rows} | {r.username for r in rows} | {r.email for r in rows}
+    return {r.id for r in rows}, sorted(tokens - found)
+
+
+@router.post("/audiences")
+def create_audience(
+    name: str = Form(...),
+    kind: str = Form(...),
+    value: str = Form(""),
+    members: str = Form(""),
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(verify_token),
+):
+    _require_admin(db, current_user)
+
+    def fail(message: str):
+        return RedirectResponse(url=f"/admin/messaging/audiences?error={quote(message)}", status_code=303)
+
+    name, value = name.strip(), value.strip()
+    if not name or len(name) > 100:
+        return fail("Name is required (up to 100 characters)")
+    if kind not in AUDIENCE_KINDS:
+        return fail(f"Kind must be one of: {', '.join(AUDIENCE_KINDS)}")
+    if kind != "list" and (not value or len(value) > 100):
+        return fail(f"A {kind.replace('_', ' ')} audience needs a value")
+    if kind == "fog_node" and not (value.isdigit() and db.query(FogDevice.id).filter(FogDevice.id == int(value)).first()):
+        return fail("Unknown fog node")
+    if db.query(Audience.id).filter(Audience.name == name).first():
+        return fail("An audience with that name already exists")
+
+    audience = Audience(name=name, kind=kind, value=value if kind != "list" else None, created_by=current_user.id)
+    db.add(audience)
+    db.flush()
+    missing = []
+    if kind == "list":
+        user_ids, missing = _resolve_members(db, members)
+        if user_ids:
+            # Core INSERT skips the session hooks, but the new Audience row already
+            # invalidates the cached sets on commit.
+            db.execute(insert(AudienceMember), [{"audience_id": audience.id, "user_id": uid} for uid in sorted(user_ids)])
+    db.commit()
+
+    success = f"Audience '{name}' created"
+    if missing:
+        success += f"; not found: {', '.join(missing[:20])}{' ...' if len(missing) > 20 else ''}"
+    return RedirectResponse(url=f"/admin/messaging/audiences?success={quote(success)}", status_code=303)
+
+
+@router.post("/audiences/{audience_id}/delete")
+def delete_audience(
+    audience_id: int,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(verify_token),
+):
+    _require_admin(db, current_user)
+
+    audience = db.query(Audience).filter(Audience.id == audience_id).first()
+    if not audience:
+        raise HTTPException(status_code=404, detail="Audience not found")
+    # SQLite does not enforce ON DELETE CASCADE here (foreign keys are off), and a
+    # new audience can reuse the id, so the members go explicitly.
+    db.query(AudienceMember).filter(AudienceMember.audience_id == audience_id).delete(synchronize_session=False)
+    db.delete(audience)
+    db.commit()
+
+    return RedirectResponse(url="/admin/messaging/audiences?success=Audience%20deleted", status_code=303)
+
+
+@router.get("/audiences/preview")
+def preview_audience(
+    ids: Optional[str] = None,
+    mode: str = "any",
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(verify_token),
+):
+    """Recipient count and a few sample members for an audience selection, from the cached sets."""
+    _require_admin(db, current_user)
+
+    try:
+        spec = format_spec(mode, _audience_ids_param(ids))
+        recipients = named_audiences.resolve(db, spec)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    sample_ids = list(islice(recipients, AUDIENCE_PREVIEW_SAMPLE))
+    sample = []
+    if sample_ids:
+        sample = [
+            {"id": r.id, "username": r.username}
+            for r in db.query(User.id, User.username).filter(User.id.in_(sample_ids)).order_by(User.id)
+        ]
+    return {
+        "audience": spec,
+        "label": named_audiences.describe(db, spec),
+        "count": len(recipients),
+        "sample": sample,
+    }
+
+
 @router.get("/sos", response_class=HTMLResponse)
 def sos_console(
     request: Request,
     db: Session = Depends(get_db),
-    current_user: User = Depends(verify_token),
+    current_user: Principal = Depends(verify_token),
 ):
     _require_admin(db, current_user)
 
@@ -306,7 +493,7 @@ def sos_console(
 def queue_monitor(
     request: Request,
     db: Session = Depends(get_db),
-    current_user: User = Depends(verify_token),
+    current_user: Principal = Depends(verify_token),
 ):
     _require_admin(db, current_user)
 
@@ -336,11 +523,12 @@ def queue_monitor(
 @router.get("/tracking", response_class=HTMLResponse)
 def tracking(
     request: Request,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(verify_token),
+    db: Session = Depends(get_read_db),
+    current_user: Principal = Depends(verify_token),
 ):
     _require_admin(db, current_user)
 
+    progress_seq = progress_hub.seq
     broadcasts = (
         db.query(BroadcastMessage)
         .order_by(desc(BroadcastMessage.created_at))
@@ -348,38 +536,94 @@ def tracking(
         .all()
     )
 
-    # Build summary per broadcast
+    # Build summary per broadcast from the materialized counters (no per-row aggregation)
+    all_counts = delivery_counters.counts_for(db, [b.id for b in broadcasts])
     summaries = []
     for b in broadcasts:
-        counts = dict(
-            db.query(BroadcastRecipient.status, func.count(BroadcastRecipient.id))
-            .filter(BroadcastRecipient.broadcast_id == b.id)
-            .group_by(BroadcastRecipient.status)
-            .all()
-        )
-        total = sum(counts.values()) if counts else 0
+        counts = all_counts[b.id]
         summaries.append({
             "b": b,
-            "total": total,
-            "sent": counts.get("sent", 0),
-            "delivered": counts.get("delivered", 0),
-            "read": counts.get("read", 0),
-            "failed": counts.get("failed", 0),
-            "queued": counts.get("queued", 0),
+            "total": sum(counts.values()),
+            **counts,
         })
 
     return templates.TemplateResponse("admin_tracking.html", {
         "request": request,
         "current_user": current_user,
         "summaries": summaries,
+        "progress_seq": progress_seq,
     })
 
 
+PROGRESS_HEARTBEAT_SECONDS = 15.0
+
+
+def _sse(event: str, data: dict, event_id: Optional[int] = None) -> str:
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@router.get("/progress/stream")
+async def progress_stream(
+    request: Request,
+    ids: Optional[str] = None,
+    since: Optional[int] = None,
+    timeout: float = Query(300.0, gt=0, le=3600),
+    last_event_id: Optional[str] = Header(None),
+    current_user: Principal = Depends(verify_token),
+):
+    """Server-Sent Events with delivery counter deltas as recipients change status.
+
+    ``ids`` limits the stream to a comma-separated list of broadcasts (default: all).
+    Events after ``since`` (or the browser's ``Last-Event-ID`` on reconnect) are
+    replayed first; a ``resync`` event means the gap could not be replayed and the
+    page should reload. The server closes the stream after ``timeout`` seconds and
+    the browser reconnects. Served entirely from memory, without a database session.
+    """
+    _require_admin(None, current_user)
+
+    try:
+        watch = {int(i) for i in ids.split(",") if i.strip()} if ids else None
+        if last_event_id:
+            since = int(last_event_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid broadcast ids or event id")
+
+    sub = progress_hub.subscribe(watch, since)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+
+    async def events():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0 or await request.is_disconnected():
+                    return
+                try:
+                    item = await sub.get(min(remaining, PROGRESS_HEARTBEAT_SECONDS))
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if item is RESYNC:
+                    yield _sse("resync", {})
+                    return
+                yield _sse("progress", {"broadcast_id": item.broadcast_id, "deltas": item.deltas}, item.seq)
+        finally:
+            progress_hub.unsubscribe(sub)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.get("/testing", response_class=HTMLResponse)
 def testing(
     request: Request,
     db: Session = Depends(get_db),
-    current_user: User = Depends(verify_token),
+    current_user: Principal = Depends(verify_token),
 ):
     _require_admin(db, current_user)
 
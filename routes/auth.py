@@ -1,12 +1,18 @@
-import bcrypt
 import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
 from fastapi import Depends, HTTPException, Cookie
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from dotenv import load_dotenv
 from database.deps import get_db
-from database.models import User
+from database.models import User, Role, UserRole
+from services.passwords import password_hasher
 
 load_dotenv()
 
@@ -18,21 +24,11 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    # Truncate password if needed
-    password_bytes = plain_password.encode('utf-8')
-    if len(password_bytes) > 72:
-        password_bytes = password_bytes[:72]
-    
-    return bcrypt.checkpw(password_bytes, hashed_password.encode('utf-8'))
+    # Runs on the bounded bcrypt pool; raises 503 when it is saturated.
+    return password_hasher.verify_sync(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
-    # Truncate password if needed
-    password_bytes = password.encode('utf-8')
-    if len(password_bytes) > 72:
-        password_bytes = password_bytes[:72]
-    
-    hashed = bcrypt.hashpw(password_bytes, bcrypt.gensalt())
-    return hashed.decode('utf-8')
+    return password_hasher.hash_sync(password)
 
 def create_access_token(data: dict):
     to_encode = data.copy()
@@ -40,7 +36,91 @@ def create_access_token(data: dict):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def verify_token(access_token: str = Cookie(None), db: Session = Depends(get_db)):
+@dataclass(frozen=True)
+class Principal:
+    """The authenticated user as seen by request handlers, detached from any session."""
+    id: int
+    email: str
+    username: Optional[str]
+    role: str
+    is_active: bool
+    created_at: Optional[datetime]
+    roles: frozenset
+    is_admin: bool
+
+
+class PrincipalCache:
+    """Bounded LRU of resolved principals keyed by token subject, with a TTL per entry."""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple[float, Principal]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, subject: str) -> Optional[Principal]:
+        with self._lock:
+            entry = self._entries.get(subject)
+            if entry is None:
+                return None
+            expires_at, principal = entry
+            if expires_at < time.monotonic():
+                del self._entries[subject]
+                return None
+            self._entries.move_to_end(subject)
+            return principal
+
+    def put(self, subject: str, principal: Principal) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[subject] = (time.monotonic() + self.ttl_seconds, principal)
+            self._entries.move_to_end(subject)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, subject: str) -> None:
+        with self._lock:
+            self._entries.pop(subject, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+principal_cache = PrincipalCache(
+    max_entries=int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000")),
+    ttl_seconds=float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60")),
+)
+
+
+def _resolve_principal(db: Session, email: str) -> Optional[Principal]:
+    user = db.query(User).filter(User.email == email).first()
+    if user is None:
+        return None
+
+    role_names = frozenset(
+        name.lower()
+        for (name,) in db.query(Role.name)
+        .join(UserRole, UserRole.role_id == Role.id)
+        .filter(UserRole.user_id == user.id)
+    )
+    # Dev-friendly: if the 'admin' role doesn't exist yet, everyone counts as admin.
+    admin_role_exists = db.query(Role.id).filter(func.lower(Role.name) == "admin").first() is not None
+
+    return Principal(
+        id=user.id,
+        email=user.email,
+        username=user.username,
+        role=user.role,
+        is_active=bool(user.is_active),
+        created_at=user.created_at,
+        roles=role_names,
+        is_admin=("admin" in role_names) or not admin_role_exists,
+    )
+
+
+def verify_token(access_token: str = Cookie(None), db: Session = Depends(get_db)) -> Principal:
     if not access_token:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
@@ -51,10 +131,13 @@ def verify_token(access_token: str = Cookie(None), db: Session = Depends(get_db)
         if email is None:
             raise HTTPException(status_code=401, detail="Invalid token")
         
-        user = db.query(User).filter(User.email == email).first()
-        if user is None:
-            raise HTTPException(status_code=401, detail="User not found")
+        principal = principal_cache.get(email)
+        if principal is None:
+            principal = _resolve_principal(db, email)
+            if principal is None:
+                raise HTTPException(status_code=401, detail="User not found")
+            principal_cache.put(email, principal)
         
-        return user
+        return principal
     except JWTError:
-        raise HTTPException(status_code=401, detail="Invalid token")
\ No newline at end of file
+        raise HTTPException(status_code=401, detail="Invalid token")
@@ -0,0 +1,96 @@
+from datetime import datetime, timezone
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+
+from routes.auth import Principal, verify_token
+from services.export import EVENTS, FORMATS, RECIPIENTS, Dataset, ExportFilter, exporter
+
+router = APIRouter(prefix="/api/exports", tags=["Exports"])
+
+RECIPIENT_STATUSES = ("queued", "sent", "delivered", "read", "failed")
+
+def _parse_time(name: str, value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be an ISO date or date-time")
+    # Stored times are naive UTC.
+    return parsed.astimezone(timezone.utc).replace(tzinfo=None) if parsed.tzinfo else parsed
+
+def _parse_ids(value: Optional[str]) -> Optional[list]:
+    if not value:
+        return None
+    try:
+        return [int(i) for i in value.split(",") if i.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="broadcast_id must be a comma-separated list of ids")
+
+def _export(dataset: Dataset, export_filter: ExportFilter, format: str, current_user: Principal) -> StreamingResponse:
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can export delivery records")
+    if export_filter.since and export_filter.until and export_filter.since >= export_filter.until:
+        raise HTTPException(status_code=400, detail="since must be before until")
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    return StreamingResponse(
+        exporter.stream(dataset, export_filter, format),
+        media_type=FORMATS[format],
+        headers={
+            "Content-Disposition": f'attachment; filename="{dataset.name}-{stamp}.{format}"',
+            "Cache-Control": "no-store",
+        },
+    )
+
+@router.get("/broadcast-events")
+def export_broadcast_events(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    broadcast_id: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    archived: bool = False,
+    current_user: Principal = Depends(verify_token),
+):
+    """Stream broadcast events as NDJSON or CSV, in id order.
+
+    ``broadcast_id`` is a comma-separated list; ``since`` (inclusive) and ``until``
+    (exclusive) are ISO dates or date-times on the event time, UTC unless an
+    offset is given. ``archived=true`` adds rows moved out by the retention job.
+    """
+    export_filter = ExportFilter(
+        broadcast_ids=_parse_ids(broadcast_id),
+        since=_parse_time("since", since),
+        until=_parse_time("until", until),
+        include_archived=archived,
+    )
+    return _export(EVENTS, export_filter, format, current_user)
+
+@router.get("/broadcast-recipients")
+def export_broadcast_recipients(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    broadcast_id: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    status: Optional[str] = None,
+    archived: bool = False,
+    current_user: Principal = Depends(verify_token),
+):
+    """Stream delivery records (one row per broadcast recipient) as NDJSON or CSV.
+
+    Filters as for events, except that ``since``/``until`` select broadcasts by
+    their creation time; ``status`` is a comma-separated list of delivery statuses.
+    """
+    statuses = [s.strip() for s in status.split(",") if s.strip()] if status else None
+    unknown = set(statuses or ()) - set(RECIPIENT_STATUSES)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown statuses: {', '.join(sorted(unknown))}")
+    export_filter = ExportFilter(
+        broadcast_ids=_parse_ids(broadcast_id),
+        since=_parse_time("since", since),
+        until=_parse_time("until", until),
+        statuses=statuses,
+        include_archived=archived,
+    )
+    return _export(RECIPIENTS, export_filter, format, current_user)
@@ -0,0 +1,105 @@
+import hmac
+import os
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from pydantic import BaseModel
+
+from database.deps import get_async_db, get_async_read_db, DbRunner
+from routes.auth import Principal, verify_token
+from services import fog_sync
+from services.telemetry import telemetry
+
+router = APIRouter(prefix="/api/fog", tags=["Fog Nodes"])
+
+FOG_NODE_TOKEN = os.getenv("FOG_NODE_TOKEN")
+
+class Heartbeat(BaseModel):
+    node: str                    # fog node name; registered on first heartbeat
+    connected_users: int = 0
+    storage_used_bytes: Optional[int] = None
+    storage_free_bytes: Optional[int] = None
+    latency_ms: Optional[float] = None
+
+def _check_node_token(authorization: Optional[str]) -> None:
+    # Nodes authenticate with a shared bearer token; without one configured the
+    # node endpoints stay closed (they register devices and hand out message data).
+    if not FOG_NODE_TOKEN:
+        raise HTTPException(status_code=503, detail="Fog node access is disabled; set FOG_NODE_TOKEN")
+    if not hmac.compare_digest((authorization or "").encode(), f"Bearer {FOG_NODE_TOKEN}".encode()):
+        raise HTTPException(status_code=401, detail="Invalid fog node token")
+
+@router.post("/telemetry", status_code=202)
+async def heartbeat(
+    payload: Heartbeat,
+    authorization: Optional[str] = Header(None),
+    db: DbRunner = Depends(get_async_db),
+):
+    _check_node_token(authorization)
+
+    device_id = telemetry.device_id(payload.node)
+    if device_id is None:
+        # Only a node's first heartbeat touches the database.
+        device_id = await db.run(telemetry.register, payload.node)
+    telemetry.record(
+        device_id,
+        connected_users=payload.connected_users,
+        storage_used=payload.storage_used_bytes,
+        storage_free=payload.storage_free_bytes,
+        latency_ms=payload.latency_ms,
+    )
+    return {"device_id": device_id}
+
+@router.get("/nodes")
+def list_nodes(current_user: Principal = Depends(verify_token)):
+    return {"nodes": telemetry.nodes(), "totals": telemetry.totals()}
+
+@router.get("/nodes/{device_id}/samples")
+def node_samples(device_id: int, limit: Optional[int] = None, current_user: Principal = Depends(verify_token)):
+    samples = telemetry.samples(device_id, limit)
+    if samples is None:
+        raise HTTPException(status_code=404, detail="Fog node not found")
+    return {"device_id": device_id, "samples": samples}
+
+@router.get("/sync")
+async def sync(
+    node: str,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    authorization: Optional[str] = Header(None),
+    accept: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+    db: DbRunner = Depends(get_async_read_db),
+):
+    """Everything a fog node has not forwarded yet, one resumable chunk at a time.
+
+    Only what concerns the users assigned to the node (``user_locations``) is sent:
+    their recipient assignments, the broadcasts those belong to, and direct
+    messages addressed to them.
+
+    Start without ``cursor``, then pass back the returned ``cursor`` while
+    ``has_more`` is true; keep the last one for the next poll. Responses carry an
+    ETag, and a poll with a matching ``If-None-Match`` gets a 304 when nothing is new.
+    Send ``Accept: application/msgpack`` for msgpack (if installed on the server) and
+    ``Accept-Encoding: deflate`` or ``gzip`` for a compressed body.
+    """
+    _check_node_token(authorization)
+    device_id = telemetry.device_id(node)
+    if device_id is None:
+        raise HTTPException(status_code=404, detail="Unknown fog node; send a heartbeat first")
+
+    position = fog_sync.parse_cursor(cursor)
+    chunk = fog_sync.clamp_chunk(limit)
+    media, coding = fog_sync.negotiate(accept, accept_encoding)
+
+    current_head = await db.run(fog_sync.head)
+    tag = fog_sync.etag(position, chunk, current_head, f"{device_id};{media};{coding}")
+    headers = {"ETag": tag, "Vary": "Accept, Accept-Encoding", "Cache-Control": "no-cache"}
+    if if_none_match == tag:
+        return Response(status_code=304, headers=headers)
+
+    payload = await db.run(fog_sync.build_chunk, device_id, position, chunk, current_head)
+    if coding:
+        headers["Content-Encoding"] = coding
+    return Response(content=fog_sync.encode(payload, media, coding), media_type=media, headers=headers)
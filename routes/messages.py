@@ -1,10 +1,14 @@
+from collections import defaultdict
+
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, aliased
 from pydantic import BaseModel
 from typing import List, Optional
 
-from database.deps import get_db
+from database.deps import get_read_db, get_async_db, get_async_read_db, DbRunner
 from database.models import Message, MessageRecipient, User
+from routes.auth import Principal, verify_token
+from routes.pagination import clamp_limit, decode_cursor, encode_cursor, raw_key, before
 
 router = APIRouter(prefix="/api/messages", tags=["Messages"])
 
@@ -14,8 +18,7 @@ class MessageCreate(BaseModel):
     body: str
     recipient_ids: List[int]
 
-@router.post("")
-def send_message(payload: MessageCreate, db: Session = Depends(get_db)):
+def _send_message(db: Session, payload: MessageCreate) -> dict:
     sender = db.query(User).filter(User.id == payload.sender_id).first()
     if not sender:
         raise HTTPException(status_code=404, detail="Sender not found")
@@ -35,25 +38,126 @@ def send_message(payload: MessageCreate, db: Session = Depends(get_db)):
     db.commit()
     return {"message_id": msg.id, "sent_to": payload.recipient_ids}
 
+@router.post("")
+async def send_message(payload: MessageCreate, db: DbRunner = Depends(get_async_db)):
+    return await db.run(_send_message, payload)
+
 @router.get("/inbox/{user_id}")
-def inbox(user_id: int, db: Session = Depends(get_db)):
-    rows = (
+async def inbox(
+    user_id: int,
+    cursor: Optional[str] = None,
+    since: Optional[str] = None,
+    limit: int = 50,
+    db: DbRunner = Depends(get_async_read_db),
+):
+    """A user's inbox, one page at a time.
+
+    Without ``since`` pages go newest first; pass ``next_cursor`` back as ``cursor``
+    for older messages. Keep ``sync_cursor`` and pass it later as ``since`` to fetch
+    only messages that arrived after it (oldest first, repeat while ``has_more``).
+    Pages follow message_recipients(user_id, message_id), so each one is an index
+    range scan.
+    """
+    return await db.run(_inbox_page, user_id, cursor, since, limit)
+
+def _inbox_page(db: Session, user_id: int, cursor: Optional[str], since: Optional[str], limit: int) -> dict:
+    limit = clamp_limit(limit)
+    q = (
         db.query(MessageRecipient, Message)
         .join(Message, Message.id == MessageRecipient.message_id)
         .filter(MessageRecipient.user_id == user_id)
-        .order_by(Message.created_at.desc())
-        .all()
     )
+    if since:
+        (since_id,) = decode_cursor(since, 1, (int,))
+        q = q.filter(MessageRecipient.message_id > since_id).order_by(MessageRecipient.message_id.asc())
+    else:
+        if cursor:
+            (before_id,) = decode_cursor(cursor, 1, (int,))
+            q = q.filter(MessageRecipient.message_id < before_id)
+        q = q.order_by(MessageRecipient.message_id.desc())
+    rows = q.limit(limit + 1).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    if since:
+        next_cursor = None
+        sync_cursor = encode_cursor(rows[-1][1].id) if rows else since
+    else:
+        next_cursor = encode_cursor(rows[-1][1].id) if has_more else None
+        # Only the first page knows the newest message; later pages leave sync state alone.
+        sync_cursor = encode_cursor(rows[0][1].id if rows else 0) if not cursor else None
 
-    return [
+    return {
+        "items": [
+            {
+                "message_id": m.id,
+                "from_user_id": m.sender_id,
+                "subject": m.subject,
+                "body": m.body,
+                "status": mr.status,
+                "created_at": str(m.created_at),
+                "read_at": str(mr.read_at) if mr.read_at else None,
+            }
+            for (mr, m) in rows
+        ],
+        "has_more": has_more,
+        "next_cursor": next_cursor,
+        "sync_cursor": sync_cursor,
+    }
+
+def message_log_page(db: Session, cursor: Optional[str] = None, limit: Optional[int] = None) -> dict:
+    """One page of the message log, newest first, keyset-paginated on (created_at, id).
+
+    Uses two queries regardless of page size: one for the messages and their
+    senders, one for the recipients of every message on the page.
+    """
+    limit = clamp_limit(limit)
+    Sender = aliased(User)
+    created_key = raw_key(Message.created_at)
+
+    q = db.query(
+        Message.id,
+        Message.body,
+        Message.created_at,
+        created_key.label("created_key"),
+        Sender.username.label("sender_username"),
+    ).join(Sender, Message.sender_id == Sender.id)
+    if cursor:
+        ts_key, id_key = decode_cursor(cursor, 2, (str, int))
+        q = q.filter(before(Message.created_at, Message.id, ts_key, id_key))
+    rows = q.order_by(created_key.desc(), Message.id.desc()).limit(limit + 1).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    recipients = defaultdict(list)
+    if rows:
+        for message_id, username in (
+            db.query(MessageRecipient.message_id, User.username)
+            .join(User, User.id == MessageRecipient.user_id)
+            .filter(MessageRecipient.message_id.in_([r.id for r in rows]))
+        ):
+            recipients[message_id].append(username)
+
+    items = [
         {
-            "message_id": m.id,
-            "from_user_id": m.sender_id,
-            "subject": m.subject,
-            "body": m.body,
-            "status": mr.status,
-            "created_at": str(m.created_at),
-            "read_at": str(mr.read_at) if mr.read_at else None,
+            "id": r.id,
+            "from": r.sender_username,
+            "to": recipients[r.id],
+            "message": r.body,
+            "date": r.created_at,
         }
-        for (mr, m) in rows
+        for r in rows
     ]
+    next_cursor = encode_cursor(rows[-1].created_key, rows[-1].id) if has_more else None
+    return {"items": items, "next_cursor": next_cursor}
+
+@router.get("/log")
+def message_log(
+    cursor: Optional[str] = None,
+    limit: int = 50,
+    db: Session = Depends(get_read_db),
+    current_user: Principal = Depends(verify_token),
+):
+    return message_log_page(db, cursor=cursor, limit=limit)
@@ -0,0 +1,70 @@
+"""Keyset pagination helpers shared by the JSON list endpoints.
+
+Pages are ordered by ``(timestamp, id)`` and continued with an opaque cursor that
+holds the last row's key. Timestamps are compared as their stored text
+(``raw_key``) because SQLite keeps ``server_default=func.now()`` values as
+``YYYY-MM-DD HH:MM:SS`` strings, and a bound ``datetime`` would render with
+microseconds and never compare equal to them.
+"""
+from __future__ import annotations
+
+import base64
+import json
+from typing import Any, Optional, Sequence
+
+from fastapi import HTTPException
+from sqlalchemy import String, and_, literal, or_, type_coerce
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# What a cursor value may be unless a caller narrows it: any JSON scalar.
+SCALAR = (str, int, float, type(None))
+
+
+def clamp_limit(limit: Optional[int]) -> int:
+    if not limit or limit < 1:
+        return DEFAULT_PAGE_SIZE
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def encode_cursor(*values: Any) -> str:
+    raw = json.dumps(list(values), separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int, types: Optional[Sequence] = None) -> list:
+    """The ``size`` values of a cursor made by ``encode_cursor``.
+
+    ``types`` gives the accepted type (or tuple of types) per position and
+    defaults to ``SCALAR`` for each. Anything else, such as nested lists or
+    objects that would only fail once the query is built, is a 400.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, UnicodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    for value, expected in zip(values, types or (SCALAR,) * size):
+        # JSON true/false decode to bool, which isinstance would accept as int.
+        if isinstance(value, bool) or not isinstance(value, expected):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+def raw_key(column):
+    """The column value exactly as stored, for use in ORDER BY / cursors."""
+    return type_coerce(column, String)
+
+
+def before(ts_column, id_column, ts_key: str, id_key: int):
+    """Rows strictly after (ts_key, id_key) in ``ORDER BY ts DESC, id DESC`` order."""
+    ts = literal(ts_key, String)
+    return or_(ts_column < ts, and_(ts_column == ts, id_column < id_key))
+
+
+def after(ts_column, id_column, ts_key: str, id_key: int):
+    """Rows strictly after (ts_key, id_key) in ``ORDER BY ts ASC, id ASC`` order."""
+    ts = literal(ts_key, String)
+    return or_(ts_column > ts, and_(ts_column == ts, id_column > id_key))
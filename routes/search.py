@@ -0,0 +1,38 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+
+from database.deps import get_read_db
+from routes.auth import Principal, verify_token
+from services.search import KINDS, search_index
+
+router = APIRouter(prefix="/api/search", tags=["Search"])
+
+def parse_kinds(kinds: Optional[str]) -> Optional[list]:
+    if not kinds:
+        return None
+    selected = [k.strip() for k in kinds.split(",") if k.strip()]
+    unknown = set(selected) - set(KINDS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown kinds: {', '.join(sorted(unknown))}")
+    return selected
+
+@router.get("")
+def search(
+    q: str,
+    kinds: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 20,
+    db: Session = Depends(get_read_db),
+    current_user: Principal = Depends(verify_token),
+):
+    """Ranked full-text search over messages, broadcasts and broadcast events.
+
+    ``kinds`` is a comma-separated subset of ``message,broadcast,event``. Every word
+    in ``q`` must match; the last one also matches as a prefix. ``snippet_html`` is
+    escaped text with the matches wrapped in ``<mark>``.
+    """
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can search messages")
+    return search_index.search(db, q, kinds=parse_kinds(kinds), cursor=cursor, limit=limit)
@@ -1,9 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
+from sqlalchemy import and_, or_
 from sqlalchemy.orm import Session
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 
-from database.deps import get_db
-from database.models import User
+from database.deps import get_db, get_read_db
+from database.models import FogDevice, User, UserLocation
+from routes.auth import Principal, verify_token
+from routes.pagination import SCALAR, clamp_limit, decode_cursor, encode_cursor, raw_key
+from services.stats import live_stats
+from services.user_import import ImportBusyError, ImportFormatError, user_importer
 
 router = APIRouter(prefix="/api/users", tags=["Users"])
 
@@ -12,6 +19,10 @@ class UserCreate(BaseModel):
     username: str
     password_hash: str  # for now (later we will hash real passwords)
 
+class UserLocationUpdate(BaseModel):
+    fog_device_id: Optional[int] = None
+    area: Optional[str] = Field(None, max_length=100)
+
 @router.post("")
 def create_user(payload: UserCreate, db: Session = Depends(get_db)):
     # basic uniqueness checks
@@ -32,6 +43,147 @@ def create_user(payload: UserCreate, db: Session = Depends(get_db)):
     return {"id": user.id, "email": user.email, "username": user.username}
 
 @router.get("")
-def list_users(db: Session = Depends(get_db)):
+def list_users(db: Session = Depends(get_read_db)):
     users = db.query(User).order_by(User.id.desc()).all()
     return [{"id": u.id, "email": u.email, "username": u.username, "is_active": u.is_active} for u in users]
+
+# Sortable columns; each is backed by an index whose entries end in the rowid (id).
+USER_SORT_COLUMNS = {
+    "id": User.id,
+    "username": User.username,
+    "email": User.email,
+    "created_at": raw_key(User.created_at),
+}
+
+def mask_email(email: str) -> str:
+    local, _, domain = email.partition("@")
+    if len(local) <= 2:
+        return f"{local[:1]}***@{domain}"
+    return f"{local[:2]}***{local[-1]}@{domain}"
+
+def _prefix_range(column, prefix: str):
+    # A range instead of LIKE so the column's index is used; matching is case-sensitive.
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return and_(column >= prefix, column < upper)
+
+def _past_key(column, descending: bool, key, id_key: int):
+    """Rows after (key, id_key) in ``ORDER BY column, id`` (both ASC or both DESC).
+
+    NULL sorts lowest, as in SQLite, which only matters for ``username``.
+    """
+    if descending:
+        if key is None:
+            return and_(column.is_(None), User.id < id_key)
+        return or_(column < key, and_(column == key, User.id < id_key), column.is_(None))
+    if key is None:
+        return or_(column.is_not(None), User.id > id_key)
+    return or_(column > key, and_(column == key, User.id > id_key))
+
+def user_page(
+    db: Session,
+    q: Optional[str] = None,
+    sort: str = "id",
+    order: str = "desc",
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+) -> dict:
+    """One page of the users table, keyset-paginated on (sort column, id).
+
+    ``q`` is a prefix of the username or the email. Only the columns shown in the
+    table are selected, in a single query; ``total`` comes from the live counters
+    and is only given when no search is applied.
+    """
+    limit = clamp_limit(limit)
+    column = USER_SORT_COLUMNS[sort]
+    descending = order == "desc"
+
+    query = db.query(
+        User.id, User.username, User.email, User.role, User.is_active, User.created_at,
+        column.label("sort_key"),
+    )
+    if q:
+        query = query.filter(or_(_prefix_range(User.username, q), _prefix_range(User.email, q)))
+    if cursor:
+        cursor_sort, cursor_order, key, id_key = decode_cursor(cursor, 4, (str, str, SCALAR, int))
+        if (cursor_sort, cursor_order) != (sort, order):
+            raise HTTPException(status_code=400, detail="Cursor belongs to a different sort order")
+        query = query.filter(_past_key(column, descending, key, id_key))
+    ordering = (column.desc(), User.id.desc()) if descending else (column.asc(), User.id.asc())
+    rows = query.order_by(*ordering).limit(limit + 1).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    items = [
+        {
+            "id": r.id,
+            "username": r.username,
+            "email": mask_email(r.email),
+            "role": r.role,
+            "is_active": bool(r.is_active),
+            "created_at": r.created_at.strftime("%Y-%m-%d %H:%M") if r.created_at else None,
+        }
+        for r in rows
+    ]
+    next_cursor = encode_cursor(sort, order, rows[-1].sort_key, rows[-1].id) if has_more else None
+    total = None if q else live_stats.snapshot()["users_total"]
+    return {"items": items, "next_cursor": next_cursor, "total": total}
+
+@router.get("/page")
+def list_users_page(
+    q: Optional[str] = None,
+    sort: Literal["id", "username", "email", "created_at"] = "id",
+    order: Literal["asc", "desc"] = "desc",
+    cursor: Optional[str] = None,
+    limit: int = 25,
+    db: Session = Depends(get_read_db),
+    current_user: Principal = Depends(verify_token),
+):
+    """Server-side paging for the users table; pass ``next_cursor`` back as ``cursor``."""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can list users")
+    return user_page(db, q=(q or "").strip() or None, sort=sort, order=order, cursor=cursor, limit=limit)
+
+@router.post("/import")
+def import_users(file: UploadFile = File(...), current_user: Principal = Depends(verify_token)):
+    """Create mobile users from a CSV with ``username,email,password`` columns.
+
+    Rows are processed in batches as the file is read; rows that fail are skipped
+    and reported by line number. If the file stops decoding partway, the rows
+    imported so far are reported with ``stopped`` set. One import runs at a time
+    (``IMPORT_MAX_CONCURRENT``); others get a 503. Large files are better run with
+    ``python -m services.user_import``.
+    """
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can import users")
+    try:
+        result = user_importer.run_binary(file.file)
+    except ImportFormatError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    except ImportBusyError as exc:
+        raise HTTPException(status_code=503, detail=str(exc))
+    return result.as_dict()
+
+@router.put("/{user_id}/location")
+def set_user_location(
+    user_id: int,
+    payload: UserLocationUpdate,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(verify_token),
+):
+    """Set the fog node and area a user is reached through (used by fog node and area audiences)."""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can set user locations")
+    if not db.query(User.id).filter(User.id == user_id).first():
+        raise HTTPException(status_code=404, detail="User not found")
+    if payload.fog_device_id is not None and not db.query(FogDevice.id).filter(FogDevice.id == payload.fog_device_id).first():
+        raise HTTPException(status_code=400, detail="Unknown fog node")
+
+    area = (payload.area or "").strip() or None
+    location = db.get(UserLocation, user_id)
+    if location is None:
+        location = UserLocation(user_id=user_id)
+        db.add(location)
+    location.fog_device_id = payload.fog_device_id
+    location.area = area
+    db.commit()
+    return {"user_id": user_id, "fog_device_id": payload.fog_device_id, "area": area}
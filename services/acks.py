@@ -0,0 +1,276 @@
+"""Write-behind buffer for delivery and read acknowledgements.
+
+Devices report acknowledgements in bulk. ``AckBuffer.add`` only coalesces them in
+memory, keyed by (kind, target id, user id) and keeping the furthest status per
+key, so a burst of duplicate or superseded acks costs nothing. A background task
+flushes the buffer every ``flush_interval_seconds`` (or sooner once
+``flush_size`` keys are pending) in a single transaction, as one executemany
+UPDATE per (target status, current status) pair. Updates only ever move a
+recipient forward along queued -> sent -> delivered -> read; a late ack also
+overrides "failed".
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Iterable, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import bindparam, func, update
+from sqlalchemy.orm import Session
+
+from database.connection import SessionLocal
+from database.models import BroadcastRecipient, MessageRecipient
+from services import delivery_counters
+
+logger = logging.getLogger(__name__)
+
+ACK_STATUSES = ("sent", "delivered", "read")
+RANK = {"queued": 0, "sent": 1, "delivered": 2, "read": 3}
+
+# Current statuses each acknowledged status may replace.
+_BROADCAST_SOURCES = {
+    "sent": ("queued", "failed"),
+    "delivered": ("queued", "sent", "failed"),
+    "read": ("queued", "sent", "delivered", "failed"),
+}
+# message_recipients rows start at "sent" and have no delivered_at column.
+_MESSAGE_SOURCES = {
+    "delivered": ("sent",),
+    "read": ("sent", "delivered"),
+}
+
+
+@dataclass(frozen=True)
+class Ack:
+    kind: str          # "broadcast" or "message"
+    target_id: int     # broadcast_id or message_id
+    user_id: int
+    status: str        # sent/delivered/read
+    at: datetime
+
+
+def _broadcast_update(status: str, source: str):
+    t = BroadcastRecipient.__table__
+    at = bindparam("b_at")
+    values = {"status": status, "sent_at": func.coalesce(t.c.sent_at, at)}
+    if status == "delivered":
+        values["delivered_at"] = at
+    elif status == "read":
+        values["delivered_at"] = func.coalesce(t.c.delivered_at, at)
+        values["read_at"] = at
+    return (
+        update(t)
+        .where(t.c.broadcast_id == bindparam("b_target"), t.c.user_id == bindparam("b_user"), t.c.status == source)
+        .values(**values)
+    )
+
+
+def _message_update(status: str, source: str):
+    t = MessageRecipient.__table__
+    values = {"status": status}
+    if status == "read":
+        values["read_at"] = bindparam("b_at")
+    return (
+        update(t)
+        .where(t.c.message_id == bindparam("b_target"), t.c.user_id == bindparam("b_user"), t.c.status == source)
+        .values(**values)
+    )
+
+
+def apply_acks(db: Session, acks: Iterable[Ack]) -> int:
+    """Apply coalesced acks with batched UPDATEs. Returns the number of rows moved.
+
+    Does not commit; counter deltas for broadcasts go through delivery_counters.
+    """
+    broadcasts: dict[int, dict[str, list]] = defaultdict(lambda: defaultdict(list))
+    messages: dict[str, list] = defaultdict(list)
+    for ack in acks:
+        params = {"b_target": ack.target_id, "b_user": ack.user_id, "b_at": ack.at}
+        if ack.kind == "broadcast":
+            broadcasts[ack.target_id][ack.status].append(params)
+        elif ack.status in _MESSAGE_SOURCES:
+            messages[ack.status].append(params)
+
+    moved = 0
+    for broadcast_id, by_status in broadcasts.items():
+        deltas: dict[str, int] = defaultdict(int)
+        for status, rows in by_status.items():
+            for source in _BROADCAST_SOURCES[status]:
+                n = db.execute(_broadcast_update(status, source), rows).rowcount or 0
+                deltas[source] -= n
+                deltas[status] += n
+                moved += n
+        delivery_counters.add(db, broadcast_id, deltas)
+
+    for status, rows in messages.items():
+        for source in _MESSAGE_SOURCES[status]:
+            moved += db.execute(_message_update(status, source), rows).rowcount or 0
+    return moved
+
+
+class _Rate:
+    """Events per second over a sliding window."""
+
+    def __init__(self, window_seconds: float = 60.0):
+        self.window = window_seconds
+        self._samples: deque[tuple[float, int]] = deque()
+        self.total = 0
+
+    def add(self, n: int) -> None:
+        self.total += n
+        self._samples.append((time.monotonic(), n))
+
+    def per_second(self) -> float:
+        cutoff = time.monotonic() - self.window
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+        return sum(n for _, n in self._samples) / self.window
+
+
+class AckBuffer:
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        flush_interval_seconds: float = 1.0,
+        flush_size: int = 5000,
+        max_pending: int = 100_000,
+    ):
+        self.session_factory = session_factory
+        self.flush_interval_seconds = flush_interval_seconds
+        self.flush_size = flush_size
+        self.max_pending = max_pending
+        self._pending: dict[tuple[str, int, int], Ack] = {}
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._stopping: Optional[asyncio.Event] = None
+        self.received = _Rate()
+        self.applied = _Rate()
+        self.coalesced = 0
+        self.rejected = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    # ---------- intake ----------
+    def add(self, acks: list[Ack]) -> int:
+        """Buffer acks; raises 503 when the buffer is full. Returns how many were accepted."""
+        with self._lock:
+            if len(self._pending) + len(acks) > self.max_pending:
+                self.rejected += len(acks)
+                raise HTTPException(
+                    status_code=503,
+                    detail="Acknowledgement buffer is full, please retry shortly",
+                    headers={"Retry-After": "1"},
+                )
+            self._merge(acks)
+            self.received.add(len(acks))
+            full = len(self._pending) >= self.flush_size
+        if full and self._wake is not None:
+            self._wake.set()
+        return len(acks)
+
+    def _merge(self, acks: Iterable[Ack]) -> None:
+        # Caller holds the lock.
+        for ack in acks:
+            key = (ack.kind, ack.target_id, ack.user_id)
+            current = self._pending.get(key)
+            if current is not None:
+                self.coalesced += 1
+                if RANK[ack.status] <= RANK[current.status]:
+                    continue
+            self._pending[key] = ack
+
+    # ---------- flushing ----------
+    def _take(self) -> list[Ack]:
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        return list(batch.values())
+
+    def _write(self, batch: list[Ack]) -> int:
+        db = self.session_factory()
+        try:
+            moved = apply_acks(db, batch)
+            db.commit()
+            return moved
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def flush(self) -> int:
+        batch = self._take()
+        if not batch:
+            return 0
+        try:
+            moved = await asyncio.to_thread(self._write, batch)
+        except Exception:
+            self.failed_flushes += 1
+            # Put the batch back (newer acks for the same key win) and retry next round.
+            with self._lock:
+                newer, self._pending = self._pending, {}
+                self._merge(batch)
+                self._merge(newer.values())
+            raise
+        self.flushes += 1
+        self.applied.add(moved)
+        return moved
+
+    # ---------- lifecycle ----------
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._stopping = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._stopping.set()
+        self._wake.set()
+        await self._task
+        self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Acknowledgement flush failed")
+
+    def stats(self) -> dict:
+        return {
+            "received_total": self.received.total,
+            "applied_total": self.applied.total,
+            "received_per_second": round(self.received.per_second(), 2),
+            "applied_per_second": round(self.applied.per_second(), 2),
+            "pending": self.pending,
+            "coalesced_total": self.coalesced,
+            "rejected_total": self.rejected,
+            "flushes_total": self.flushes,
+            "failed_flushes_total": self.failed_flushes,
+        }
+
+
+ack_buffer = AckBuffer(
+    flush_interval_seconds=float(os.getenv("ACK_FLUSH_SECONDS", "1")),
+    flush_size=int(os.getenv("ACK_FLUSH_SIZE", "5000")),
+    max_pending=int(os.getenv("ACK_MAX_PENDING", "100000")),
+)
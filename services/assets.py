@@ -0,0 +1,259 @@
+"""Fingerprinted, precompressed static assets.
+
+The build step minifies every CSS and JS file under ``static/`` (with ``rcssmin``
+/ ``rjsmin`` when installed, else a conservative built-in pass), names each output
+after a hash of its content (``css/styles.3f9a0c1b2d4e.css``) under
+``static/dist/`` and writes ``.gz`` and, when the ``brotli`` package is
+installed, ``.br`` variants next to it. ``manifest.json`` maps source paths to
+the hashed ones.
+
+Templates link assets with ``asset_url('css/styles.css')``, which resolves
+through the manifest (and falls back to the plain file while no build exists).
+``AssetFiles`` serves ``/static``: hashed files go out with an immutable
+one-year ``Cache-Control`` in the best encoding the client accepts, so a page
+view costs no asset requests at all until the asset itself changes; anything
+else is served as before and revalidated by ETag.
+
+    python -m services.assets          # build (run on deploy)
+"""
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import shutil
+from pathlib import Path, PurePosixPath
+from typing import Optional
+
+import anyio
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:  # optional; only gzip variants are built
+    brotli = None
+
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+logger = logging.getLogger(__name__)
+
+STATIC_DIR = Path(os.getenv("STATIC_DIR", "static"))
+DIST = "dist"
+MANIFEST = "manifest.json"
+ASSETS_AUTOBUILD = os.getenv("ASSETS_AUTOBUILD", "1") == "1"
+
+MINIFIED_SUFFIXES = {".css", ".js"}
+COMPRESSIBLE_SUFFIXES = {".css", ".js", ".svg", ".json", ".txt"}
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))  # preference order
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+
+# ---------- minification ----------
+_CSS_TOKENS = re.compile(r"""("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|(/\*.*?\*/)""", re.S)
+_CSS_SPACE = re.compile(r"\s+")
+_CSS_PUNCT = re.compile(r"\s*([{};,>])\s*")
+_CSS_KEPT = re.compile(r"\0(\d+)\0")
+
+
+def minify_css(source: str) -> str:
+    if rcssmin is not None:
+        return rcssmin.cssmin(source)
+    # Whitespace and comments only; strings are set aside first (data: URIs carry SVG markup).
+    kept: list[str] = []
+
+    def set_aside(match: re.Match) -> str:
+        string, comment = match.groups()
+        if comment and not comment.startswith("/*!"):
+            return " "
+        kept.append(string or comment)  # license banners stay
+        return f"\0{len(kept) - 1}\0"
+
+    code = _CSS_TOKENS.sub(set_aside, source)
+    code = _CSS_PUNCT.sub(r"\1", _CSS_SPACE.sub(" ", code)).replace(";}", "}")
+    return _CSS_KEPT.sub(lambda m: kept[int(m.group(1))], code).strip()
+
+
+def minify_js(source: str) -> str:
+    if rjsmin is not None:
+        return rjsmin.jsmin(source)
+    # Line-level only: indentation, blank lines and whole-line // comments.
+    lines = (line.strip() for line in source.splitlines())
+    return "\n".join(line for line in lines if line and not line.startswith("//"))
+
+
+def _minify(suffix: str, data: bytes) -> bytes:
+    if suffix == ".css":
+        return minify_css(data.decode("utf-8")).encode("utf-8")
+    if suffix == ".js":
+        return minify_js(data.decode("utf-8")).encode("utf-8")
+    return data
+
+
+# ---------- build ----------
+def _sources(static_dir: Path):
+    for path in sorted(static_dir.rglob("*")):
+        rel = path.relative_to(static_dir)
+        if path.is_file() and rel.parts[0] != DIST and not any(part.startswith(".") for part in rel.parts):
+            yield rel.as_posix(), path
+
+
+def _write_variants(target: Path, data: bytes) -> None:
+    variants = {".gz": gzip.compress(data, 9, mtime=0)}
+    if brotli is not None:
+        variants[".br"] = brotli.compress(data, quality=11)
+    for suffix, body in variants.items():
+        if len(body) < len(data):
+            target.with_name(target.name + suffix).write_bytes(body)
+
+
+def build(static_dir: Path = STATIC_DIR) -> dict[str, str]:
+    """Rebuild ``dist/`` from scratch and return the new manifest."""
+    dist = static_dir / DIST
+    staging = static_dir / f".{DIST}-build-{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    manifest = {}
+    for rel, path in _sources(static_dir):
+        suffix = path.suffix.lower()
+        data = _minify(suffix, path.read_bytes()) if suffix in MINIFIED_SUFFIXES else path.read_bytes()
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        hashed = str(PurePosixPath(rel).with_name(f"{path.stem}.{digest}{path.suffix}"))
+        target = staging / hashed
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(data)
+        if suffix in COMPRESSIBLE_SUFFIXES:
+            _write_variants(target, data)
+        manifest[rel] = f"{DIST}/{hashed}"
+    (staging / MANIFEST).write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    # Swap in whole so a running server never sees a half-written dist/. Workers
+    # starting together may race here; whichever build lands is identical.
+    old = static_dir / f".{DIST}-old-{os.getpid()}"
+    try:
+        if dist.exists():
+            dist.rename(old)
+        staging.rename(dist)
+    except OSError:
+        logger.info("Another process replaced %s first", dist)
+    shutil.rmtree(staging, ignore_errors=True)
+    shutil.rmtree(old, ignore_errors=True)
+    return manifest
+
+
+def is_stale(static_dir: Path = STATIC_DIR) -> bool:
+    manifest = static_dir / DIST / MANIFEST
+    if not manifest.exists():
+        return True
+    built = manifest.stat().st_mtime
+    return any(path.stat().st_mtime > built for _, path in _sources(static_dir))
+
+
+# ---------- lookup ----------
+class AssetManifest:
+    def __init__(self, static_dir: Path = STATIC_DIR, url_prefix: str = "/static"):
+        self.static_dir = static_dir
+        self.url_prefix = url_prefix
+        self.paths: dict[str, str] = {}
+        self.hashed: frozenset[str] = frozenset()
+
+    def load(self) -> None:
+        try:
+            paths = json.loads((self.static_dir / DIST / MANIFEST).read_text())
+        except FileNotFoundError:
+            paths = {}
+        self.paths = paths
+        self.hashed = frozenset(paths.values())
+
+    def ensure_built(self) -> None:
+        """Build when sources changed since the last build (or none exists), then load."""
+        if ASSETS_AUTOBUILD and is_stale(self.static_dir):
+            manifest = build(self.static_dir)
+            logger.info("Built %d static assets", len(manifest))
+        self.load()
+
+    def url(self, path: str) -> str:
+        return f"{self.url_prefix}/{self.paths.get(path, path)}"
+
+
+asset_manifest = AssetManifest()
+
+
+def asset_url(path: str) -> str:
+    """Jinja helper: URL of the fingerprinted build of ``path`` (relative to static/)."""
+    return asset_manifest.url(path)
+
+
+def register(templates) -> None:
+    templates.env.globals["asset_url"] = asset_url
+
+
+# ---------- serving ----------
+def _accepted_encodings(header: Optional[str]) -> set[str]:
+    accepted = set()
+    for part in (header or "").lower().split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip()
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if coding:
+            accepted.add(coding)
+    return accepted
+
+
+class AssetFiles(StaticFiles):
+    """StaticFiles that serves precompressed variants and caches hashed files forever."""
+
+    def __init__(self, *args, manifest: AssetManifest = asset_manifest, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.manifest = manifest
+
+    async def get_response(self, path: str, scope) -> Response:
+        rel = path.replace(os.sep, "/")
+        immutable = rel in self.manifest.hashed
+        response = None
+        if immutable:
+            accepted = _accepted_encodings(Headers(scope=scope).get("accept-encoding"))
+            for coding, suffix in ENCODINGS:
+                if coding not in accepted:
+                    continue
+                full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, path + suffix)
+                if stat_result is None:
+                    continue
+                response = self.file_response(full_path, stat_result, scope)
+                response.headers["content-encoding"] = coding
+                media_type = mimetypes.guess_type(rel)[0] or "application/octet-stream"
+                if media_type.startswith("text/"):
+                    media_type += "; charset=utf-8"
+                response.headers["content-type"] = media_type
+                break
+        if response is None:
+            response = await super().get_response(path, scope)
+        if response.status_code in (200, 304):
+            response.headers["cache-control"] = IMMUTABLE if immutable else REVALIDATE
+            if immutable:
+                response.headers["vary"] = "Accept-Encoding"
+        return response
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    for source, hashed in build().items():
+        print(f"{source} -> {hashed}")
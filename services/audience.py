@@ -0,0 +1,389 @@
+"""Cached audience membership for broadcast fan-out.
+
+The resident audience is held as an immutable, versioned snapshot of sorted user
+ids in an ``array('I')`` (4 bytes per resident). Session events record which
+users, roles and user_roles rows a commit touched; the next reader folds those
+changes into a new snapshot by re-checking only the affected users. Role changes
+(which can switch the audience rule itself) and a periodic refresh fall back to a
+full rebuild, which also picks up writes made by other processes.
+
+Named audiences (everyone with a role, behind a fog node, in an area, or on an
+explicit list) are cached the same way as compressed ``IdSet``s, one query each
+to build. A broadcast's audience spec (``all_residents``, ``any:1,2`` or
+``all:1,2``) resolves to the union or intersection of those sets, limited to
+residents, without touching the database once the sets are warm. Commits that
+touch the rows an audience kind depends on drop that kind's cached sets.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from typing import Callable, Iterable, Iterator, NamedTuple, Optional
+
+from sqlalchemy import event, func, inspect, select, union
+from sqlalchemy.orm import Session
+
+from database.connection import SessionLocal
+from database.models import Audience, AudienceMember, Role, User, UserLocation, UserRole
+from services.idset import IdSet
+
+
+def resident_ids_query(db: Session):
+    """Query selecting the ids of every broadcast resident.
+
+    Prefer the explicit 'resident' role if present; otherwise all active non-admin
+    users (or all active users if there is no admin role either).
+    """
+    resident_role = db.query(Role).filter(func.lower(Role.name) == "resident").first()
+    if resident_role:
+        return (
+            db.query(User.id)
+            .join(UserRole, UserRole.user_id == User.id)
+            .filter(UserRole.role_id == resident_role.id)
+            .filter(User.is_active == 1)
+        )
+
+    admin_role = db.query(Role).filter(func.lower(Role.name) == "admin").first()
+    if not admin_role:
+        return db.query(User.id).filter(User.is_active == 1)
+
+    admin_user_ids = select(UserRole.user_id).where(UserRole.role_id == admin_role.id)
+    return (
+        db.query(User.id)
+        .filter(User.is_active == 1)
+        .filter(~User.id.in_(admin_user_ids))
+    )
+
+
+class MembershipSnapshot:
+    """Immutable sorted set of user ids."""
+
+    __slots__ = ("version", "ids", "built_at", "_idset")
+
+    def __init__(self, version: int, ids: array, built_at: float):
+        self.version = version
+        self.ids = ids
+        self.built_at = built_at
+        self._idset = None
+
+    @property
+    def idset(self) -> IdSet:
+        """The same ids as an ``IdSet``, built on first use (for combining with named audiences)."""
+        if self._idset is None:
+            self._idset = IdSet.from_ids(self.ids)
+        return self._idset
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.ids)
+
+    def __contains__(self, user_id: int) -> bool:
+        i = bisect_left(self.ids, user_id)
+        return i < len(self.ids) and self.ids[i] == user_id
+
+    def chunks(self, size: int) -> Iterator[array]:
+        for start in range(0, len(self.ids), size):
+            yield self.ids[start:start + size]
+
+
+class ResidentAudience:
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        refresh_seconds: float = 300.0,
+    ):
+        self.session_factory = session_factory
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._snapshot: Optional[MembershipSnapshot] = None
+        self._version = 0
+        self._changed_users: set[int] = set()
+        self._needs_rebuild = True
+
+    # ---------- change tracking ----------
+    def mark_users_changed(self, user_ids) -> None:
+        with self._lock:
+            self._changed_users.update(user_ids)
+
+    def mark_rules_changed(self) -> None:
+        with self._lock:
+            self._needs_rebuild = True
+
+    # ---------- reads ----------
+    def snapshot(self, db: Optional[Session] = None) -> MembershipSnapshot:
+        with self._lock:
+            if self._is_fresh():
+                return self._snapshot
+
+        # One builder at a time, so incremental updates never race each other.
+        with self._build_lock:
+            with self._lock:
+                if self._is_fresh():
+                    return self._snapshot
+                current = self._snapshot
+                full = current is None or self._needs_rebuild or self._expired()
+                changed, self._changed_users = self._changed_users, set()
+                self._needs_rebuild = False
+
+            own_session = db is None
+            db = db or self.session_factory()
+            try:
+                if full:
+                    ids = array("I", (uid for (uid,) in resident_ids_query(db).order_by(User.id.asc()).yield_per(10000)))
+                else:
+                    ids = self._apply(db, current.ids, changed)
+            except Exception:
+                # Put the work back so the next reader retries it.
+                with self._lock:
+                    self._changed_users |= changed
+                    self._needs_rebuild = self._needs_rebuild or full
+                raise
+            finally:
+                if own_session:
+                    db.close()
+
+            with self._lock:
+                self._version += 1
+                self._snapshot = MembershipSnapshot(
+                    self._version,
+                    ids,
+                    time.monotonic() if full else current.built_at,
+                )
+                return self._snapshot
+
+    def _expired(self) -> bool:
+        return time.monotonic() - self._snapshot.built_at > self.refresh_seconds
+
+    def _is_fresh(self) -> bool:
+        return (
+            self._snapshot is not None
+            and not self._needs_rebuild
+            and not self._changed_users
+            and not self._expired()
+        )
+
+    def _apply(self, db: Session, ids: array, changed: set[int]) -> array:
+        members = {uid for (uid,) in resident_ids_query(db).filter(User.id.in_(changed))}
+        ids = array("I", ids)
+        for uid in sorted(changed):
+            i = bisect_left(ids, uid)
+            present = i < len(ids) and ids[i] == uid
+            if uid in members and not present:
+                ids.insert(i, uid)
+            elif uid not in members and present:
+                del ids[i]
+        return ids
+
+
+resident_audience = ResidentAudience(
+    refresh_seconds=float(os.getenv("AUDIENCE_REFRESH_SECONDS", "300")),
+)
+
+
+# ---------- named audiences ----------
+ALL_RESIDENTS = "all_residents"
+AUDIENCE_KINDS = ("role", "fog_node", "area", "list")
+SPEC_MODES = ("any", "all")
+DEFINITIONS = "definitions"  # change marker for the audiences table itself
+_SPEC_MAX = 100  # BroadcastMessage.audience is String(100)
+
+
+class AudienceDef(NamedTuple):
+    id: int
+    name: str
+    kind: str
+    value: Optional[str]
+
+
+def format_spec(mode: str, audience_ids: Iterable[int]) -> str:
+    """The audience spec stored on a broadcast; no audiences means every resident."""
+    ids = sorted(set(audience_ids))
+    if not ids:
+        return ALL_RESIDENTS
+    if mode not in SPEC_MODES:
+        raise ValueError(f"Audience mode must be one of: {', '.join(SPEC_MODES)}")
+    spec = f"{mode}:{','.join(str(i) for i in ids)}"
+    if len(spec) > _SPEC_MAX:
+        raise ValueError("Too many audiences for one broadcast")
+    return spec
+
+
+def parse_spec(spec: Optional[str]) -> tuple[str, list[int]]:
+    if not spec or spec == ALL_RESIDENTS:
+        return ALL_RESIDENTS, []
+    mode, _, ids = spec.partition(":")
+    try:
+        audience_ids = [int(i) for i in ids.split(",") if i]
+    except ValueError:
+        audience_ids = []
+    if mode not in SPEC_MODES or not audience_ids:
+        raise ValueError(f"Unknown audience {spec!r}")
+    return mode, audience_ids
+
+
+def _members_query(audience: AudienceDef):
+    """The one query that builds an audience's member set."""
+    if audience.kind == "role":
+        # Roles live in user_roles and, for the built-in admin/mobile split, on users.role.
+        role = (audience.value or "").lower()
+        by_table = select(UserRole.user_id).where(
+            UserRole.role_id.in_(select(Role.id).where(func.lower(Role.name) == role))
+        )
+        return union(by_table, select(User.id).where(func.lower(User.role) == role))
+    if audience.kind == "fog_node":
+        return select(UserLocation.user_id).where(UserLocation.fog_device_id == int(audience.value))
+    if audience.kind == "area":
+        return select(UserLocation.user_id).where(UserLocation.area == audience.value)
+    # Joined to users: member rows of deleted users are not cascaded away (SQLite foreign keys are off).
+    return (
+        select(AudienceMember.user_id)
+        .join(User, User.id == AudienceMember.user_id)
+        .where(AudienceMember.audience_id == audience.id)
+    )
+
+
+class NamedAudiences:
+    def __init__(self, residents: ResidentAudience, refresh_seconds: float = 300.0):
+        self.residents = residents
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._definitions: Optional[dict[int, AudienceDef]] = None
+        self._definitions_at = 0.0
+        self._sets: dict[int, tuple[int, IdSet, float]] = {}  # audience id -> (generation, ids, built_at)
+        self._generations = dict.fromkeys(AUDIENCE_KINDS + (DEFINITIONS,), 0)
+
+    # ---------- change tracking ----------
+    def mark_changed(self, kinds: Iterable[str]) -> None:
+        """Drop cached sets of these audience kinds (or everything, for ``DEFINITIONS``)."""
+        kinds = set(kinds)
+        with self._lock:
+            for kind in kinds:
+                self._generations[kind] += 1
+            if DEFINITIONS in kinds:
+                self._definitions = None
+                self._sets.clear()
+
+    def _expired(self, built_at: float) -> bool:
+        return time.monotonic() - built_at > self.refresh_seconds
+
+    # ---------- reads ----------
+    def definitions(self, db: Session) -> dict[int, AudienceDef]:
+        with self._lock:
+            if self._definitions is not None and not self._expired(self._definitions_at):
+                return self._definitions
+            generation = self._generations[DEFINITIONS]
+        rows = db.query(Audience.id, Audience.name, Audience.kind, Audience.value).order_by(Audience.name).all()
+        definitions = {r.id: AudienceDef(*r) for r in rows}
+        with self._lock:
+            # A commit landing mid-read leaves the cache empty; the next reader retries.
+            if self._generations[DEFINITIONS] == generation:
+                self._definitions, self._definitions_at = definitions, time.monotonic()
+        return definitions
+
+    def members(self, db: Session, audience_id: int) -> IdSet:
+        """Everyone in the audience, residents or not."""
+        audience = self.definitions(db).get(audience_id)
+        if audience is None:
+            raise ValueError(f"Unknown audience {audience_id}")
+        with self._lock:
+            generation = self._generations[audience.kind]
+            definitions_generation = self._generations[DEFINITIONS]
+            cached = self._sets.get(audience_id)
+            if cached and cached[0] == generation and not self._expired(cached[2]):
+                return cached[1]
+        ids = IdSet.from_ids(uid for (uid,) in db.execute(_members_query(audience)))
+        with self._lock:
+            if (
+                self._generations[audience.kind] == generation
+                and self._generations[DEFINITIONS] == definitions_generation
+            ):
+                self._sets[audience_id] = (generation, ids, time.monotonic())
+        return ids
+
+    def resolve(self, db: Session, spec: Optional[str]):
+        """Recipients for an audience spec, as a sized, sorted iterable with ``chunks``.
+
+        Raises ``ValueError`` for a malformed spec or an unknown audience.
+        """
+        mode, audience_ids = parse_spec(spec)
+        residents = self.residents.snapshot(db)
+        if mode == ALL_RESIDENTS:
+            return residents
+        sets = [self.members(db, audience_id) for audience_id in audience_ids]
+        combined = IdSet.union(sets) if mode == "any" else IdSet.intersection(sets)
+        return combined & residents.idset
+
+    def summaries(self, db: Session) -> list[dict]:
+        """Every audience with its member and resident counts, by name."""
+        residents = self.residents.snapshot(db).idset
+        summaries = []
+        for audience in self.definitions(db).values():
+            ids = self.members(db, audience.id)
+            summaries.append({**audience._asdict(), "members": len(ids), "residents": len(ids & residents)})
+        return summaries
+
+    def describe(self, db: Session, spec: Optional[str]) -> str:
+        try:
+            mode, audience_ids = parse_spec(spec)
+        except ValueError:
+            return spec
+        if mode == ALL_RESIDENTS:
+            return "All residents"
+        definitions = self.definitions(db)
+        names = [definitions[i].name if i in definitions else f"#{i} (deleted)" for i in audience_ids]
+        return f"{'Any' if mode == 'any' else 'All'} of: {', '.join(names)}"
+
+
+named_audiences = NamedAudiences(
+    resident_audience,
+    refresh_seconds=float(os.getenv("AUDIENCE_REFRESH_SECONDS", "300")),
+)
+
+
+# ---------- session hooks ----------
+@event.listens_for(Session, "after_flush")
+def _collect_audience_changes(session: Session, flush_context) -> None:
+    pending = session.info.setdefault("audience_changes", {"users": set(), "rules": False, "kinds": set()})
+    dirty = set(session.dirty)
+    for obj in list(session.new) + list(dirty) + list(session.deleted):
+        if isinstance(obj, User):
+            if obj.id is not None:
+                pending["users"].add(obj.id)
+            if obj not in dirty or inspect(obj).attrs.role.history.has_changes():
+                pending["kinds"].add("role")
+        elif isinstance(obj, UserRole):
+            pending["users"].add(obj.user_id)
+            pending["kinds"].add("role")
+        elif isinstance(obj, Role):
+            pending["rules"] = True
+            pending["kinds"].add("role")
+        elif isinstance(obj, UserLocation):
+            pending["kinds"].update(("fog_node", "area"))
+        elif isinstance(obj, AudienceMember):
+            pending["kinds"].add("list")
+        elif isinstance(obj, Audience):
+            pending["kinds"].add(DEFINITIONS)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_audience_changes(session: Session) -> None:
+    pending = session.info.pop("audience_changes", None)
+    if not pending:
+        return
+    if pending["users"]:
+        resident_audience.mark_users_changed(pending["users"])
+    if pending["rules"]:
+        resident_audience.mark_rules_changed()
+    if pending["kinds"]:
+        named_audiences.mark_changed(pending["kinds"])
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_audience_changes(session: Session) -> None:
+    session.info.pop("audience_changes", None)
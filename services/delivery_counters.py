@@ -0,0 +1,179 @@
+"""Materialized per-broadcast delivery counters.
+
+Every change to ``BroadcastRecipient.status`` should go through ``transition`` (or
+``init`` for a fresh fan-out) so ``broadcast_delivery_counters`` stays in step and
+the tracking pages can read counts without aggregating ``broadcast_recipients``.
+None of these helpers commit; callers own the transaction. The deltas they apply
+are collected on the session and published to ``progress_hub`` after commit.
+"""
+from __future__ import annotations
+
+from collections import defaultdict
+from typing import Iterable, Optional
+
+from sqlalchemy import delete, event, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from database.models import BroadcastDeliveryCounter, BroadcastRecipient
+from services.progress import progress_hub
+
+STATUSES = ("queued", "sent", "delivered", "read", "failed")
+
+
+def _empty() -> dict[str, int]:
+    return {s: 0 for s in STATUSES}
+
+
+def _record(db: Session, broadcast_id: int, deltas: dict[str, int]) -> None:
+    pending = db.info.setdefault("progress_deltas", {})
+    row = pending.setdefault(broadcast_id, defaultdict(int))
+    for status, n in deltas.items():
+        row[status] += n
+
+
+def init(db: Session, broadcast_id: int, queued: int) -> None:
+    """Create the counter row for a broadcast whose recipients were just fanned out."""
+    db.execute(insert(BroadcastDeliveryCounter).values(broadcast_id=broadcast_id, **{**_empty(), "queued": queued}))
+    _record(db, broadcast_id, {"queued": queued})
+
+
+def add(db: Session, broadcast_id: int, deltas: dict[str, int]) -> None:
+    """Apply status deltas to a broadcast's counters.
+
+    If the broadcast has no counter row yet (created before counters existed), the
+    row is rebuilt from ``broadcast_recipients`` instead, which already reflects the
+    change that produced the deltas.
+    """
+    deltas = {s: n for s, n in deltas.items() if n and s in STATUSES}
+    if not deltas:
+        return
+    C = BroadcastDeliveryCounter
+    result = db.execute(
+        update(C)
+        .where(C.broadcast_id == broadcast_id)
+        .values(**{s: getattr(C, s) + n for s, n in deltas.items()})
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        rebuild(db, [broadcast_id])
+    _record(db, broadcast_id, deltas)
+
+
+def transition(
+    db: Session,
+    broadcast_id: int,
+    to_status: str,
+    from_statuses: Iterable[str],
+    values: Optional[dict] = None,
+    where: Iterable = (),
+) -> int:
+    """Move recipients of one broadcast into ``to_status`` and update its counters.
+
+    Runs one UPDATE per source status so the row counts give exact deltas.
+    ``where`` narrows the rows further (e.g. to a batch of user ids). Returns the
+    number of recipients moved.
+    """
+    where = list(where)
+    deltas: dict[str, int] = defaultdict(int)
+    moved = 0
+    for src in from_statuses:
+        if src == to_status:
+            continue
+        result = db.execute(
+            update(BroadcastRecipient)
+            .where(
+                BroadcastRecipient.broadcast_id == broadcast_id,
+                BroadcastRecipient.status == src,
+                *where,
+            )
+            .values(status=to_status, **(values or {}))
+            .execution_options(synchronize_session=False)
+        )
+        n = result.rowcount or 0
+        deltas[src] -= n
+        deltas[to_status] += n
+        moved += n
+    add(db, broadcast_id, deltas)
+    return moved
+
+
+def aggregate(db: Session, broadcast_ids: Optional[Iterable[int]] = None) -> dict[int, dict[str, int]]:
+    """Count recipients by status straight from broadcast_recipients in one GROUP BY."""
+    q = db.query(
+        BroadcastRecipient.broadcast_id,
+        BroadcastRecipient.status,
+        func.count(BroadcastRecipient.id),
+    )
+    if broadcast_ids is not None:
+        q = q.filter(BroadcastRecipient.broadcast_id.in_(list(broadcast_ids)))
+    counts: dict[int, dict[str, int]] = defaultdict(_empty)
+    for broadcast_id, status, n in q.group_by(BroadcastRecipient.broadcast_id, BroadcastRecipient.status):
+        if status in STATUSES:
+            counts[broadcast_id][status] = n
+    return dict(counts)
+
+
+def counts_for(db: Session, broadcast_ids: Iterable[int]) -> dict[int, dict[str, int]]:
+    """Status counts for many broadcasts in at most two queries.
+
+    Reads the counter table, then falls back to a single ``aggregate`` over any
+    broadcasts that have no counter row yet. Every requested id is present in the
+    result, with zeros when it has no recipients.
+    """
+    ids = list(broadcast_ids)
+    if not ids:
+        return {}
+    C = BroadcastDeliveryCounter
+    counts = {
+        row.broadcast_id: {s: getattr(row, s) for s in STATUSES}
+        for row in db.query(C).filter(C.broadcast_id.in_(ids))
+    }
+    missing = [i for i in ids if i not in counts]
+    if missing:
+        fallback = aggregate(db, missing)
+        for i in missing:
+            counts[i] = fallback.get(i, _empty())
+    return counts
+
+
+def rebuild(db: Session, broadcast_ids: Optional[Iterable[int]] = None) -> int:
+    """Recompute counter rows from broadcast_recipients. Returns the number of rows written."""
+    C = BroadcastDeliveryCounter
+    ids = list(broadcast_ids) if broadcast_ids is not None else None
+    counts = aggregate(db, ids)
+    stmt = delete(C)
+    if ids is not None:
+        stmt = stmt.where(C.broadcast_id.in_(ids))
+        for i in ids:
+            counts.setdefault(i, _empty())
+    db.execute(stmt)
+    if counts:
+        db.execute(insert(C), [{"broadcast_id": i, **c} for i, c in counts.items()])
+    return len(counts)
+
+
+def backfill_missing(db: Session) -> int:
+    """Create counter rows for broadcasts that have recipients but no counters yet."""
+    has_counter = select(BroadcastDeliveryCounter.broadcast_id)
+    missing = [
+        broadcast_id
+        for (broadcast_id,) in db.query(BroadcastRecipient.broadcast_id)
+        .filter(~BroadcastRecipient.broadcast_id.in_(has_counter))
+        .distinct()
+    ]
+    if not missing:
+        return 0
+    return rebuild(db, missing)
+
+
+# ---------- session hooks ----------
+@event.listens_for(Session, "after_commit")
+def _publish_progress(session: Session) -> None:
+    pending = session.info.pop("progress_deltas", None)
+    if pending:
+        progress_hub.publish(pending)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_progress(session: Session) -> None:
+    session.info.pop("progress_deltas", None)
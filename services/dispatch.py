@@ -0,0 +1,438 @@
+"""Background dispatch of queued broadcasts.
+
+The worker drains ``BroadcastMessage`` rows with status "queued", highest
+``priority`` first, and hands their ``BroadcastRecipient`` rows to a transport in
+batches. All progress lives in the recipient rows themselves (``status``,
+``attempts``, ``last_attempt_at``), so a restarted worker simply picks up where
+the previous one stopped.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+
+from sqlalchemy import and_, func, or_, update
+from sqlalchemy.orm import Session
+
+from database.connection import SessionLocal
+from database.models import BroadcastEvent, BroadcastMessage, BroadcastRecipient
+from services import delivery_counters
+
+logger = logging.getLogger(__name__)
+
+DISPATCH_ENABLED = os.getenv("DISPATCH_ENABLED", "1") == "1"
+
+
+@dataclass(frozen=True)
+class DispatchJob:
+    """Detached snapshot of the broadcast handed to transports."""
+    broadcast_id: int
+    msg_type: str
+    severity: str
+    subject: str
+    body: str
+    priority: int
+
+
+class DeliveryError(Exception):
+    """Raised by a transport when a single recipient could not be reached."""
+
+
+class Transport:
+    """Delivers one broadcast to one recipient. Raise DeliveryError on failure."""
+
+    async def send(self, job: DispatchJob, user_id: int) -> None:
+        raise NotImplementedError
+
+
+class SimulatedTransport(Transport):
+    """Default transport: accepts every send, like the manual mark_sent action."""
+
+    async def send(self, job: DispatchJob, user_id: int) -> None:
+        return None
+
+
+@dataclass
+class FakeTransport(Transport):
+    """In-process transport for tests.
+
+    Records every successful send, fails for ``fail_user_ids`` and tracks the
+    highest number of concurrent in-flight sends it observed.
+    """
+    fail_user_ids: set[int] = field(default_factory=set)
+    delay: float = 0.0
+    sent: list[tuple[int, int]] = field(default_factory=list)
+    in_flight: int = 0
+    max_in_flight: int = 0
+
+    async def send(self, job: DispatchJob, user_id: int) -> None:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            if user_id in self.fail_user_ids:
+                raise DeliveryError(f"user {user_id} unreachable")
+            self.sent.append((job.broadcast_id, user_id))
+        finally:
+            self.in_flight -= 1
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class DispatchWorker:
+    def __init__(
+        self,
+        transport: Optional[Transport] = None,
+        session_factory: Callable[[], Session] = SessionLocal,
+        batch_size: int = 500,
+        max_in_flight: int = 50,
+        max_attempts: int = 5,
+        backoff_base_seconds: float = 5.0,
+        poll_interval_seconds: float = 2.0,
+        sweep_interval_seconds: float = 30.0,
+    ):
+        self.transport = transport or SimulatedTransport()
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.max_attempts = max_attempts
+        self.backoff_base_seconds = backoff_base_seconds
+        self.poll_interval_seconds = poll_interval_seconds
+        self.sweep_interval_seconds = sweep_interval_seconds
+        self._next_sweep = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+
+    # ---------- lifecycle ----------
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._stopping.clear()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        self._stopping.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+    async def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                processed = await self.run_once()
+            except Exception:
+                logger.exception("Broadcast dispatch iteration failed")
+                processed = 0
+            if processed:
+                continue
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.poll_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    # ---------- one iteration ----------
+    async def run_once(self) -> int:
+        """Dispatch at most one batch. Returns the number of recipients attempted."""
+        await asyncio.to_thread(self._expire_broadcasts)
+
+        claimed = await asyncio.to_thread(self._claim_batch)
+        # Sweep when idle and, under steady traffic, on a timer as well, so stranded
+        # final attempts and drained broadcasts do not wait for the queue to empty.
+        if claimed is None or time.monotonic() >= self._next_sweep:
+            await self._sweep()
+        if claimed is None:
+            return 0
+        job, user_ids = claimed
+        if not user_ids:
+            return 0  # another dispatcher claimed the batch first
+
+        results = await self._send_all(job, user_ids)
+        await asyncio.to_thread(self._record_results, job.broadcast_id, results)
+        await asyncio.to_thread(self._finalize_if_done, job.broadcast_id)
+        return len(user_ids)
+
+    async def _sweep(self) -> None:
+        self._next_sweep = time.monotonic() + self.sweep_interval_seconds
+        await asyncio.to_thread(self._fail_exhausted)
+        await asyncio.to_thread(self._finalize_drained)
+
+    async def _send_all(self, job: DispatchJob, user_ids: list[int]) -> dict[int, Optional[str]]:
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        async def send_one(user_id: int) -> tuple[int, Optional[str]]:
+            async with semaphore:
+                try:
+                    await self.transport.send(job, user_id)
+                    return user_id, None
+                except Exception as e:
+                    return user_id, (str(e) or type(e).__name__)[:255]
+
+        pairs = await asyncio.gather(*(send_one(uid) for uid in user_ids))
+        return dict(pairs)
+
+    def _backoff(self, attempts: int) -> timedelta:
+        return timedelta(seconds=self.backoff_base_seconds * (2 ** max(attempts - 1, 0)))
+
+    def _eligible_filter(self, now: datetime):
+        # One branch per attempt count keeps the exponential backoff in SQL.
+        retry_ready = [
+            and_(
+                BroadcastRecipient.attempts == n,
+                BroadcastRecipient.last_attempt_at <= now - self._backoff(n),
+            )
+            for n in range(1, self.max_attempts)
+        ]
+        return and_(
+            BroadcastRecipient.status == "queued",
+            or_(BroadcastRecipient.attempts == 0, *retry_ready),
+        )
+
+    def _expire_broadcasts(self) -> None:
+        now = _utcnow()
+        db = self.session_factory()
+        try:
+            expired = (
+                db.query(BroadcastMessage.id)
+                .filter(BroadcastMessage.status == "queued")
+                .filter(BroadcastMessage.ttl_expires_at.isnot(None))
+                .filter(BroadcastMessage.ttl_expires_at <= now)
+                .all()
+            )
+            for (broadcast_id,) in expired:
+                dropped = delivery_counters.transition(
+                    db, broadcast_id, "failed", ["queued"],
+                    values={"fail_reason": "ttl_expired", "last_attempt_at": now},
+                )
+                db.add(BroadcastEvent(
+                    broadcast_id=broadcast_id,
+                    event_type="expired",
+                    message=f"TTL expired, {dropped} undelivered recipients dropped",
+                ))
+                self._finalize(db, broadcast_id)
+            db.commit()
+        finally:
+            db.close()
+
+    def _claim_batch(self) -> Optional[tuple[DispatchJob, list[int]]]:
+        """Pick the highest-priority queued broadcast with recipients ready to send and
+        claim a batch of them.
+
+        Broadcasts whose remaining recipients are all backing off are skipped so they
+        do not hold up lower-priority traffic. Claiming bumps ``attempts`` and ``last_attempt_at`` before anything is sent, so
+        a crash mid-batch leaves the rows eligible again once their backoff elapses
+        (rows that were on their final attempt are failed by ``_fail_exhausted``).
+
+        The claiming UPDATE only matches rows still at the attempt count that was
+        read, and only the rows it returns are sent, so dispatchers in several worker
+        processes never send the same recipient twice.
+        """
+        now = _utcnow()
+        db = self.session_factory()
+        try:
+            eligible = (
+                db.query(BroadcastRecipient.id)
+                .filter(BroadcastRecipient.broadcast_id == BroadcastMessage.id)
+                .filter(self._eligible_filter(now))
+                .exists()
+            )
+            b = (
+                db.query(BroadcastMessage)
+                .filter(BroadcastMessage.status == "queued")
+                .filter(eligible)
+                .order_by(
+                    BroadcastMessage.priority.desc(),
+                    BroadcastMessage.created_at.asc(),
+                    BroadcastMessage.id.asc(),
+                )
+                .first()
+            )
+            if not b:
+                return None
+            job = DispatchJob(
+                broadcast_id=b.id,
+                msg_type=b.msg_type,
+                severity=b.severity,
+                subject=b.subject,
+                body=b.body,
+                priority=b.priority,
+            )
+
+            rows = (
+                db.query(BroadcastRecipient.id, BroadcastRecipient.attempts)
+                .filter(BroadcastRecipient.broadcast_id == b.id)
+                .filter(self._eligible_filter(now))
+                .order_by(BroadcastRecipient.id.asc())
+                .limit(self.batch_size)
+                .all()
+            )
+            by_attempts: dict[int, list[int]] = defaultdict(list)
+            for r in rows:
+                by_attempts[r.attempts].append(r.id)
+            user_ids = []
+            for attempts, ids in by_attempts.items():
+                user_ids += db.execute(
+                    update(BroadcastRecipient)
+                    .where(
+                        BroadcastRecipient.id.in_(ids),
+                        BroadcastRecipient.status == "queued",
+                        BroadcastRecipient.attempts == attempts,
+                    )
+                    .values(attempts=BroadcastRecipient.attempts + 1, last_attempt_at=now)
+                    .returning(BroadcastRecipient.user_id)
+                    .execution_options(synchronize_session=False)
+                ).scalars().all()
+            db.commit()
+            return job, user_ids
+        finally:
+            db.close()
+
+    def _record_results(self, broadcast_id: int, results: dict[int, Optional[str]]) -> None:
+        now = _utcnow()
+        sent_ids = [uid for uid, err in results.items() if err is None]
+        failures = {uid: err for uid, err in results.items() if err is not None}
+
+        db = self.session_factory()
+        try:
+            if sent_ids:
+                delivery_counters.transition(
+                    db, broadcast_id, "sent", ["queued"],
+                    values={"sent_at": now, "fail_reason": None},
+                    where=[BroadcastRecipient.user_id.in_(sent_ids)],
+                )
+            for reason in set(failures.values()):
+                uids = [uid for uid, err in failures.items() if err == reason]
+                # Out of attempts -> failed; otherwise stays queued for a backed-off retry.
+                delivery_counters.transition(
+                    db, broadcast_id, "failed", ["queued"],
+                    values={"fail_reason": reason},
+                    where=[
+                        BroadcastRecipient.user_id.in_(uids),
+                        BroadcastRecipient.attempts >= self.max_attempts,
+                    ],
+                )
+                db.execute(
+                    update(BroadcastRecipient)
+                    .where(
+                        BroadcastRecipient.broadcast_id == broadcast_id,
+                        BroadcastRecipient.status == "queued",
+                        BroadcastRecipient.user_id.in_(uids),
+                    )
+                    .values(fail_reason=reason)
+                    .execution_options(synchronize_session=False)
+                )
+            db.commit()
+        finally:
+            db.close()
+
+    def _fail_exhausted(self) -> None:
+        """Fail queued recipients whose final attempt was claimed but never recorded.
+
+        Without this, a crash between claiming the last attempt and recording its
+        result would leave the rows queued (and no longer eligible) forever, and
+        their broadcast would never finish.
+        """
+        cutoff = _utcnow() - self._backoff(self.max_attempts)
+        stale = [
+            BroadcastRecipient.attempts >= self.max_attempts,
+            BroadcastRecipient.last_attempt_at <= cutoff,
+        ]
+        db = self.session_factory()
+        try:
+            broadcast_ids = [
+                broadcast_id for (broadcast_id,) in (
+                    db.query(BroadcastRecipient.broadcast_id)
+                    .join(BroadcastMessage, BroadcastMessage.id == BroadcastRecipient.broadcast_id)
+                    .filter(BroadcastMessage.status == "queued")
+                    .filter(BroadcastRecipient.status == "queued", *stale)
+                    .distinct()
+                )
+            ]
+            for broadcast_id in broadcast_ids:
+                failed = delivery_counters.transition(
+                    db, broadcast_id, "failed", ["queued"],
+                    values={"fail_reason": func.coalesce(BroadcastRecipient.fail_reason, "attempts exhausted")},
+                    where=stale,
+                )
+                db.add(BroadcastEvent(
+                    broadcast_id=broadcast_id,
+                    event_type="attempts_exhausted",
+                    message=f"{failed} recipients failed: no result was recorded for their final attempt",
+                ))
+            db.commit()
+        finally:
+            db.close()
+
+    def _finalize_drained(self) -> None:
+        """Finalize queued broadcasts that have no queued recipients left (or never had any)."""
+        db = self.session_factory()
+        try:
+            pending = (
+                db.query(BroadcastRecipient.id)
+                .filter(BroadcastRecipient.broadcast_id == BroadcastMessage.id)
+                .filter(BroadcastRecipient.status == "queued")
+                .exists()
+            )
+            drained = (
+                db.query(BroadcastMessage.id)
+                .filter(BroadcastMessage.status == "queued")
+                .filter(~pending)
+                .all()
+            )
+            for (broadcast_id,) in drained:
+                self._finalize(db, broadcast_id)
+            db.commit()
+        finally:
+            db.close()
+
+    def _finalize_if_done(self, broadcast_id: int) -> None:
+        db = self.session_factory()
+        try:
+            self._finalize(db, broadcast_id)
+            db.commit()
+        finally:
+            db.close()
+
+    def _finalize(self, db: Session, broadcast_id: int) -> None:
+        """Close out a queued broadcast once none of its recipients are still queued."""
+        b = db.query(BroadcastMessage).filter(BroadcastMessage.id == broadcast_id).first()
+        if not b or b.status != "queued":
+            return
+        pending = (
+            db.query(BroadcastRecipient.id)
+            .filter(BroadcastRecipient.broadcast_id == broadcast_id)
+            .filter(BroadcastRecipient.status == "queued")
+            .first()
+        )
+        if pending:
+            return
+        counts = delivery_counters.counts_for(db, [broadcast_id])[broadcast_id]
+        failed = counts["failed"]
+        total = sum(counts.values())
+        b.status = "failed" if total and failed == total else "sent"
+        db.add(BroadcastEvent(
+            broadcast_id=broadcast_id,
+            event_type="dispatched",
+            message=f"Dispatch finished: {total - failed} sent, {failed} failed",
+        ))
+
+
+def worker_from_env() -> DispatchWorker:
+    return DispatchWorker(
+        batch_size=int(os.getenv("DISPATCH_BATCH_SIZE", "500")),
+        max_in_flight=int(os.getenv("DISPATCH_MAX_IN_FLIGHT", "50")),
+        max_attempts=int(os.getenv("DISPATCH_MAX_ATTEMPTS", "5")),
+        backoff_base_seconds=float(os.getenv("DISPATCH_BACKOFF_SECONDS", "5")),
+        poll_interval_seconds=float(os.getenv("DISPATCH_POLL_SECONDS", "2")),
+        sweep_interval_seconds=float(os.getenv("DISPATCH_SWEEP_SECONDS", "30")),
+    )
+
+
+dispatcher = worker_from_env()
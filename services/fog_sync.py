@@ -0,0 +1,229 @@
+"""Store-and-forward sync for fog nodes.
+
+A node holds an opaque cursor with three high-water marks: the last
+``sync_changes.seq`` it saw (broadcasts created, edited or deleted, recorded by
+the session hook below), the last ``broadcast_recipients.id`` and the last
+``messages.id``. Both tables are AUTOINCREMENT, so ids are never handed out again
+after a delete or an archive run, and with SQLite's single writer they grow in
+commit order: "everything above the mark" is exactly what the node has not seen.
+
+A node only gets what concerns the users assigned to it in ``user_locations``:
+their recipient assignments, broadcasts with at least one of them among the
+recipients, and direct messages addressed to them (``recipient_ids`` listing only
+those users). Marks still advance past rows meant for other nodes.
+
+Each call returns one chunk of at most ``limit`` rows per stream plus the cursor
+to resume from, so a node on a lossy link only ever re-fetches the chunk that was
+cut off. Rows are sent column-wise (``fields`` + ``rows``) with epoch-second
+timestamps, as msgpack when the node asks for it and the package is installed,
+else compact JSON, and compressed per ``Accept-Encoding``. The ETag covers the
+cursor and the current head, so a caught-up node polling with ``If-None-Match``
+costs one small query and gets a 304.
+"""
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import zlib
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import event, func, insert, literal, select
+from sqlalchemy.orm import Session
+
+from database.models import BroadcastMessage, BroadcastRecipient, Message, MessageRecipient, SyncChange, UserLocation
+from routes.pagination import decode_cursor, encode_cursor
+
+try:
+    import msgpack
+except ImportError:  # optional; JSON is used instead
+    msgpack = None
+
+DEFAULT_CHUNK = 500
+MAX_CHUNK = 5000
+
+BROADCAST_FIELDS = (
+    "id", "msg_type", "severity", "audience", "subject", "body", "status", "priority",
+    "ttl_expires_at", "created_at", "updated_at",
+)
+RECIPIENT_FIELDS = ("id", "broadcast_id", "user_id")
+MESSAGE_FIELDS = ("id", "sender_id", "subject", "body", "created_at", "recipient_ids")
+
+
+def clamp_chunk(limit: Optional[int]) -> int:
+    if not limit or limit < 1:
+        return DEFAULT_CHUNK
+    return min(limit, MAX_CHUNK)
+
+
+def parse_cursor(cursor: Optional[str]) -> tuple[int, int, int]:
+    if not cursor:
+        return 0, 0, 0
+    return tuple(decode_cursor(cursor, 3, (int, int, int)))
+
+
+def _epoch(dt: Optional[datetime]) -> Optional[int]:
+    if dt is None:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)  # SQLite hands back naive UTC
+    return int(dt.timestamp())
+
+
+def head(db: Session) -> tuple[int, int, int]:
+    """Current high-water marks of the three streams, in one statement."""
+    row = db.execute(select(
+        select(func.coalesce(func.max(SyncChange.seq), 0)).scalar_subquery(),
+        select(func.coalesce(func.max(BroadcastRecipient.id), 0)).scalar_subquery(),
+        select(func.coalesce(func.max(Message.id), 0)).scalar_subquery(),
+    )).one()
+    return tuple(row)
+
+
+def etag(cursor: tuple, limit: int, current_head: tuple, fmt: str) -> str:
+    digest = hashlib.sha1(repr((cursor, limit, current_head, fmt)).encode()).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def build_chunk(
+    db: Session, device_id: int, cursor: tuple[int, int, int], limit: int, current_head: tuple[int, int, int],
+) -> dict:
+    seq, recipient_mark, message_mark = cursor
+    node_users = select(UserLocation.user_id).where(UserLocation.fog_device_id == device_id)
+
+    # ---------- broadcasts (new, changed or deleted) ----------
+    changes = db.execute(
+        select(SyncChange.seq, SyncChange.entity_id)
+        .where(SyncChange.seq > seq, SyncChange.seq <= current_head[0], SyncChange.entity == "broadcast")
+        .order_by(SyncChange.seq)
+        .limit(limit)
+    ).all()
+    changed_ids = list(dict.fromkeys(entity_id for _, entity_id in changes))
+    broadcasts = []
+    deleted = []
+    if changed_ids:
+        found = {b.id: b for b in db.query(BroadcastMessage).filter(BroadcastMessage.id.in_(changed_ids))}
+        relevant = set(db.execute(
+            select(BroadcastRecipient.broadcast_id).distinct()
+            .where(BroadcastRecipient.broadcast_id.in_(list(found)), BroadcastRecipient.user_id.in_(node_users))
+        ).scalars()) if found else set()
+        for broadcast_id in changed_ids:
+            b = found.get(broadcast_id)
+            if b is None:
+                deleted.append(broadcast_id)
+                continue
+            if broadcast_id not in relevant:
+                continue
+            broadcasts.append([
+                b.id, b.msg_type, b.severity, b.audience, b.subject, b.body, b.status, b.priority,
+                _epoch(b.ttl_expires_at), _epoch(b.created_at), _epoch(b.updated_at),
+            ])
+        seq = changes[-1][0]
+    elif current_head[0] > seq:
+        # Only non-broadcast entries in the gap; skip past them.
+        seq = current_head[0]
+
+    # ---------- recipient assignments ----------
+    recipients = [
+        list(row) for row in db.execute(
+            select(BroadcastRecipient.id, BroadcastRecipient.broadcast_id, BroadcastRecipient.user_id)
+            .where(
+                BroadcastRecipient.id > recipient_mark,
+                BroadcastRecipient.id <= current_head[1],
+                BroadcastRecipient.user_id.in_(node_users),
+            )
+            .order_by(BroadcastRecipient.id)
+            .limit(limit)
+        )
+    ]
+    # A short page means nothing else for this node up to the head.
+    # The head drops when the newest rows are deleted or archived; a mark never moves back.
+    recipient_mark = recipients[-1][0] if len(recipients) == limit else max(recipient_mark, current_head[1])
+
+    # ---------- direct messages ----------
+    message_rows = db.execute(
+        select(Message.id, Message.sender_id, Message.subject, Message.body, Message.created_at)
+        .where(
+            Message.id > message_mark,
+            Message.id <= current_head[2],
+            Message.id.in_(select(MessageRecipient.message_id).where(MessageRecipient.user_id.in_(node_users))),
+        )
+        .order_by(Message.id)
+        .limit(limit)
+    ).all()
+    messages = []
+    if message_rows:
+        ids = [m.id for m in message_rows]
+        to: dict[int, list] = {i: [] for i in ids}
+        for message_id, user_id in db.execute(
+            select(MessageRecipient.message_id, MessageRecipient.user_id)
+            .where(MessageRecipient.message_id.in_(ids), MessageRecipient.user_id.in_(node_users))
+        ):
+            to[message_id].append(user_id)
+        messages = [[m.id, m.sender_id, m.subject, m.body, _epoch(m.created_at), to[m.id]] for m in message_rows]
+    message_mark = message_rows[-1].id if len(message_rows) == limit else max(message_mark, current_head[2])
+
+    next_cursor = (seq, recipient_mark, message_mark)
+    return {
+        "cursor": encode_cursor(*next_cursor),
+        "has_more": any(mark < top for mark, top in zip(next_cursor, current_head)),
+        "broadcasts": {"fields": BROADCAST_FIELDS, "rows": broadcasts},
+        "deleted_broadcasts": deleted,
+        "recipients": {"fields": RECIPIENT_FIELDS, "rows": recipients},
+        "messages": {"fields": MESSAGE_FIELDS, "rows": messages},
+    }
+
+
+def negotiate(accept: Optional[str], accept_encoding: Optional[str]) -> tuple[str, Optional[str]]:
+    """(media type, content coding) for a request's Accept / Accept-Encoding headers."""
+    accept = accept or ""
+    media = "application/msgpack" if msgpack is not None and "msgpack" in accept else "application/json"
+    codings = [c.split(";")[0].strip() for c in (accept_encoding or "").lower().split(",")]
+    coding = "deflate" if "deflate" in codings else "gzip" if "gzip" in codings else None
+    return media, coding
+
+
+def encode(payload: dict, media: str, coding: Optional[str]) -> bytes:
+    if media == "application/msgpack":
+        body = msgpack.packb(payload, use_bin_type=True)
+    else:
+        body = json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    if coding == "deflate":
+        return zlib.compress(body, 6)
+    if coding == "gzip":
+        return gzip.compress(body, 6)
+    return body
+
+
+def backfill_changes(db: Session) -> int:
+    """Log broadcasts that predate the change log so nodes syncing from zero see them."""
+    logged = select(SyncChange.entity_id).where(SyncChange.entity == "broadcast")
+    result = db.execute(
+        insert(SyncChange.__table__).from_select(
+            ["entity", "entity_id"],
+            select(literal("broadcast"), BroadcastMessage.id)
+            .where(BroadcastMessage.id.not_in(logged))
+            .order_by(BroadcastMessage.id),
+        )
+    )
+    return result.rowcount or 0
+
+
+# ---------- session hooks ----------
+@event.listens_for(Session, "after_flush")
+def _log_broadcast_changes(session: Session, flush_context) -> None:
+    changed = {
+        obj.id
+        for obj in list(session.new) + list(session.deleted)
+        if isinstance(obj, BroadcastMessage)
+    }
+    changed.update(
+        obj.id for obj in session.dirty
+        if isinstance(obj, BroadcastMessage) and session.is_modified(obj, include_collections=False)
+    )
+    if changed:
+        session.connection().execute(
+            insert(SyncChange.__table__),
+            [{"entity": "broadcast", "entity_id": i} for i in sorted(changed)],
+        )
@@ -0,0 +1,157 @@
+"""Compressed, immutable sets of user ids.
+
+Ids are split on their high 16 bits into containers, as in roaring bitmaps: a
+container holding up to ``ARRAY_MAX`` ids is a sorted ``array('H')`` of the low
+16 bits (2 bytes per id), a fuller one is an 8 KiB bitmap. A million-member
+audience takes about 128 KiB, and union/intersection work container by container
+(bitmaps as machine-word ANDs/ORs), so combining audiences never touches the
+database.
+"""
+from __future__ import annotations
+
+from array import array
+from bisect import bisect_left
+from typing import Iterable, Iterator
+
+ARRAY_MAX = 4096
+_BITMAP_BYTES = 1 << 13  # 65536 bits
+
+
+def _bitmap_int(container) -> int:
+    if isinstance(container, bytes):
+        return int.from_bytes(container, "little")
+    bits = bytearray(_BITMAP_BYTES)
+    for low in container:
+        bits[low >> 3] |= 1 << (low & 7)
+    return int.from_bytes(bits, "little")
+
+
+def _bitmap_lows(bitmap: bytes) -> Iterator[int]:
+    for i, byte in enumerate(bitmap):
+        if byte:
+            base = i << 3
+            for bit in range(8):
+                if byte >> bit & 1:
+                    yield base | bit
+
+
+def _from_int(bits: int):
+    """Container (and cardinality) for a bitmap held as an int."""
+    card = bits.bit_count()
+    if card > ARRAY_MAX:
+        return bits.to_bytes(_BITMAP_BYTES, "little"), card
+    return array("H", _bitmap_lows(bits.to_bytes(_BITMAP_BYTES, "little"))), card
+
+
+def _from_lows(lows: list[int]):
+    if len(lows) > ARRAY_MAX:
+        return _from_int(_bitmap_int(lows))
+    return array("H", lows), len(lows)
+
+
+def _contains(container, low: int) -> bool:
+    if isinstance(container, bytes):
+        return bool(container[low >> 3] >> (low & 7) & 1)
+    i = bisect_left(container, low)
+    return i < len(container) and container[i] == low
+
+
+class IdSet:
+    __slots__ = ("_containers", "_cards", "_len")
+
+    def __init__(self, containers: dict | None = None, cards: dict | None = None):
+        self._containers = containers or {}
+        self._cards = cards or {}
+        self._len = sum(self._cards.values())
+
+    @classmethod
+    def from_ids(cls, ids: Iterable[int]) -> "IdSet":
+        groups: dict[int, list[int]] = {}
+        for uid in ids:
+            groups.setdefault(uid >> 16, []).append(uid & 0xFFFF)
+        containers, cards = {}, {}
+        for high, lows in groups.items():
+            lows = sorted(set(lows))
+            containers[high], cards[high] = _from_lows(lows)
+        return cls(containers, cards)
+
+    # ---------- set algebra ----------
+    def __or__(self, other: "IdSet") -> "IdSet":
+        containers, cards = dict(self._containers), dict(self._cards)
+        for high, theirs in other._containers.items():
+            mine = containers.get(high)
+            if mine is None:
+                containers[high], cards[high] = theirs, other._cards[high]
+            elif isinstance(mine, bytes) or isinstance(theirs, bytes):
+                containers[high], cards[high] = _from_int(_bitmap_int(mine) | _bitmap_int(theirs))
+            else:
+                containers[high], cards[high] = _from_lows(sorted(set(mine).union(theirs)))
+        return IdSet(containers, cards)
+
+    def __and__(self, other: "IdSet") -> "IdSet":
+        containers, cards = {}, {}
+        for high, mine in self._containers.items():
+            theirs = other._containers.get(high)
+            if theirs is None:
+                continue
+            if isinstance(mine, bytes) and isinstance(theirs, bytes):
+                container, card = _from_int(_bitmap_int(mine) & _bitmap_int(theirs))
+            else:
+                small, large = (mine, theirs) if not isinstance(mine, bytes) else (theirs, mine)
+                container, card = _from_lows([low for low in small if _contains(large, low)])
+            if card:
+                containers[high], cards[high] = container, card
+        return IdSet(containers, cards)
+
+    @classmethod
+    def union(cls, sets: Iterable["IdSet"]) -> "IdSet":
+        result = cls()
+        for s in sets:
+            result = result | s
+        return result
+
+    @classmethod
+    def intersection(cls, sets: Iterable["IdSet"]) -> "IdSet":
+        sets = sorted(sets, key=len)  # smallest first keeps every step cheap
+        if not sets:
+            return cls()
+        result = sets[0]
+        for s in sets[1:]:
+            if not result:
+                break
+            result = result & s
+        return result
+
+    # ---------- reads ----------
+    def __len__(self) -> int:
+        return self._len
+
+    def __bool__(self) -> bool:
+        return self._len > 0
+
+    def __contains__(self, uid: int) -> bool:
+        container = self._containers.get(uid >> 16)
+        return container is not None and _contains(container, uid & 0xFFFF)
+
+    def __iter__(self) -> Iterator[int]:
+        for high in sorted(self._containers):
+            base = high << 16
+            container = self._containers[high]
+            lows = _bitmap_lows(container) if isinstance(container, bytes) else container
+            for low in lows:
+                yield base | low
+
+    def chunks(self, size: int) -> Iterator[array]:
+        chunk = array("I")
+        for uid in self:
+            chunk.append(uid)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = array("I")
+        if chunk:
+            yield chunk
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate payload size, for reporting."""
+        return sum(len(c) if isinstance(c, bytes) else c.itemsize * len(c) for c in self._containers.values())
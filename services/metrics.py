@@ -0,0 +1,195 @@
+"""In-process metrics rendered in the Prometheus text format.
+
+``MetricsMiddleware`` times every request by route template and, through
+SQLAlchemy cursor events, counts and times the SQL statements the request ran.
+Pool and bcrypt figures are read from their owners when ``/metrics`` is scraped.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, labelnames
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [bucket counts..., +Inf count, sum]
+        self._values: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(labels)
+            if row is None:
+                row = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            row[i] += 1
+            row[-1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((labels, list(row)) for labels, row in self._values.items())
+        for labels, row in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, row):
+                cumulative += n
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            cumulative += row[len(self.buckets)]
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {row[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+def _samples(name: str, help: str, kind: str, samples: list[tuple[dict, float]]) -> list[str]:
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {value}")
+    return lines
+
+
+REQUEST_LATENCY = Histogram(
+    "hopfog_http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status"),
+)
+REQUEST_SQL_STATEMENTS = Histogram(
+    "hopfog_http_request_sql_statements", "SQL statements executed per HTTP request", ("method", "route"),
+    buckets=SQL_COUNT_BUCKETS,
+)
+REQUEST_SQL_DURATION = Histogram(
+    "hopfog_http_request_sql_duration_seconds", "Time spent in SQL per HTTP request", ("method", "route"),
+)
+SQL_STATEMENT_DURATION = Histogram(
+    "hopfog_sql_statement_duration_seconds", "Duration of individual SQL statements", ("engine",),
+)
+
+
+class RequestStats:
+    __slots__ = ("sql_count", "sql_seconds")
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+
+
+# Set by the middleware; worker threads and run_sync greenlets inherit the context,
+# so statements issued on behalf of a request are attributed to it.
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+
+def instrument_engine(engine, name: str) -> None:
+    """Count and time every statement run on ``engine``."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        elapsed = time.perf_counter() - started
+        SQL_STATEMENT_DURATION.observe(elapsed, name)
+        stats = current_request.get()
+        if stats is not None:
+            stats.sql_count += 1
+            stats.sql_seconds += elapsed
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        conn = context.connection
+        if conn is not None and conn.info.get("query_started"):
+            conn.info["query_started"].pop()
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency and SQL usage per route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        status = {"code": 500}
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_request.reset(token)
+            elapsed = time.perf_counter() - started
+            route = scope.get("route")
+            # Label by path template, never the raw path, to keep label cardinality bounded.
+            route_path = getattr(route, "path", None) or "unmatched"
+            method = scope.get("method", "")
+            REQUEST_LATENCY.observe(elapsed, method, route_path, str(status["code"]))
+            REQUEST_SQL_STATEMENTS.observe(stats.sql_count, method, route_path)
+            REQUEST_SQL_DURATION.observe(stats.sql_seconds, method, route_path)
+
+
+def render_metrics() -> str:
+    from database.connection import pool_stats
+    from services.acks import ack_buffer
+    from services.passwords import password_hasher
+
+    lines: list[str] = []
+    for metric in (REQUEST_LATENCY, REQUEST_SQL_STATEMENTS, REQUEST_SQL_DURATION, SQL_STATEMENT_DURATION):
+        lines.extend(metric.render())
+
+    pools = pool_stats()
+    pool_fields = {
+        "checkouts": ("hopfog_db_pool_checkouts_total", "counter", "Connections checked out of the pool"),
+        "checkout_wait_seconds_total": ("hopfog_db_pool_checkout_wait_seconds_total", "counter", "Time spent waiting for a pooled connection"),
+        "checkout_wait_seconds_max": ("hopfog_db_pool_checkout_wait_seconds_max", "gauge", "Longest wait for a pooled connection"),
+        "checkout_timeouts": ("hopfog_db_pool_checkout_timeouts_total", "counter", "Pool checkouts that timed out"),
+        "lock_errors": ("hopfog_db_lock_errors_total", "counter", "Statements that failed with 'database is locked'"),
+        "checked_out": ("hopfog_db_pool_checked_out", "gauge", "Connections currently checked out"),
+        "overflow": ("hopfog_db_pool_overflow", "gauge", "Connections open beyond pool_size"),
+    }
+    for field, (name, kind, help) in pool_fields.items():
+        samples = [({"engine": role}, data[field]) for role, data in pools.items() if field in data]
+        if samples:
+            lines.extend(_samples(name, help, kind, samples))
+
+    lines.extend(_samples("hopfog_bcrypt_pending", "bcrypt operations queued or running", "gauge", [({}, password_hasher.pending)]))
+    lines.extend(_samples("hopfog_bcrypt_rejected_total", "bcrypt operations rejected with 503", "counter", [({}, password_hasher.rejected)]))
+    lines.extend(_samples("hopfog_bcrypt_rounds", "Current bcrypt work factor", "gauge", [({}, password_hasher.rounds)]))
+
+    acks = ack_buffer.stats()
+    lines.extend(_samples("hopfog_acks_received_total", "Acknowledgements accepted into the buffer", "counter", [({}, acks["received_total"])]))
+    lines.extend(_samples("hopfog_acks_applied_total", "Recipient rows moved forward by acknowledgements", "counter", [({}, acks["applied_total"])]))
+    lines.extend(_samples("hopfog_acks_per_second", "Acknowledgements received per second (60 s window)", "gauge", [({}, acks["received_per_second"])]))
+    lines.extend(_samples("hopfog_acks_pending", "Acknowledgements waiting to be written", "gauge", [({}, acks["pending"])]))
+    lines.extend(_samples("hopfog_acks_rejected_total", "Acknowledgements rejected with 503", "counter", [({}, acks["rejected_total"])]))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,154 @@
+"""Password hashing on a bounded worker pool.
+
+bcrypt is deliberately slow, so hashing and verification run on a small thread
+pool (bcrypt releases the GIL) instead of the request thread or the event loop.
+At most ``max_pending`` operations may be queued or running; beyond that callers
+get an immediate 503 rather than piling up behind a login burst.
+
+The work factor comes from ``BCRYPT_ROUNDS`` or, when that is unset, is
+calibrated at startup so one hash takes about ``BCRYPT_TARGET_MS``. Hashes with a
+different cost are upgraded on the next successful login (see ``needs_rehash``).
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import bcrypt
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+BCRYPT_MAX_BYTES = 72
+
+
+def _encode(password: str) -> bytes:
+    # bcrypt only looks at the first 72 bytes
+    return password.encode("utf-8")[:BCRYPT_MAX_BYTES]
+
+
+def hash_password(password: str, rounds: int) -> str:
+    return bcrypt.hashpw(_encode(password), bcrypt.gensalt(rounds=rounds)).decode("utf-8")
+
+
+def check_password(password: str, hashed: str) -> bool:
+    return bcrypt.checkpw(_encode(password), hashed.encode("utf-8"))
+
+
+def hash_rounds(hashed: str) -> Optional[int]:
+    """Cost factor of a ``$2b$12$...`` hash, or None if it cannot be parsed."""
+    try:
+        return int(hashed.split("$")[2])
+    except (IndexError, ValueError, AttributeError):
+        return None
+
+
+class PasswordHasher:
+    def __init__(
+        self,
+        workers: int,
+        max_pending: int,
+        rounds: Optional[int],
+        target_ms: float,
+        min_rounds: int = 10,
+        max_rounds: int = 14,
+    ):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.target_ms = target_ms
+        self.min_rounds = min_rounds
+        self.max_rounds = max_rounds
+        self.rounds = rounds or 12
+        self._calibrate_on_start = rounds is None
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._pending = 0
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    @property
+    def pending(self) -> int:
+        """Operations queued or running on the pool."""
+        return self._pending
+
+    # ---------- admission ----------
+    def _admit(self) -> None:
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=503,
+                    detail="Server is busy, please try again shortly",
+                    headers={"Retry-After": "1"},
+                )
+            self._pending += 1
+
+    def _release(self, _future=None) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    def _submit(self, fn, *args):
+        self._admit()
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    # ---------- async API (for async def routes) ----------
+    async def hash(self, password: str) -> str:
+        return await asyncio.wrap_future(self._submit(hash_password, password, self.rounds))
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await asyncio.wrap_future(self._submit(check_password, password, hashed))
+
+    # ---------- sync API (for def routes, already on a worker thread) ----------
+    def hash_sync(self, password: str) -> str:
+        return self._submit(hash_password, password, self.rounds).result()
+
+    def verify_sync(self, password: str, hashed: str) -> bool:
+        return self._submit(check_password, password, hashed).result()
+
+    def needs_rehash(self, hashed: str) -> bool:
+        return hash_rounds(hashed) != self.rounds
+
+    # ---------- work factor ----------
+    def calibrate(self) -> int:
+        """Pick the cost whose hash time is closest to target_ms (skipped if BCRYPT_ROUNDS is set)."""
+        if not self._calibrate_on_start:
+            return self.rounds
+        probe_rounds = self.min_rounds
+        started = time.perf_counter()
+        hash_password("calibration", probe_rounds)
+        elapsed_ms = max((time.perf_counter() - started) * 1000, 0.001)
+        # Each extra round doubles the cost.
+        rounds = probe_rounds + round(math.log2(self.target_ms / elapsed_ms))
+        self.rounds = max(self.min_rounds, min(self.max_rounds, rounds))
+        logger.info(
+            "bcrypt calibrated: %d rounds (%.1f ms at %d rounds, target %.0f ms)",
+            self.rounds, elapsed_ms, probe_rounds, self.target_ms,
+        )
+        return self.rounds
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False)
+
+
+_workers = int(os.getenv("BCRYPT_WORKERS", str(min(4, os.cpu_count() or 1))))
+_rounds = os.getenv("BCRYPT_ROUNDS")
+
+password_hasher = PasswordHasher(
+    workers=_workers,
+    max_pending=int(os.getenv("BCRYPT_MAX_PENDING", str(_workers * 16))),
+    rounds=int(_rounds) if _rounds else None,
+    target_ms=float(os.getenv("BCRYPT_TARGET_MS", "250")),
+    min_rounds=int(os.getenv("BCRYPT_MIN_ROUNDS", "10")),
+    max_rounds=int(os.getenv("BCRYPT_MAX_ROUNDS", "14")),
+)
@@ -0,0 +1,134 @@
+"""In-process publish/subscribe hub for broadcast delivery progress.
+
+``delivery_counters`` records the status deltas a transaction applies and
+publishes them here once it commits. Each event gets a sequence number and is
+kept in a short history, so a viewer can ask for everything after the sequence
+number its page was rendered at (or the SSE ``Last-Event-ID``) and apply the
+deltas to the counts it already shows. Fan-out to viewers is pure memory: adding
+viewers adds no database work.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass(frozen=True)
+class ProgressEvent:
+    seq: int
+    broadcast_id: int
+    deltas: dict
+
+
+# Queued in place of events a slow viewer could not keep up with.
+RESYNC = object()
+
+
+class Subscription:
+    def __init__(self, hub: "ProgressHub", broadcast_ids: Optional[set[int]], queue_size: int):
+        self.hub = hub
+        self.broadcast_ids = broadcast_ids
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._overflowed = False
+
+    def wants(self, event: ProgressEvent) -> bool:
+        return self.broadcast_ids is None or event.broadcast_id in self.broadcast_ids
+
+    def offer(self, item) -> bool:
+        """Hand an event to the subscriber's loop; safe to call from any thread.
+
+        Returns False when the loop is already closed and the subscriber is gone.
+        """
+        try:
+            self.loop.call_soon_threadsafe(self._put, item)
+        except RuntimeError:
+            return False
+        return True
+
+    def _put(self, item) -> None:
+        if self._overflowed:
+            return
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            # Drop everything after this point and tell the viewer to reload instead.
+            self._overflowed = True
+            self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+    async def get(self, timeout: float):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class ProgressHub:
+    def __init__(self, history: int = 2048, queue_size: int = 512):
+        self.queue_size = queue_size
+        self._history: deque[ProgressEvent] = deque(maxlen=history)
+        self._subscribers: set[Subscription] = set()
+        self._listeners: list = []
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    @property
+    def seq(self) -> int:
+        """Sequence number of the latest event; pages render this as their starting point."""
+        return self._seq
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    def add_listener(self, fn) -> None:
+        """Call ``fn(changes)`` synchronously for every publish (in-process consumers)."""
+        self._listeners.append(fn)
+
+    def publish(self, changes: dict[int, dict[str, int]]) -> None:
+        """Publish committed per-broadcast status deltas."""
+        for fn in self._listeners:
+            fn(changes)
+        gone: set[Subscription] = set()
+        with self._lock:
+            for broadcast_id, deltas in changes.items():
+                deltas = {s: n for s, n in deltas.items() if n}
+                if not deltas:
+                    continue
+                self._seq += 1
+                event = ProgressEvent(self._seq, broadcast_id, deltas)
+                self._history.append(event)
+                for sub in self._subscribers:
+                    if sub not in gone and sub.wants(event) and not sub.offer(event):
+                        gone.add(sub)
+        # Dropped after the lock is released: publish runs on whichever thread committed.
+        for sub in gone:
+            self.unsubscribe(sub)
+
+    def subscribe(self, broadcast_ids: Optional[set[int]] = None, since: Optional[int] = None) -> Subscription:
+        """Register a viewer (from a running event loop), replaying events after ``since``."""
+        sub = Subscription(self, broadcast_ids, self.queue_size)
+        with self._lock:
+            if since is not None and since < self._seq:
+                oldest = self._history[0].seq if self._history else self._seq + 1
+                if since < oldest - 1:
+                    # Part of the gap has already left the history.
+                    sub._put(RESYNC)
+                else:
+                    for event in self._history:
+                        if event.seq > since and sub.wants(event):
+                            sub._put(event)
+            self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            self._subscribers.discard(sub)
+
+
+progress_hub = ProgressHub(
+    history=int(os.getenv("PROGRESS_HISTORY", "2048")),
+    queue_size=int(os.getenv("PROGRESS_QUEUE_SIZE", "512")),
+)
@@ -0,0 +1,274 @@
+"""Retention, archival and compaction of the high-volume tables.
+
+Policies (days; 0 turns a policy off):
+
+* ``recipient_days``: recipient rows of finished broadcasts (sent/failed/cancelled)
+  whose last change is older than this are moved out of ``broadcast_recipients``.
+  Their counters are rebuilt first, so tracking pages keep showing the totals.
+* ``event_days``: ``broadcast_events`` rows older than this.
+* ``message_days``: direct messages (with their recipient rows) older than this.
+
+Rows go to the matching ``*_archive`` table (or are dropped when ``archive`` is
+off) in batches of ``batch_size``, each in its own short transaction with a pause
+in between, so the single SQLite writer is never held for long. Superseded
+``sync_changes`` entries are compacted the same way, and when anything moved the
+job releases free pages with ``PRAGMA incremental_vacuum(vacuum_pages)`` until the
+freelist is empty, again one short transaction per step, then runs ``PRAGMA optimize``.
+
+    python -m services.retention        # one run with the RETENTION_* settings
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+
+from sqlalchemy import Table, delete, exists, func, insert, select, text
+from sqlalchemy.orm import Session
+
+from database.connection import IS_SQLITE, SessionLocal
+from database.models import (
+    BroadcastEvent, BroadcastMessage, BroadcastRecipient, Message, MessageRecipient, SyncChange,
+    broadcast_events_archive, broadcast_recipients_archive, message_recipients_archive, messages_archive,
+)
+from services import delivery_counters
+
+logger = logging.getLogger(__name__)
+
+RETENTION_ENABLED = os.getenv("RETENTION_ENABLED", "0") == "1"
+FINISHED_STATUSES = ("sent", "failed", "cancelled")
+
+
+@dataclass
+class RetentionPolicy:
+    recipient_days: int = 30
+    event_days: int = 90
+    message_days: int = 365
+    archive: bool = True
+    batch_size: int = 5000
+    pause_seconds: float = 0.05
+    vacuum_pages: int = 2000
+
+
+def _cutoff(days: int) -> datetime:
+    return datetime.now(timezone.utc) - timedelta(days=days)
+
+
+class RetentionJob:
+    def __init__(
+        self,
+        policy: RetentionPolicy,
+        session_factory: Callable[[], Session] = SessionLocal,
+        interval_seconds: float = 24 * 3600,
+    ):
+        self.policy = policy
+        self.session_factory = session_factory
+        self.interval_seconds = interval_seconds
+        self._task: Optional[asyncio.Task] = None
+        self._stopping: Optional[asyncio.Event] = None
+
+    # ---------- batching ----------
+    def _batch_end(self, db: Session, id_column, *where) -> Optional[int]:
+        """Largest id among the next ``batch_size`` matching rows, or None when done."""
+        window = select(id_column.label("id")).where(*where).order_by(id_column).limit(self.policy.batch_size).subquery()
+        return db.execute(select(func.max(window.c.id))).scalar()
+
+    def _move(self, db: Session, source: Table, archive: Table, *where) -> int:
+        if self.policy.archive:
+            names = [c.name for c in source.columns]
+            db.execute(insert(archive).from_select(names, select(*source.columns).where(*where)))
+        return db.execute(delete(source).where(*where)).rowcount or 0
+
+    def _pause(self) -> None:
+        if self.policy.pause_seconds:
+            time.sleep(self.policy.pause_seconds)
+
+    # ---------- policies ----------
+    def archive_recipients(self, db: Session) -> int:
+        if not self.policy.recipient_days:
+            return 0
+        cutoff = _cutoff(self.policy.recipient_days)
+        B, R = BroadcastMessage, BroadcastRecipient
+        broadcast_ids = db.execute(
+            select(B.id)
+            .where(
+                B.status.in_(FINISHED_STATUSES),
+                func.coalesce(B.updated_at, B.created_at) < cutoff,
+                exists().where(R.broadcast_id == B.id),
+            )
+            .order_by(B.id)
+        ).scalars().all()
+
+        total = 0
+        for broadcast_id in broadcast_ids:
+            # Collapse into exact counters before the rows they are computed from go away.
+            delivery_counters.rebuild(db, [broadcast_id])
+            db.commit()
+            moved = 0
+            while True:
+                last = self._batch_end(db, R.id, R.broadcast_id == broadcast_id)
+                if last is None:
+                    break
+                moved += self._move(db, R.__table__, broadcast_recipients_archive,
+                                    R.broadcast_id == broadcast_id, R.id <= last)
+                db.commit()
+                self._pause()
+            db.add(BroadcastEvent(
+                broadcast_id=broadcast_id,
+                event_type="recipients_archived",
+                message=f"{moved} recipient rows archived; totals kept in delivery counters",
+            ))
+            db.commit()
+            total += moved
+        return total
+
+    def archive_events(self, db: Session) -> int:
+        if not self.policy.event_days:
+            return 0
+        cutoff = _cutoff(self.policy.event_days)
+        E = BroadcastEvent
+        total = 0
+        while True:
+            last = self._batch_end(db, E.id, E.created_at < cutoff)
+            if last is None:
+                return total
+            total += self._move(db, E.__table__, broadcast_events_archive, E.created_at < cutoff, E.id <= last)
+            db.commit()
+            self._pause()
+
+    def archive_messages(self, db: Session) -> int:
+        if not self.policy.message_days:
+            return 0
+        cutoff = _cutoff(self.policy.message_days)
+        M, MR = Message, MessageRecipient
+        total = 0
+        while True:
+            last = self._batch_end(db, M.id, M.created_at < cutoff)
+            if last is None:
+                return total
+            batch = select(M.id).where(M.created_at < cutoff, M.id <= last)
+            self._move(db, MR.__table__, message_recipients_archive, MR.message_id.in_(batch))
+            total += self._move(db, M.__table__, messages_archive, M.created_at < cutoff, M.id <= last)
+            db.commit()
+            self._pause()
+
+    def compact_sync_log(self, db: Session) -> int:
+        """Drop sync_changes entries superseded by a later entry for the same row."""
+        S = SyncChange
+        later = S.__table__.alias("later")
+        superseded = exists().where(later.c.entity == S.entity, later.c.entity_id == S.entity_id, later.c.seq > S.seq)
+        total = 0
+        start = 0
+        while True:
+            last = self._batch_end(db, S.seq, S.seq > start)
+            if last is None:
+                return total
+            total += db.execute(delete(S).where(S.seq > start, S.seq <= last, superseded)).rowcount or 0
+            db.commit()
+            self._pause()
+            start = last
+
+    def incremental_vacuum(self, db: Session) -> int:
+        """Release free pages ``vacuum_pages`` at a time until the freelist is empty.
+
+        Each step is its own short write, with the same pause as the row batches.
+        Returns the number of pages released.
+        """
+        released = 0
+        free = db.execute(text("PRAGMA freelist_count")).scalar()
+        while free:
+            db.commit()
+            # executescript steps the pragma to completion; execute() would free one page.
+            db.connection().connection.driver_connection.executescript(
+                f"PRAGMA incremental_vacuum({int(self.policy.vacuum_pages)})"
+            )
+            remaining = db.execute(text("PRAGMA freelist_count")).scalar()
+            if remaining >= free:
+                break
+            released += free - remaining
+            free = remaining
+            self._pause()
+        return released
+
+    def maintain(self, db: Session) -> None:
+        if not IS_SQLITE:
+            return
+        if db.execute(text("PRAGMA auto_vacuum")).scalar() == 2:  # INCREMENTAL
+            self.incremental_vacuum(db)
+        db.execute(text("PRAGMA optimize"))
+        db.commit()
+
+    # ---------- runs ----------
+    def run_once(self) -> dict:
+        started = time.perf_counter()
+        db = self.session_factory()
+        try:
+            report = {
+                "broadcast_recipients": self.archive_recipients(db),
+                "broadcast_events": self.archive_events(db),
+                "messages": self.archive_messages(db),
+                "sync_changes": self.compact_sync_log(db),
+            }
+            if any(report.values()):
+                self.maintain(db)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        report["seconds"] = round(time.perf_counter() - started, 3)
+        logger.info("Retention run finished", extra={"retention": report})
+        return report
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._stopping = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._stopping.set()
+        await self._task
+        self._task = None
+
+    async def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await asyncio.to_thread(self.run_once)
+            except Exception:
+                logger.exception("Retention run failed")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+
+def policy_from_env() -> RetentionPolicy:
+    return RetentionPolicy(
+        recipient_days=int(os.getenv("RETENTION_RECIPIENT_DAYS", "30")),
+        event_days=int(os.getenv("RETENTION_EVENT_DAYS", "90")),
+        message_days=int(os.getenv("RETENTION_MESSAGE_DAYS", "365")),
+        archive=os.getenv("RETENTION_ARCHIVE", "1") == "1",
+        batch_size=int(os.getenv("RETENTION_BATCH_SIZE", "5000")),
+        pause_seconds=float(os.getenv("RETENTION_BATCH_PAUSE_SECONDS", "0.05")),
+        vacuum_pages=int(os.getenv("RETENTION_VACUUM_PAGES", "2000")),
+    )
+
+
+retention_job = RetentionJob(
+    policy_from_env(),
+    interval_seconds=float(os.getenv("RETENTION_INTERVAL_HOURS", "24")) * 3600,
+)
+
+
+if __name__ == "__main__":
+    from database.connection import Base, engine
+    import database.models  # noqa: F401
+
+    Base.metadata.create_all(bind=engine)
+    print(retention_job.run_once())
@@ -0,0 +1,265 @@
+"""Full-text search over direct messages, broadcasts and broadcast events.
+
+Each searchable table gets an FTS5 index in external-content mode (the index
+stores only tokens; text is read back from the source table for snippets):
+
+* ``messages_fts``: ``messages.body``
+* ``broadcasts_fts``: ``broadcast_messages.subject`` and ``body``
+* ``broadcast_events_fts``: ``broadcast_events.message``
+
+Triggers on the source tables keep the indexes in step with every INSERT,
+DELETE and text UPDATE, including bulk Core statements and the retention job,
+so nothing in the application has to remember to reindex. Status-only updates
+of broadcasts do not touch the index.
+
+``install`` creates what is missing (at startup) and fills newly created
+indexes from existing rows; ``python -m services.search rebuild`` rebuilds them
+from scratch and ``optimize`` merges index segments. Search needs SQLite with
+FTS5; on other databases ``available`` stays false and the API answers 503.
+"""
+from __future__ import annotations
+
+import html
+import logging
+import re
+import time
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session, aliased
+
+from database.connection import IS_SQLITE
+from database.models import BroadcastEvent, BroadcastMessage, Message, User
+from routes.pagination import clamp_limit, decode_cursor, encode_cursor
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class FtsIndex:
+    kind: str
+    name: str
+    source: str
+    columns: tuple[str, ...]
+    weights: tuple[float, ...]   # bm25 column weights
+
+    def _values(self, prefix: str) -> str:
+        return ", ".join(f"{prefix}.{c}" for c in self.columns)
+
+    def ddl(self) -> list[str]:
+        cols = ", ".join(self.columns)
+        return [
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.name} USING fts5("
+            f"{cols}, content='{self.source}', content_rowid='id', "
+            f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+            f"CREATE TRIGGER IF NOT EXISTS {self.name}_ai AFTER INSERT ON {self.source} BEGIN "
+            f"INSERT INTO {self.name}(rowid, {cols}) VALUES (new.id, {self._values('new')}); END",
+            f"CREATE TRIGGER IF NOT EXISTS {self.name}_ad AFTER DELETE ON {self.source} BEGIN "
+            f"INSERT INTO {self.name}({self.name}, rowid, {cols}) VALUES ('delete', old.id, {self._values('old')}); END",
+            f"CREATE TRIGGER IF NOT EXISTS {self.name}_au AFTER UPDATE OF {cols} ON {self.source} BEGIN "
+            f"INSERT INTO {self.name}({self.name}, rowid, {cols}) VALUES ('delete', old.id, {self._values('old')}); "
+            f"INSERT INTO {self.name}(rowid, {cols}) VALUES (new.id, {self._values('new')}); END",
+        ]
+
+    def select(self) -> str:
+        weights = ", ".join(str(w) for w in self.weights)
+        return (
+            f"SELECT '{self.kind}' AS kind, rowid AS id, bm25({self.name}, {weights}) AS score, "
+            f"snippet({self.name}, -1, :mark_start, :mark_end, '…', :tokens) AS snippet "
+            f"FROM {self.name} WHERE {self.name} MATCH :query"
+        )
+
+
+INDEXES = (
+    FtsIndex("message", "messages_fts", "messages", ("body",), (1.0,)),
+    FtsIndex("broadcast", "broadcasts_fts", "broadcast_messages", ("subject", "body"), (3.0, 1.0)),
+    FtsIndex("event", "broadcast_events_fts", "broadcast_events", ("message",), (1.0,)),
+)
+KINDS = tuple(i.kind for i in INDEXES)
+
+# Private-use characters mark highlights in snippets so the text can be escaped first.
+MARK_START, MARK_END = "\ue000", "\ue001"
+SNIPPET_TOKENS = 12
+_TERM = re.compile(r"\w+", re.UNICODE)
+
+
+class SearchIndex:
+    def __init__(self):
+        self.available = False
+
+    # ---------- schema ----------
+    def _existing(self, conn) -> set[str]:
+        return set(conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'")).scalars())
+
+    def install(self, engine: Engine) -> list[str]:
+        """Create missing indexes and triggers; fill indexes that were just created.
+
+        Returns the names of the indexes that were built from existing rows.
+        """
+        if not IS_SQLITE:
+            return []
+        built = []
+        try:
+            with engine.begin() as conn:
+                existing = self._existing(conn)
+                for index in INDEXES:
+                    for statement in index.ddl():
+                        conn.execute(text(statement))
+                    if index.name not in existing:
+                        conn.execute(text(f"INSERT INTO {index.name}({index.name}) VALUES ('rebuild')"))
+                        built.append(index.name)
+        except OperationalError:
+            logger.warning("SQLite FTS5 is not available; full-text search is disabled")
+            return []
+        self.available = True
+        if built:
+            logger.info("Built full-text indexes: %s", ", ".join(built))
+        return built
+
+    def rebuild(self, engine: Engine) -> dict:
+        timings = {}
+        with engine.begin() as conn:
+            for index in INDEXES:
+                started = time.perf_counter()
+                conn.execute(text(f"INSERT INTO {index.name}({index.name}) VALUES ('rebuild')"))
+                timings[index.name] = round(time.perf_counter() - started, 3)
+        return timings
+
+    def optimize(self, engine: Engine) -> None:
+        with engine.begin() as conn:
+            for index in INDEXES:
+                conn.execute(text(f"INSERT INTO {index.name}({index.name}) VALUES ('optimize')"))
+
+    # ---------- queries ----------
+    @staticmethod
+    def match_expression(q: str) -> str:
+        """Plain words to an FTS5 query: all terms required, the last one as a prefix.
+
+        Quoting every term keeps user input from being parsed as FTS5 syntax.
+        """
+        terms = _TERM.findall(q or "")
+        if not terms:
+            raise HTTPException(status_code=400, detail="Search needs at least one word")
+        quoted = [f'"{t}"' for t in terms]
+        quoted[-1] += "*"
+        return " ".join(quoted)
+
+    def search(
+        self,
+        db: Session,
+        q: str,
+        kinds: Optional[Iterable[str]] = None,
+        cursor: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> dict:
+        """One page of hits across the requested kinds, best (lowest bm25) first.
+
+        Pages continue on (score, kind, id). Hits are resolved to their rows with at
+        most one more query per kind on the page.
+        """
+        if not self.available:
+            raise HTTPException(status_code=503, detail="Full-text search is not available on this database")
+        limit = clamp_limit(limit)
+        selected = [i for i in INDEXES if kinds is None or i.kind in set(kinds)]
+        if not selected:
+            raise HTTPException(status_code=400, detail=f"kinds must be among {', '.join(KINDS)}")
+
+        params = {
+            "query": self.match_expression(q),
+            "mark_start": MARK_START,
+            "mark_end": MARK_END,
+            "tokens": SNIPPET_TOKENS,
+            "limit": limit + 1,
+        }
+        sql = " UNION ALL ".join(i.select() for i in selected)
+        where = ""
+        if cursor:
+            score, kind, id_key = decode_cursor(cursor, 3, ((int, float), str, int))
+            if kind not in KINDS:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            where = "WHERE (score, kind, id) > (:c_score, :c_kind, :c_id)"
+            params.update(c_score=score, c_kind=kind, c_id=id_key)
+        rows = db.execute(
+            text(f"SELECT kind, id, score, snippet FROM ({sql}) {where} ORDER BY score, kind, id LIMIT :limit"),
+            params,
+        ).all()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        details = self._details(db, rows)
+        items = []
+        for row in rows:
+            detail = details.get((row.kind, row.id))
+            if detail is None:
+                continue  # deleted between the two queries
+            items.append({
+                "kind": row.kind,
+                "id": row.id,
+                "score": round(-row.score, 4),
+                "snippet_html": highlight(row.snippet),
+                **detail,
+            })
+        next_cursor = encode_cursor(rows[-1].score, rows[-1].kind, rows[-1].id) if has_more else None
+        return {"items": items, "next_cursor": next_cursor}
+
+    def _details(self, db: Session, rows) -> dict:
+        ids: dict[str, list[int]] = {}
+        for row in rows:
+            ids.setdefault(row.kind, []).append(row.id)
+        details = {}
+        if ids.get("message"):
+            Sender = aliased(User)
+            for m in (
+                db.query(Message.id, Message.created_at, Sender.username)
+                .join(Sender, Sender.id == Message.sender_id)
+                .filter(Message.id.in_(ids["message"]))
+            ):
+                details[("message", m.id)] = {"from": m.username, "created_at": m.created_at, "url": None}
+        if ids.get("broadcast"):
+            for b in db.query(
+                BroadcastMessage.id, BroadcastMessage.subject, BroadcastMessage.msg_type,
+                BroadcastMessage.status, BroadcastMessage.created_at,
+            ).filter(BroadcastMessage.id.in_(ids["broadcast"])):
+                details[("broadcast", b.id)] = {
+                    "subject": b.subject, "msg_type": b.msg_type, "status": b.status,
+                    "created_at": b.created_at, "url": f"/admin/messaging/broadcasts/{b.id}",
+                }
+        if ids.get("event"):
+            for e in db.query(
+                BroadcastEvent.id, BroadcastEvent.broadcast_id, BroadcastEvent.event_type, BroadcastEvent.created_at,
+            ).filter(BroadcastEvent.id.in_(ids["event"])):
+                details[("event", e.id)] = {
+                    "broadcast_id": e.broadcast_id, "event_type": e.event_type,
+                    "created_at": e.created_at, "url": f"/admin/messaging/broadcasts/{e.broadcast_id}",
+                }
+        return details
+
+
+def highlight(snippet: Optional[str]) -> str:
+    """Escape a snippet and turn the FTS5 match markers into <mark> tags."""
+    escaped = html.escape(snippet or "")
+    return escaped.replace(MARK_START, "<mark>").replace(MARK_END, "</mark>")
+
+
+search_index = SearchIndex()
+
+
+if __name__ == "__main__":
+    import sys
+
+    from database.connection import Base, engine
+    import database.models  # noqa: F401
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "rebuild"
+    Base.metadata.create_all(bind=engine)
+    search_index.install(engine)
+    if command == "rebuild":
+        print(search_index.rebuild(engine))
+    elif command == "optimize":
+        search_index.optimize(engine)
+    else:
+        raise SystemExit("usage: python -m services.search [rebuild|optimize]")
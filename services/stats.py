@@ -0,0 +1,217 @@
+"""Live counters for the dashboard and the admin messaging overview.
+
+Counts are held in memory and kept current from the write paths: session hooks
+record inserted, updated and deleted ``User``, ``BroadcastMessage`` and
+``Message`` rows on flush and apply them on commit, and queued recipient depth
+follows the delivery counter deltas published on ``progress_hub``. Writes that
+bypass the ORM (bulk UPDATE/DELETE statements, other processes) are caught up by
+a full recount every ``reconcile_seconds``. Reading a figure never touches the
+database.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import threading
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+from typing import Callable, Optional
+
+from sqlalchemy import event, func, inspect
+from sqlalchemy.orm import Session
+
+from database.connection import SessionLocal
+from database.models import BroadcastDeliveryCounter, BroadcastMessage, Message, User
+from services.progress import progress_hub
+from services.telemetry import telemetry
+
+logger = logging.getLogger(__name__)
+
+
+def _active(value) -> int:
+    return 1 if value else 0
+
+
+def _today() -> date:
+    return datetime.now(timezone.utc).date()
+
+
+class LiveStats:
+    def __init__(
+        self,
+        reconcile_seconds: float = 300.0,
+        message_days: int = 30,
+        session_factory: Callable[[], Session] = SessionLocal,
+    ):
+        self.reconcile_seconds = reconcile_seconds
+        self.message_days = message_days
+        self.session_factory = session_factory
+        self._lock = threading.Lock()
+        self.broadcasts: Counter = Counter()   # (msg_type, status) -> n
+        self.users: Counter = Counter()        # (role, is_active) -> n
+        self.messages_by_day: Counter = Counter()  # date -> n
+        self.queued_recipients = 0
+        self.reconciled_at: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping: Optional[asyncio.Event] = None
+
+    # ---------- incremental updates ----------
+    def apply(self, broadcasts: Counter, users: Counter, messages: Counter) -> None:
+        with self._lock:
+            self.broadcasts.update(broadcasts)
+            self.users.update(users)
+            self.messages_by_day.update(messages)
+
+    def apply_delivery(self, changes: dict[int, dict[str, int]]) -> None:
+        queued = sum(deltas.get("queued", 0) for deltas in changes.values())
+        if queued:
+            with self._lock:
+                self.queued_recipients += queued
+
+    # ---------- full recount ----------
+    def reconcile(self, db: Session) -> None:
+        broadcasts = Counter({
+            (msg_type, status): n
+            for msg_type, status, n in db.query(
+                BroadcastMessage.msg_type, BroadcastMessage.status, func.count(BroadcastMessage.id)
+            ).group_by(BroadcastMessage.msg_type, BroadcastMessage.status)
+        })
+        users = Counter({
+            (role, _active(is_active)): n
+            for role, is_active, n in db.query(User.role, User.is_active, func.count(User.id))
+            .group_by(User.role, User.is_active)
+        })
+        since = _today() - timedelta(days=self.message_days - 1)
+        day = func.date(Message.created_at)
+        messages = Counter({
+            date.fromisoformat(str(d)): n
+            for d, n in db.query(day, func.count(Message.id))
+            .filter(Message.created_at >= datetime.combine(since, datetime.min.time()))
+            .group_by(day)
+        })
+        queued = db.query(func.coalesce(func.sum(BroadcastDeliveryCounter.queued), 0)).scalar()
+        with self._lock:
+            self.broadcasts, self.users, self.messages_by_day = broadcasts, users, messages
+            self.queued_recipients = int(queued)
+            self.reconciled_at = datetime.now(timezone.utc)
+
+    def _reconcile_now(self) -> None:
+        db = self.session_factory()
+        try:
+            self.reconcile(db)
+        finally:
+            db.close()
+
+    # ---------- reads ----------
+    def snapshot(self) -> dict:
+        today = _today()
+        with self._lock:
+            by_status: Counter = Counter()
+            by_type: Counter = Counter()
+            for (msg_type, status), n in self.broadcasts.items():
+                by_status[status] += n
+                by_type[msg_type] += n
+            users_by_role: Counter = Counter()
+            active_users = 0
+            for (role, is_active), n in self.users.items():
+                users_by_role[role] += n
+                active_users += n if is_active else 0
+            days = [today - timedelta(days=i) for i in range(self.message_days - 1, -1, -1)]
+            messages_per_day = [{"date": d.isoformat(), "count": self.messages_by_day.get(d, 0)} for d in days]
+            data = {
+                "broadcasts_total": sum(by_status.values()),
+                "broadcasts_by_status": dict(by_status),
+                "broadcasts_by_type": dict(by_type),
+                "queued_recipients": self.queued_recipients,
+                "users_total": sum(users_by_role.values()),
+                "users_active": active_users,
+                "users_by_role": dict(users_by_role),
+                "messages_today": self.messages_by_day.get(today, 0),
+                "messages_per_day": messages_per_day,
+                "reconciled_at": self.reconciled_at.isoformat() if self.reconciled_at else None,
+            }
+        data["fog"] = telemetry.totals()
+        return data
+
+    # ---------- lifecycle ----------
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._stopping = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._stopping.set()
+        await self._task
+        self._task = None
+
+    async def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.reconcile_seconds)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await asyncio.to_thread(self._reconcile_now)
+            except Exception:
+                logger.exception("Stats reconciliation failed")
+
+
+live_stats = LiveStats(
+    reconcile_seconds=float(os.getenv("STATS_RECONCILE_SECONDS", "300")),
+    message_days=int(os.getenv("STATS_MESSAGE_DAYS", "30")),
+)
+progress_hub.add_listener(live_stats.apply_delivery)
+
+
+# ---------- session hooks ----------
+def _old(obj, attr: str):
+    history = inspect(obj).attrs[attr].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(obj, attr)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_stats_changes(session: Session, flush_context) -> None:
+    pending = session.info.setdefault("stats_changes", (Counter(), Counter(), Counter()))
+    broadcasts, users, messages = pending
+    for obj in session.new:
+        if isinstance(obj, BroadcastMessage):
+            broadcasts[(obj.msg_type, obj.status)] += 1
+        elif isinstance(obj, User):
+            users[(obj.role, _active(obj.is_active))] += 1
+        elif isinstance(obj, Message):
+            messages[_today()] += 1
+    for obj in session.deleted:
+        if isinstance(obj, BroadcastMessage):
+            broadcasts[(_old(obj, "msg_type"), _old(obj, "status"))] -= 1
+        elif isinstance(obj, User):
+            users[(_old(obj, "role"), _active(_old(obj, "is_active")))] -= 1
+    for obj in session.dirty:
+        if isinstance(obj, BroadcastMessage):
+            before = (_old(obj, "msg_type"), _old(obj, "status"))
+            after = (obj.msg_type, obj.status)
+            if before != after:
+                broadcasts[before] -= 1
+                broadcasts[after] += 1
+        elif isinstance(obj, User):
+            before = (_old(obj, "role"), _active(_old(obj, "is_active")))
+            after = (obj.role, _active(obj.is_active))
+            if before != after:
+                users[before] -= 1
+                users[after] += 1
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_stats_changes(session: Session) -> None:
+    pending = session.info.pop("stats_changes", None)
+    if pending and any(pending):
+        live_stats.apply(*pending)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_stats_changes(session: Session) -> None:
+    session.info.pop("stats_changes", None)
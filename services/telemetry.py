@@ -0,0 +1,361 @@
+"""Live fog node telemetry.
+
+Fog nodes post heartbeats (connected users, storage used/free, latency). The
+latest ``capacity`` samples per node live in memory in a ``RingSeries``: one
+preallocated ``array('d')`` per field, overwritten oldest first, so memory per
+node is fixed no matter how often it reports. Each heartbeat is also folded into
+1-minute and 1-hour rollup buckets, which a background task writes to
+``fog_telemetry_rollups`` every ``flush_interval_seconds`` (one row per node per
+bucket, updated in place) instead of storing every heartbeat. The fog node and
+dashboard pages read live figures straight from memory.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from array import array
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database.connection import SessionLocal
+from database.models import FogDevice, FogTelemetryRollup
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ("ts", "connected_users", "storage_used", "storage_free", "latency_ms")
+RESOLUTIONS = {"1m": 60, "1h": 3600}
+
+
+def format_bytes(n: Optional[float]) -> str:
+    if n is None or math.isnan(n):
+        return "—"
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if abs(n) < 1024 or unit == "TB":
+            return f"{n:.0f}{unit}" if unit == "B" else f"{n:.1f}{unit}"
+        n /= 1024
+
+
+class RingSeries:
+    """Fixed-capacity samples stored column-wise; appending past capacity drops the oldest."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._cols = {f: array("d", [math.nan]) * capacity for f in FIELDS}
+        self._next = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, sample: dict) -> None:
+        i = self._next
+        for f in FIELDS:
+            value = sample.get(f)
+            self._cols[f][i] = math.nan if value is None else float(value)
+        self._next = (i + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+    def _indexes(self, n: Optional[int] = None):
+        n = self._size if n is None else min(n, self._size)
+        start = (self._next - n) % self.capacity
+        return ((start + k) % self.capacity for k in range(n))
+
+    def recent(self, n: Optional[int] = None) -> list[dict]:
+        """The last ``n`` samples (all by default), oldest first; missing values are None."""
+        out = []
+        for i in self._indexes(n):
+            row = {}
+            for f in FIELDS:
+                v = self._cols[f][i]
+                row[f] = None if math.isnan(v) else v
+            out.append(row)
+        return out
+
+    def latest(self) -> Optional[dict]:
+        rows = self.recent(1)
+        return rows[0] if rows else None
+
+    def mean(self, f: str, n: int) -> Optional[float]:
+        values = [v for v in (self._cols[f][i] for i in self._indexes(n)) if not math.isnan(v)]
+        return sum(values) / len(values) if values else None
+
+
+@dataclass
+class _Bucket:
+    samples: int = 0
+    users_sum: float = 0.0
+    users_max: float = 0.0
+    latency_sum: float = 0.0
+    latency_n: int = 0
+    latency_max: Optional[float] = None
+    storage_used: Optional[float] = None
+    storage_free: Optional[float] = None
+    version: int = 0
+    persisted: int = 0
+
+    def add(self, s: dict) -> None:
+        self.samples += 1
+        users = s.get("connected_users") or 0
+        self.users_sum += users
+        self.users_max = max(self.users_max, users)
+        if s.get("latency_ms") is not None:
+            self.latency_sum += s["latency_ms"]
+            self.latency_n += 1
+            self.latency_max = s["latency_ms"] if self.latency_max is None else max(self.latency_max, s["latency_ms"])
+        if s.get("storage_used") is not None:
+            self.storage_used = s["storage_used"]
+        if s.get("storage_free") is not None:
+            self.storage_free = s["storage_free"]
+        self.version += 1
+
+    def row(self) -> dict:
+        return {
+            "samples": self.samples,
+            "connected_users_avg": round(self.users_sum / self.samples) if self.samples else 0,
+            "connected_users_max": int(self.users_max),
+            "latency_ms_avg": round(self.latency_sum / self.latency_n) if self.latency_n else None,
+            "latency_ms_max": None if self.latency_max is None else round(self.latency_max),
+            "storage_used_bytes": None if self.storage_used is None else int(self.storage_used),
+            "storage_free_bytes": None if self.storage_free is None else int(self.storage_free),
+        }
+
+
+@dataclass
+class _Node:
+    device_id: int
+    name: str
+    series: RingSeries
+    last_seen: Optional[float] = None
+    persisted_status: Optional[str] = None
+    buckets: dict = field(default_factory=dict)  # (resolution, bucket start epoch) -> _Bucket
+
+
+class TelemetryStore:
+    def __init__(
+        self,
+        capacity: int = 720,
+        offline_after_seconds: float = 90.0,
+        latency_window: int = 10,
+        flush_interval_seconds: float = 30.0,
+        session_factory: Callable[[], Session] = SessionLocal,
+    ):
+        self.capacity = capacity
+        self.offline_after_seconds = offline_after_seconds
+        self.latency_window = latency_window
+        self.flush_interval_seconds = flush_interval_seconds
+        self.session_factory = session_factory
+        self._nodes: dict[int, _Node] = {}
+        self._by_name: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping: Optional[asyncio.Event] = None
+
+    # ---------- registry ----------
+    def load(self, db: Session) -> int:
+        """Register every known FogDevice (no samples yet, so they start offline)."""
+        devices = db.query(FogDevice.id, FogDevice.name, FogDevice.status).all()
+        with self._lock:
+            for device_id, name, status in devices:
+                self._add_node(device_id, name or f"fog-{device_id}", status)
+        return len(devices)
+
+    def clear(self) -> None:
+        """Forget every node and its samples (after the database was replaced)."""
+        with self._lock:
+            self._nodes.clear()
+            self._by_name.clear()
+
+    def _add_node(self, device_id: int, name: str, status: Optional[str] = None) -> _Node:
+        node = self._nodes.get(device_id)
+        if node is None:
+            node = _Node(device_id, name, RingSeries(self.capacity), persisted_status=status)
+            self._nodes[device_id] = node
+            self._by_name[name] = device_id
+        return node
+
+    def device_id(self, name: str) -> Optional[int]:
+        return self._by_name.get(name)
+
+    def register(self, db: Session, name: str) -> int:
+        """Create (or find) the FogDevice row for a node reporting for the first time."""
+        device = db.query(FogDevice).filter(FogDevice.name == name).first()
+        if device is None:
+            try:
+                db.execute(insert(FogDevice).values(name=name, status="online"))
+                db.commit()
+            except IntegrityError:
+                db.rollback()  # a concurrent first heartbeat from the same node won; use its row
+            device = db.query(FogDevice).filter(FogDevice.name == name).one()
+        with self._lock:
+            self._add_node(device.id, name, device.status)
+        return device.id
+
+    # ---------- ingestion ----------
+    def record(self, device_id: int, connected_users: int, storage_used: Optional[int],
+               storage_free: Optional[int], latency_ms: Optional[float], now: Optional[float] = None) -> None:
+        now = time.time() if now is None else now
+        sample = {
+            "ts": now,
+            "connected_users": connected_users,
+            "storage_used": storage_used,
+            "storage_free": storage_free,
+            "latency_ms": latency_ms,
+        }
+        with self._lock:
+            node = self._nodes[device_id]
+            node.series.append(sample)
+            node.last_seen = now
+            for resolution, seconds in RESOLUTIONS.items():
+                key = (resolution, int(now // seconds) * seconds)
+                bucket = node.buckets.get(key)
+                if bucket is None:
+                    bucket = node.buckets[key] = _Bucket()
+                bucket.add(sample)
+
+    # ---------- live figures ----------
+    def _status(self, node: _Node, now: float) -> str:
+        if node.last_seen is not None and now - node.last_seen <= self.offline_after_seconds:
+            return "online"
+        return "offline"
+
+    def nodes(self) -> list[dict]:
+        now = time.time()
+        out = []
+        with self._lock:
+            nodes = sorted(self._nodes.values(), key=lambda n: n.device_id)
+            for node in nodes:
+                latest = node.series.latest() or {}
+                latency = node.series.mean("latency_ms", self.latency_window)
+                out.append({
+                    "id": node.device_id,
+                    "name": node.name,
+                    "status": self._status(node, now),
+                    "people_connected": int(latest.get("connected_users") or 0),
+                    "storage_used_bytes": latest.get("storage_used"),
+                    "storage_free_bytes": latest.get("storage_free"),
+                    "storage_used": format_bytes(latest.get("storage_used")),
+                    "storage_free": format_bytes(latest.get("storage_free")),
+                    "latency_ms": None if latency is None else round(latency),
+                    "latency": "—" if latency is None else f"{latency:.0f}ms",
+                    "last_seen_seconds": None if node.last_seen is None else round(now - node.last_seen),
+                })
+        return out
+
+    def totals(self) -> dict:
+        online = [n for n in self.nodes() if n["status"] == "online"]
+        used = sum(n["storage_used_bytes"] or 0 for n in online)
+        return {
+            "nodes": len(self._nodes),
+            "online": len(online),
+            "people_connected": sum(n["people_connected"] for n in online),
+            "storage_used_bytes": used,
+            "storage_used": format_bytes(used),
+        }
+
+    def samples(self, device_id: int, limit: Optional[int] = None) -> Optional[list[dict]]:
+        with self._lock:
+            node = self._nodes.get(device_id)
+            return None if node is None else node.series.recent(limit)
+
+    # ---------- persistence ----------
+    def _collect(self) -> tuple[list, dict]:
+        now = time.time()
+        rows, statuses = [], {}
+        with self._lock:
+            for node in self._nodes.values():
+                for (resolution, start), bucket in node.buckets.items():
+                    if bucket.version != bucket.persisted:
+                        closed = start + RESOLUTIONS[resolution] <= now
+                        rows.append((node.device_id, resolution, start, bucket.version, closed, bucket.row()))
+                status = self._status(node, now)
+                if status != node.persisted_status:
+                    statuses[node.device_id] = status
+        return rows, statuses
+
+    def _write(self, rows: list, statuses: dict) -> None:
+        db = self.session_factory()
+        try:
+            R = FogTelemetryRollup
+            for device_id, resolution, start, _version, _closed, values in rows:
+                bucket_start = datetime.fromtimestamp(start, timezone.utc)
+                result = db.execute(
+                    update(R)
+                    .where(R.device_id == device_id, R.resolution == resolution, R.bucket_start == bucket_start)
+                    .values(**values)
+                    .execution_options(synchronize_session=False)
+                )
+                if not result.rowcount:
+                    db.add(R(device_id=device_id, resolution=resolution, bucket_start=bucket_start, **values))
+            for device_id, status in statuses.items():
+                db.execute(
+                    update(FogDevice).where(FogDevice.id == device_id).values(status=status)
+                    .execution_options(synchronize_session=False)
+                )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _mark_persisted(self, rows: list, statuses: dict) -> None:
+        with self._lock:
+            for device_id, resolution, start, version, closed, _values in rows:
+                node = self._nodes[device_id]
+                bucket = node.buckets.get((resolution, start))
+                if bucket is None:
+                    continue
+                bucket.persisted = version
+                if closed and bucket.version == version:
+                    del node.buckets[(resolution, start)]
+            for device_id, status in statuses.items():
+                self._nodes[device_id].persisted_status = status
+
+    async def flush(self) -> int:
+        rows, statuses = self._collect()
+        if not rows and not statuses:
+            return 0
+        await asyncio.to_thread(self._write, rows, statuses)
+        self._mark_persisted(rows, statuses)
+        return len(rows)
+
+    # ---------- lifecycle ----------
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._stopping = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._stopping.set()
+        await self._task
+        self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.flush_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Fog telemetry flush failed")
+
+
+telemetry = TelemetryStore(
+    capacity=int(os.getenv("TELEMETRY_SAMPLES_PER_NODE", "720")),
+    offline_after_seconds=float(os.getenv("TELEMETRY_OFFLINE_SECONDS", "90")),
+    flush_interval_seconds=float(os.getenv("TELEMETRY_FLUSH_SECONDS", "30")),
+)
@@ -0,0 +1,303 @@
+"""Bulk import of mobile users from CSV.
+
+The file is read as a stream and handled ``batch_size`` rows at a time, so
+memory stays flat however long it is:
+
+1. rows are validated (``username``, ``email``, ``password`` columns; header
+   required, extra columns ignored);
+2. usernames and emails already taken are looked up for the whole batch with
+   one ``IN`` query per column, which the unique indexes answer directly;
+   duplicates inside the batch are caught in memory, and duplicates of earlier
+   batches by the lookup, since those are committed by then;
+3. the remaining passwords are hashed in parallel on a process pool (bcrypt is
+   CPU-bound), at the work factor the login path uses;
+4. the batch is inserted with one executemany INSERT and committed.
+
+A row that fails is reported with its line number and skipped; the rest of the
+import carries on. Only the first ``max_errors`` errors are kept in the result.
+If the file itself turns out unreadable partway (not UTF-8), the import stops
+there and the result says so; batches already committed stay imported.
+At most ``max_concurrent`` imports run at once; further calls are refused with
+``ImportBusyError`` instead of queueing behind them.
+
+    python -m services.user_import residents.csv
+"""
+from __future__ import annotations
+
+import csv
+import io
+import logging
+import multiprocessing
+import os
+import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Callable, Iterable, Iterator, Optional
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database.connection import SessionLocal
+from database.models import User
+from services.audience import named_audiences, resident_audience
+from services.passwords import hash_password, password_hasher
+from services.stats import live_stats
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_COLUMNS = ("username", "email", "password")
+MIN_PASSWORD_LENGTH = 6
+_EMAIL = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+_USERNAME_MAX = User.__table__.c.username.type.length
+_EMAIL_MAX = User.__table__.c.email.type.length
+
+
+class ImportFormatError(ValueError):
+    """The file cannot be imported at all (e.g. missing columns)."""
+
+
+class ImportBusyError(RuntimeError):
+    """Every import slot is taken."""
+
+
+@dataclass
+class ImportResult:
+    max_errors: int = 1000
+    rows: int = 0
+    created: int = 0
+    failed: int = 0
+    errors: list = field(default_factory=list)
+    stopped: Optional[str] = None  # why the file could not be read to the end
+    seconds: float = 0.0
+
+    def error(self, line: int, message: str) -> None:
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line, "error": message})
+
+    def as_dict(self) -> dict:
+        return {
+            "rows": self.rows,
+            "created": self.created,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+            "stopped": self.stopped,
+            "seconds": round(self.seconds, 2),
+        }
+
+
+@dataclass
+class _Row:
+    line: int
+    username: str
+    email: str
+    password: str
+
+
+def _rows(lines: Iterable[str]) -> Iterator[tuple[int, dict]]:
+    reader = csv.DictReader(lines)
+    columns = [c.strip().lower() for c in (reader.fieldnames or [])]
+    missing = [c for c in REQUIRED_COLUMNS if c not in columns]
+    if missing:
+        raise ImportFormatError(f"CSV header must include: {', '.join(missing)}")
+    reader.fieldnames = columns
+    for record in reader:
+        yield reader.line_num, record
+
+
+def _validate(line: int, record: dict) -> tuple[Optional[_Row], Optional[str]]:
+    username = (record.get("username") or "").strip()
+    email = (record.get("email") or "").strip()
+    password = record.get("password") or ""
+    if not username:
+        return None, "username is required"
+    if len(username) > _USERNAME_MAX:
+        return None, f"username is longer than {_USERNAME_MAX} characters"
+    if not _EMAIL.match(email) or len(email) > _EMAIL_MAX:
+        return None, "email is not a valid address"
+    if len(password) < MIN_PASSWORD_LENGTH:
+        return None, f"password must be at least {MIN_PASSWORD_LENGTH} characters"
+    return _Row(line, username, email, password), None
+
+
+class UserImporter:
+    def __init__(
+        self,
+        hash_workers: int,
+        batch_size: int = 500,
+        max_errors: int = 1000,
+        max_concurrent: int = 1,
+        session_factory: Callable[[], Session] = SessionLocal,
+    ):
+        self.hash_workers = hash_workers
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+        self.session_factory = session_factory
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+
+    def _hash_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn, not fork: the server process has threads (and locks) of its own.
+            self._pool = ProcessPoolExecutor(self.hash_workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    # ---------- per batch ----------
+    def _taken(self, db: Session, rows: list[_Row]) -> tuple[set[str], set[str]]:
+        usernames = set(db.execute(select(User.username).where(User.username.in_({r.username for r in rows}))).scalars())
+        emails = set(db.execute(select(User.email).where(User.email.in_({r.email for r in rows}))).scalars())
+        return usernames, emails
+
+    def _insert(self, db: Session, rows: list[_Row], hashes: list[str], result: ImportResult) -> list[int]:
+        values = [
+            {"username": r.username, "email": r.email, "password_hash": h, "role": "mobile", "is_active": 1}
+            for r, h in zip(rows, hashes)
+        ]
+        try:
+            db.execute(insert(User.__table__), values)
+            db.commit()
+            inserted = rows
+        except IntegrityError:
+            # Someone registered one of these names since the lookup; go row by row.
+            db.rollback()
+            inserted = []
+            for row, value in zip(rows, values):
+                try:
+                    db.execute(insert(User.__table__), value)
+                    db.commit()
+                    inserted.append(row)
+                except IntegrityError:
+                    db.rollback()
+                    result.error(row.line, "username or email already exists")
+        if not inserted:
+            return []
+        return list(db.execute(select(User.id).where(User.email.in_([r.email for r in inserted]))).scalars())
+
+    def _process(self, db: Session, batch: list[tuple[int, dict]], result: ImportResult) -> None:
+        rows: list[_Row] = []
+        seen_usernames: set[str] = set()
+        seen_emails: set[str] = set()
+        for line, record in batch:
+            row, problem = _validate(line, record)
+            if problem:
+                result.error(line, problem)
+            elif row.username in seen_usernames or row.email in seen_emails:
+                result.error(line, "duplicate of an earlier row in the file")
+            else:
+                seen_usernames.add(row.username)
+                seen_emails.add(row.email)
+                rows.append(row)
+        if not rows:
+            return
+
+        usernames, emails = self._taken(db, rows)
+        db.rollback()  # end the read transaction before the slow hashing step
+        fresh = []
+        for row in rows:
+            if row.username in usernames:
+                result.error(row.line, "username already taken")
+            elif row.email in emails:
+                result.error(row.line, "email already registered")
+            else:
+                fresh.append(row)
+        if not fresh:
+            return
+
+        rounds = password_hasher.rounds
+        chunk = max(1, len(fresh) // (self.hash_workers * 4))
+        hashes = list(self._hash_pool().map(
+            hash_password, [r.password for r in fresh], [rounds] * len(fresh), chunksize=chunk,
+        ))
+
+        new_ids = self._insert(db, fresh, hashes, result)
+        result.created += len(new_ids)
+        # Core INSERTs skip the ORM session hooks; tell the caches ourselves.
+        if new_ids:
+            resident_audience.mark_users_changed(new_ids)
+            named_audiences.mark_changed(["role"])
+            live_stats.apply(Counter(), Counter({("mobile", 1): len(new_ids)}), Counter())
+
+    # ---------- entry points ----------
+    def run(self, lines: Iterable[str], on_batch: Optional[Callable[[ImportResult], None]] = None) -> ImportResult:
+        if not self._slots.acquire(blocking=False):
+            raise ImportBusyError("Another user import is running; try again when it has finished")
+        try:
+            return self._run(lines, on_batch)
+        finally:
+            self._slots.release()
+
+    def _run(self, lines: Iterable[str], on_batch: Optional[Callable[[ImportResult], None]]) -> ImportResult:
+        result = ImportResult(max_errors=self.max_errors)
+        started = time.perf_counter()
+        rows = _rows(lines)
+        db = self.session_factory()
+        try:
+            while True:
+                try:
+                    batch = list(islice(rows, self.batch_size))
+                except UnicodeDecodeError:
+                    # Earlier batches are committed; report them along with where it stopped.
+                    result.stopped = f"CSV must be UTF-8 encoded; stopped after {result.rows} rows"
+                    break
+                if not batch:
+                    break
+                result.rows += len(batch)
+                self._process(db, batch, result)
+                if on_batch:
+                    on_batch(result)
+        finally:
+            db.close()
+        result.seconds = time.perf_counter() - started
+        logger.info("User import finished", extra={"user_import": {k: v for k, v in result.as_dict().items() if k != "errors"}})
+        return result
+
+    def run_binary(self, stream, **kwargs) -> ImportResult:
+        """Import from a binary file object (e.g. an upload), decoding as UTF-8 with or without BOM."""
+        return self.run(io.TextIOWrapper(stream, encoding="utf-8-sig", newline=""), **kwargs)
+
+
+user_importer = UserImporter(
+    hash_workers=int(os.getenv("IMPORT_HASH_WORKERS", str(os.cpu_count() or 1))),
+    batch_size=int(os.getenv("IMPORT_BATCH_SIZE", "500")),
+    max_errors=int(os.getenv("IMPORT_MAX_ERRORS", "1000")),
+    max_concurrent=int(os.getenv("IMPORT_MAX_CONCURRENT", "1")),
+)
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    import sys
+
+    from database.connection import Base, engine
+    import database.models  # noqa: F401
+
+    parser = argparse.ArgumentParser(description="Import mobile users from a CSV file")
+    parser.add_argument("path", help="CSV with username,email,password columns ('-' for stdin)")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    password_hasher.calibrate()
+    progress = lambda r: print(f"{r.rows} rows, {r.created} created, {r.failed} failed", file=sys.stderr)  # noqa: E731
+    try:
+        if args.path == "-":
+            result = user_importer.run(sys.stdin, on_batch=progress)
+        else:
+            with open(args.path, newline="", encoding="utf-8-sig") as f:
+                result = user_importer.run(f, on_batch=progress)
+    except ImportFormatError as exc:
+        raise SystemExit(str(exc))
+    finally:
+        user_importer.shutdown()
+    print(json.dumps(result.as_dict(), indent=2))
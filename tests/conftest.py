@@ -0,0 +1,22 @@
+import os
+import tempfile
+
+# database.connection builds its engines at import time; keep them off ./capstone.db.
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/test.db")
+os.environ.setdefault("DISPATCH_ENABLED", "0")
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database.connection import Base
+import database.models  # noqa: F401
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    """A fresh SQLite database with the full schema, as a session factory."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'app.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine.dispose()
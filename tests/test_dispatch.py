@@ -0,0 +1,198 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from database.models import BroadcastEvent, BroadcastMessage, BroadcastRecipient, User
+from services import delivery_counters, dispatch
+from services.dispatch import DispatchWorker, FakeTransport
+
+START = datetime(2026, 1, 1, 12, 0, tzinfo=timezone.utc)
+
+
+class Clock:
+    def __init__(self):
+        self.now = START
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += timedelta(seconds=seconds)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(dispatch, "_utcnow", clock)
+    return clock
+
+
+def make_broadcast(session_factory, user_ids, priority=10, ttl_expires_at=None) -> int:
+    db = session_factory()
+    try:
+        for uid in user_ids:
+            if db.get(User, uid) is None:
+                db.add(User(id=uid, email=f"user{uid}@example.com", password_hash="x", role="mobile"))
+        b = BroadcastMessage(
+            subject="Flood warning", body="Move to higher ground", status="queued",
+            priority=priority, ttl_expires_at=ttl_expires_at, created_at=START,
+        )
+        db.add(b)
+        db.flush()
+        db.add_all(BroadcastRecipient(broadcast_id=b.id, user_id=uid, status="queued") for uid in user_ids)
+        delivery_counters.init(db, b.id, len(user_ids))
+        db.commit()
+        return b.id
+    finally:
+        db.close()
+
+
+def recipients(session_factory, broadcast_id) -> dict[int, tuple]:
+    db = session_factory()
+    try:
+        return {
+            r.user_id: (r.status, r.attempts, r.fail_reason)
+            for r in db.query(BroadcastRecipient).filter(BroadcastRecipient.broadcast_id == broadcast_id)
+        }
+    finally:
+        db.close()
+
+
+def broadcast_status(session_factory, broadcast_id) -> str:
+    db = session_factory()
+    try:
+        return db.get(BroadcastMessage, broadcast_id).status
+    finally:
+        db.close()
+
+
+def event_types(session_factory, broadcast_id) -> list[str]:
+    db = session_factory()
+    try:
+        return [e.event_type for e in db.query(BroadcastEvent).filter(BroadcastEvent.broadcast_id == broadcast_id)]
+    finally:
+        db.close()
+
+
+def run(worker: DispatchWorker) -> int:
+    return asyncio.run(worker.run_once())
+
+
+def test_sends_every_recipient_and_finishes(session_factory, clock):
+    broadcast_id = make_broadcast(session_factory, [1, 2, 3])
+    transport = FakeTransport()
+    worker = DispatchWorker(transport, session_factory, max_in_flight=2)
+
+    assert run(worker) == 3
+    assert sorted(transport.sent) == [(broadcast_id, 1), (broadcast_id, 2), (broadcast_id, 3)]
+    assert transport.max_in_flight <= 2
+    assert {s for s, _, _ in recipients(session_factory, broadcast_id).values()} == {"sent"}
+    assert broadcast_status(session_factory, broadcast_id) == "sent"
+    assert run(worker) == 0
+
+
+def test_higher_priority_broadcast_goes_first(session_factory, clock):
+    low = make_broadcast(session_factory, [1], priority=10)
+    high = make_broadcast(session_factory, [2], priority=100)
+    transport = FakeTransport()
+    worker = DispatchWorker(transport, session_factory)
+
+    run(worker)
+    assert transport.sent == [(high, 2)]
+    run(worker)
+    assert transport.sent == [(high, 2), (low, 1)]
+
+
+def test_failed_sends_back_off_then_fail_after_max_attempts(session_factory, clock):
+    broadcast_id = make_broadcast(session_factory, [1, 2])
+    transport = FakeTransport(fail_user_ids={2})
+    worker = DispatchWorker(transport, session_factory, max_attempts=3, backoff_base_seconds=10)
+
+    assert run(worker) == 2
+    assert recipients(session_factory, broadcast_id)[2] == ("queued", 1, "user 2 unreachable")
+
+    # Still backing off: nothing is eligible yet.
+    clock.advance(9)
+    assert run(worker) == 0
+
+    clock.advance(1)
+    assert run(worker) == 1
+    assert recipients(session_factory, broadcast_id)[2][:2] == ("queued", 2)
+
+    # The second backoff doubles.
+    clock.advance(10)
+    assert run(worker) == 0
+    clock.advance(10)
+    assert run(worker) == 1
+
+    assert recipients(session_factory, broadcast_id) == {
+        1: ("sent", 1, None),
+        2: ("failed", 3, "user 2 unreachable"),
+    }
+    assert transport.sent == [(broadcast_id, 1)]
+    assert broadcast_status(session_factory, broadcast_id) == "sent"
+    assert "dispatched" in event_types(session_factory, broadcast_id)
+
+
+def test_expired_broadcast_is_failed_without_sending(session_factory, clock):
+    broadcast_id = make_broadcast(session_factory, [1, 2], ttl_expires_at=START + timedelta(minutes=5))
+    transport = FakeTransport()
+    worker = DispatchWorker(transport, session_factory)
+
+    clock.advance(5 * 60)
+    assert run(worker) == 0
+    assert transport.sent == []
+    assert {r[2] for r in recipients(session_factory, broadcast_id).values()} == {"ttl_expired"}
+    assert broadcast_status(session_factory, broadcast_id) == "failed"
+    assert "expired" in event_types(session_factory, broadcast_id)
+
+
+def test_restarted_worker_resumes_without_resending(session_factory, clock):
+    broadcast_id = make_broadcast(session_factory, [1, 2, 3, 4, 5])
+    transport = FakeTransport()
+
+    first = DispatchWorker(transport, session_factory, batch_size=2)
+    assert run(first) == 2
+
+    # A fresh worker stands in for a restarted process; all state lives in the rows.
+    second = DispatchWorker(transport, session_factory, batch_size=2)
+    while run(second):
+        pass
+
+    assert sorted(uid for _, uid in transport.sent) == [1, 2, 3, 4, 5]
+    assert broadcast_status(session_factory, broadcast_id) == "sent"
+
+
+def test_batch_claimed_before_a_crash_is_retried_after_backoff(session_factory, clock):
+    broadcast_id = make_broadcast(session_factory, [1, 2])
+    crashed = DispatchWorker(FakeTransport(), session_factory, backoff_base_seconds=10)
+    job, user_ids = crashed._claim_batch()  # claimed, never sent or recorded
+    assert sorted(user_ids) == [1, 2]
+
+    transport = FakeTransport()
+    restarted = DispatchWorker(transport, session_factory, backoff_base_seconds=10)
+    assert run(restarted) == 0
+
+    clock.advance(10)
+    assert run(restarted) == 2
+    assert sorted(transport.sent) == [(broadcast_id, 1), (broadcast_id, 2)]
+    assert recipients(session_factory, broadcast_id)[1] == ("sent", 2, None)
+
+
+def test_stranded_final_attempts_are_failed_while_other_traffic_flows(session_factory, clock):
+    stranded = make_broadcast(session_factory, [1], priority=100)
+    worker = DispatchWorker(FakeTransport(), session_factory, max_attempts=1, backoff_base_seconds=10)
+    worker._claim_batch()  # final attempt claimed, then the process died
+
+    busy = make_broadcast(session_factory, list(range(2, 12)), priority=10)
+    clock.advance(10)
+    restarted = DispatchWorker(FakeTransport(), session_factory, batch_size=2, max_attempts=1,
+                               backoff_base_seconds=10, sweep_interval_seconds=0)
+
+    # Every iteration claims a batch of the busy broadcast, and the sweep still runs.
+    assert run(restarted) == 2
+    assert recipients(session_factory, stranded)[1][0] == "failed"
+    assert broadcast_status(session_factory, stranded) == "failed"
+    assert "attempts_exhausted" in event_types(session_factory, stranded)
+    assert broadcast_status(session_factory, busy) == "queued"
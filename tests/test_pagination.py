@@ -0,0 +1,30 @@
+import pytest
+from fastapi import HTTPException
+
+from routes.pagination import SCALAR, decode_cursor, encode_cursor
+
+
+def test_round_trip():
+    assert decode_cursor(encode_cursor("2026-01-01 10:00:00", 42), 2, (str, int)) == ["2026-01-01 10:00:00", 42]
+    assert decode_cursor(encode_cursor("id", "desc", None, 7), 4, (str, str, SCALAR, int)) == ["id", "desc", None, 7]
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    encode_cursor(1, 2),                  # wrong length
+    encode_cursor([1], 2, 3),             # nested list
+    encode_cursor({"id": 1}, 2, 3),       # object
+    encode_cursor(True, 2, 3),            # bool is not an int
+])
+def test_malformed_cursors_are_rejected(cursor):
+    with pytest.raises(HTTPException) as exc:
+        decode_cursor(cursor, 3)
+    assert (exc.value.status_code, exc.value.detail) == (400, "Invalid cursor")
+
+
+def test_values_are_checked_against_expected_types():
+    with pytest.raises(HTTPException):
+        decode_cursor(encode_cursor("2026-01-01", "7"), 2, (str, int))
+    with pytest.raises(HTTPException):
+        decode_cursor(encode_cursor(5.5), 1, (int,))
+    assert decode_cursor(encode_cursor(5), 1, (int,)) == [5]
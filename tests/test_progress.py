@@ -0,0 +1,45 @@
+import asyncio
+import threading
+
+from services.progress import ProgressHub
+
+
+def _subscribe_on_new_loop(hub: ProgressHub):
+    loop = asyncio.new_event_loop()
+
+    async def subscribe():
+        return hub.subscribe()
+
+    sub = loop.run_until_complete(subscribe())
+    return loop, sub
+
+
+def test_publish_drops_subscriber_whose_loop_closed():
+    hub = ProgressHub()
+    loop, _ = _subscribe_on_new_loop(hub)
+    loop.close()
+
+    done = threading.Event()
+
+    def publish():
+        hub.publish({1: {"sent": 1, "queued": -1}})
+        done.set()
+
+    threading.Thread(target=publish, daemon=True).start()
+    assert done.wait(timeout=5), "publish deadlocked on a closed subscriber"
+    assert hub.subscribers == 0
+    assert hub.seq == 1
+
+
+def test_publish_keeps_live_subscribers():
+    hub = ProgressHub()
+    dead_loop, _ = _subscribe_on_new_loop(hub)
+    dead_loop.close()
+    live_loop, live = _subscribe_on_new_loop(hub)
+    try:
+        hub.publish({7: {"delivered": 2}})
+        event = live_loop.run_until_complete(live.get(timeout=1))
+        assert (event.broadcast_id, event.deltas) == (7, {"delivered": 2})
+        assert hub.subscribers == 1
+    finally:
+        live_loop.close()
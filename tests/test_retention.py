@@ -0,0 +1,44 @@
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from database.connection import Base
+from database.models import Message, SyncChange, User
+from services.retention import RetentionJob, RetentionPolicy
+
+
+def test_compact_sync_log_keeps_latest_entry_per_row_across_batches(session_factory):
+    db = session_factory()
+    for entity_id in (1, 2, 3, 1, 2, 1):
+        db.add(SyncChange(entity="broadcast", entity_id=entity_id))
+    db.commit()
+
+    job = RetentionJob(RetentionPolicy(batch_size=2, pause_seconds=0), session_factory)
+    assert job.compact_sync_log(db) == 3
+    assert [(c.seq, c.entity_id) for c in db.query(SyncChange).order_by(SyncChange.seq)] == [
+        (3, 3), (5, 2), (6, 1),
+    ]
+    db.close()
+
+
+def test_incremental_vacuum_empties_the_freelist_in_steps(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'vacuum.db'}")
+    with engine.connect() as conn:
+        conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.exec_driver_sql("VACUUM")
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine)
+
+    db = session_factory()
+    db.add(User(id=1, email="a@example.com", password_hash="x"))
+    db.add_all(Message(sender_id=1, body="x" * 2000) for _ in range(500))
+    db.commit()
+    db.query(Message).delete()
+    db.commit()
+    free = db.execute(text("PRAGMA freelist_count")).scalar()
+    assert free > 50
+
+    job = RetentionJob(RetentionPolicy(vacuum_pages=50, pause_seconds=0), session_factory)
+    assert job.incremental_vacuum(db) == free
+    assert db.execute(text("PRAGMA freelist_count")).scalar() == 0
+    db.close()
+    engine.dispose()
@@ -0,0 +1,39 @@
+import io
+
+import pytest
+
+from database.models import User
+from services.passwords import password_hasher
+from services.user_import import ImportBusyError, UserImporter
+
+
+@pytest.fixture
+def importer(session_factory, monkeypatch):
+    monkeypatch.setattr(password_hasher, "rounds", 4)
+    importer = UserImporter(hash_workers=1, batch_size=100, session_factory=session_factory)
+    yield importer
+    importer.shutdown()
+
+
+def test_undecodable_file_reports_rows_already_imported(importer, session_factory):
+    # Long enough that the text layer decodes several chunks before reaching the bad bytes.
+    good = "username,email,password\n" + "".join(f"user{i},user{i}@example.com,secret{i}\n" for i in range(1000))
+    data = good.encode() + b"broken,\xff\xfe@example.com,secret\n"
+
+    result = importer.run_binary(io.BytesIO(data)).as_dict()
+
+    assert 0 < result["created"] == result["rows"] < 1000
+    assert result["stopped"] == f"CSV must be UTF-8 encoded; stopped after {result['rows']} rows"
+    db = session_factory()
+    assert db.query(User).count() == result["created"]
+    db.close()
+
+
+def test_second_concurrent_import_is_refused(importer):
+    assert importer._slots.acquire(blocking=False)
+    try:
+        with pytest.raises(ImportBusyError):
+            importer.run(["username,email,password\n"])
+    finally:
+        importer._slots.release()
+    assert importer.run(["username,email,password\n"]).as_dict()["stopped"] is None